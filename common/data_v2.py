@@ -17,9 +17,11 @@ As a rule of thumb:
 """
 
 
+import dataclasses
 import datetime as dt
+import numpy as np
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from common import constants
 from common.data import (
@@ -121,3 +123,44 @@ class ScorableMinerIndex(BaseModel):
         max_items=constants.DATA_ENTITY_BUCKET_COUNT_LIMIT_PER_MINER_INDEX_PROTOCOL_3,
     )
     last_updated: dt.datetime = Field(description="Time last updated in UTC.")
+
+
+@dataclasses.dataclass(frozen=True)
+class ScorableBuckets:
+    """The scorable buckets of a miner's index as columns, one element per bucket.
+
+    Used to score every miner at once, where building a ScorableDataEntityBucket for each of millions of buckets would
+    be too slow. Labels are stored once in labels and referenced from label_ids.
+    """
+
+    time_bucket_ids: np.ndarray
+    sources: np.ndarray
+    label_ids: np.ndarray
+    scorable_bytes: np.ndarray
+
+    # The label of each label id in label_ids, or None for buckets without a label.
+    labels: Dict[int, Optional[str]]
+
+    @classmethod
+    def from_scorable_data_entity_buckets(
+        cls, buckets: List[ScorableDataEntityBucket]
+    ) -> "ScorableBuckets":
+        label_ids = {}
+        for bucket in buckets:
+            label_ids.setdefault(bucket.label, len(label_ids))
+
+        return cls(
+            time_bucket_ids=np.array(
+                [bucket.time_bucket_id for bucket in buckets], dtype=np.int64
+            ),
+            sources=np.array(
+                [int(bucket.source) for bucket in buckets], dtype=np.int64
+            ),
+            label_ids=np.array(
+                [label_ids[bucket.label] for bucket in buckets], dtype=np.int64
+            ),
+            scorable_bytes=np.array(
+                [bucket.scorable_bytes for bucket in buckets], dtype=np.int64
+            ),
+            labels={label_id: label for label, label_id in label_ids.items()},
+        )
@@ -92,5 +92,15 @@ class GetDataEntityBucket(BaseProtocol):
         default_factory=list,
     )
 
+    def json_with_serialized_data_entities(self, data_entities_serialized: str) -> str:
+        """Serializes the synapse to json, using the provided already serialized json list as data_entities.
+
+        Lets a miner send DataEntities serialized straight from storage, without building a DataEntity for each.
+        """
+        synapse_serialized = self.json(exclude={"data_entities"})
+        return (
+            f'{synapse_serialized[:-1]}, "data_entities": {data_entities_serialized}}}'
+        )
+
 
 # TODO Protocol for Users to Query Data which will accept query parameters such as a startDatetime, endDatetime.
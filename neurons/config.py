@@ -102,6 +102,20 @@ def add_args(neuron_type: NeuronType, parser):
         default=False,
     )
 
+    parser.add_argument(
+        "--neuron.storage_metrics",
+        action="store_true",
+        help="If set, records latency histograms, row counts and bytes for every storage operation and logs them periodically.",
+        default=False,
+    )
+
+    parser.add_argument(
+        "--neuron.storage_metrics_file",
+        type=str,
+        help="A file to also append the storage metrics to as json lines. Requires --neuron.storage_metrics.",
+        default=None,
+    )
+
     if neuron_type == NeuronType.VALIDATOR:
         parser.add_argument(
             "--neuron.axon_off",
@@ -112,6 +126,25 @@ def add_args(neuron_type: NeuronType, parser):
             help="Set this flag to not attempt to serve an Axon.",
             default=False,
         )
+        parser.add_argument(
+            "--neuron.storage_backend",
+            type=str,
+            choices=["sqlite", "numpy"],
+            help="The storage backend for miner indexes. numpy keeps each miner's index in NumPy arrays.",
+            default="sqlite",
+        )
+        parser.add_argument(
+            "--neuron.storage_snapshot_minutes",
+            type=int,
+            help="How often to snapshot miner indexes to disk, in minutes. The latest snapshot is loaded on startup. 0 disables snapshots.",
+            default=30,
+        )
+        parser.add_argument(
+            "--neuron.score_refresh_minutes",
+            type=int,
+            help="How often to rescore every miner against the current indexes on a background thread, in minutes. 0 disables refreshes.",
+            default=20,
+        )
         parser.add_argument(
             "--wandb.off",
             action="store_true",
@@ -123,10 +156,34 @@ def add_args(neuron_type: NeuronType, parser):
         parser.add_argument(
             "--neuron.database_name",
             type=str,
-            help="The name of the database.",
+            help="The name of the database. For the partitioned_sqlite and segment_log backends, the directory to store files in.",
             default="SqliteMinerStorage.sqlite",
         )
 
+        parser.add_argument(
+            "--neuron.storage_backend",
+            type=str,
+            choices=["sqlite", "partitioned_sqlite", "segment_log"],
+            help="The storage backend to use. partitioned_sqlite stores each time partition in its own SQLite file. "
+            + "segment_log appends data to one log file per time bucket, indexed in memory.",
+            default="sqlite",
+        )
+
+        parser.add_argument(
+            "--neuron.partition_hours",
+            type=int,
+            help="The number of hours of data stored in each partition of the partitioned_sqlite backend.",
+            default=24,
+        )
+
+        parser.add_argument(
+            "--neuron.segment_log_sync_on_close_only",
+            action="store_true",
+            help="If set, the segment_log backend only syncs stores to disk on shutdown. Stores are faster, but a "
+            + "power loss can lose the most recent ones.",
+            default=False,
+        )
+
         parser.add_argument(
             "--neuron.max_database_size_gb_hint",
             type=int,
@@ -136,6 +193,49 @@ def add_args(neuron_type: NeuronType, parser):
             default=250,
         )
 
+        parser.add_argument(
+            "--neuron.content_codec",
+            type=str,
+            choices=["none", "zlib", "zstd"],
+            help="The codec used to compress newly stored content. zstd requires the zstandard package.",
+            default="none",
+        )
+
+        parser.add_argument(
+            "--neuron.index_refresh_seconds",
+            type=int,
+            help="How often to rebuild the cached miner index served to validators, in seconds.",
+            default=300,
+        )
+
+        parser.add_argument(
+            "--neuron.index_refresh_writes",
+            type=int,
+            help="Rebuild the cached miner index early after this many writes to storage. 0 disables early rebuilds.",
+            default=100,
+        )
+
+        parser.add_argument(
+            "--neuron.ingestion_queue_size",
+            type=int,
+            help="The maximum number of scraped batches waiting to be written to storage before scrapers are paused.",
+            default=100,
+        )
+
+        parser.add_argument(
+            "--neuron.bucket_cache_size_mb",
+            type=int,
+            help="The memory budget for serialized DataEntityBuckets cached to serve repeated requests, in MB. 0 disables the cache.",
+            default=256,
+        )
+
+        parser.add_argument(
+            "--neuron.retention_sweep_minutes",
+            type=int,
+            help="How often to delete data older than the age limit from storage, in minutes. 0 disables the sweeps.",
+            default=60,
+        )
+
         root_dir = Path(os.path.dirname(__file__)).parent
         default_file = os.path.join(
             os.path.join(root_dir, "scraping/config/scraping_config.json"),
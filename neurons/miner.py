@@ -24,14 +24,24 @@ import traceback
 import typing
 import bittensor as bt
 import datetime as dt
+from fastapi import Response
 from common import constants, utils
-from common.data import CompressedMinerIndex
 from common.protocol import GetDataEntityBucket, GetMinerIndex
 from neurons.config import NeuronType
 from scraping.config.config_reader import ConfigReader
 from scraping.coordinator import ScraperCoordinator
 from scraping.provider import ScraperProvider
+from storage.miner.bucket_cache import DataEntityBucketCache
+from storage.miner.compressed_index_cache import CompressedIndexCache
+from storage.miner.content_codec import ContentCodec
+from storage.miner.ingestion_queue import IngestionQueue
+from storage.miner.partitioned_sqlite_miner_storage import (
+    PartitionedSqliteMinerStorage,
+)
+from storage.miner.retention_sweeper import RetentionSweeper
+from storage.miner.segment_log_miner_storage import SegmentLogMinerStorage
 from storage.miner.sqlite_miner_storage import SqliteMinerStorage
+from storage.storage_metrics import MINER_STORAGE_OPERATIONS, StorageMetrics
 
 from neurons.base_neuron import BaseNeuron
 
@@ -65,15 +75,73 @@ class Miner(BaseNeuron):
         self.lock = threading.RLock()
 
         # Instantiate storage.
-        self.storage = SqliteMinerStorage(
-            self.config.neuron.database_name,
-            self.config.neuron.max_database_size_gb_hint,
-        )
+        content_codec = ContentCodec[self.config.neuron.content_codec.upper()]
+        if self.config.neuron.storage_backend == "partitioned_sqlite":
+            self.storage = PartitionedSqliteMinerStorage(
+                self.config.neuron.database_name,
+                self.config.neuron.max_database_size_gb_hint,
+                self.config.neuron.partition_hours,
+                content_codec,
+            )
+        elif self.config.neuron.storage_backend == "segment_log":
+            self.storage = SegmentLogMinerStorage(
+                self.config.neuron.database_name,
+                self.config.neuron.max_database_size_gb_hint,
+                content_codec,
+                sync_every_store=not self.config.neuron.segment_log_sync_on_close_only,
+            )
+        else:
+            self.storage = SqliteMinerStorage(
+                self.config.neuron.database_name,
+                self.config.neuron.max_database_size_gb_hint,
+                content_codec,
+            )
 
         bt.logging.success(
             f"Successfully connected to miner storage: {self.config.neuron.database_name}."
         )
 
+        self.storage_metrics = None
+        if self.config.neuron.storage_metrics:
+            self.storage_metrics = StorageMetrics("miner_storage")
+            self.storage_metrics.instrument(self.storage, MINER_STORAGE_OPERATIONS)
+
+        # Keep the serialized index ready to serve for each supported protocol version.
+        self.index_cache = CompressedIndexCache(
+            storage=self.storage,
+            bucket_count_limits=[
+                constants.DATA_ENTITY_BUCKET_COUNT_LIMIT_PER_MINER_INDEX,
+                constants.DATA_ENTITY_BUCKET_COUNT_LIMIT_PER_MINER_INDEX_PROTOCOL_3,
+            ],
+            refresh_interval=dt.timedelta(
+                seconds=self.config.neuron.index_refresh_seconds
+            ),
+            refresh_after_writes=self.config.neuron.index_refresh_writes,
+        )
+        self.storage.add_write_listener(self.index_cache.on_write)
+
+        # Cache serialized buckets, since several validators often request the same large bucket.
+        self.bucket_cache = DataEntityBucketCache(
+            max_size_bytes=utils.mb_to_bytes(self.config.neuron.bucket_cache_size_mb)
+        )
+        self.storage.add_write_listener(self.bucket_cache.on_write)
+
+        # Write scraped data to storage on a dedicated thread, batching scrapes into larger transactions.
+        self.ingestion_queue = IngestionQueue(
+            storage=self.storage,
+            max_queued_batches=self.config.neuron.ingestion_queue_size,
+        )
+
+        # Delete expired data on a schedule, rather than only once storage is full.
+        self.retention_sweeper = None
+        if self.config.neuron.retention_sweep_minutes > 0:
+            self.retention_sweeper = RetentionSweeper(
+                storage=self.storage,
+                sweep_interval=dt.timedelta(
+                    minutes=self.config.neuron.retention_sweep_minutes
+                ),
+            )
+
         # Configure the ScraperCoordinator
         bt.logging.info(
             f"Loading scraping config from {self.config.neuron.scraping_config_file}."
@@ -87,6 +155,7 @@ class Miner(BaseNeuron):
             scraper_provider=ScraperProvider(),
             miner_storage=self.storage,
             config=scraping_config,
+            ingestion_queue=self.ingestion_queue,
         )
 
         # Configure per hotkey request limits.
@@ -117,6 +186,10 @@ class Miner(BaseNeuron):
 
         bt.logging.success(f"Miner starting at block: {self.block}.")
 
+        self.index_cache.run_in_background_thread()
+        self.ingestion_queue.run_in_background_thread()
+        if self.retention_sweeper:
+            self.retention_sweeper.run_in_background_thread()
         self.scraping_coordinator.run_in_background_thread()
 
         # This loop maintains the miner's operations until intentionally stopped.
@@ -143,6 +216,10 @@ class Miner(BaseNeuron):
         except KeyboardInterrupt:
             self.axon.stop()
             self.scraping_coordinator.stop()
+            self.ingestion_queue.stop()
+            if self.retention_sweeper:
+                self.retention_sweeper.stop()
+            self.index_cache.stop()
             bt.logging.success("Miner killed by keyboard interrupt.")
             sys.exit()
 
@@ -251,6 +328,37 @@ class Miner(BaseNeuron):
         )
         bt.logging.info(log)
 
+        ingestion_metrics = self.ingestion_queue.get_metrics()
+        bt.logging.info(
+            f"Ingestion queue depth:{ingestion_metrics.queue_depth} | "
+            f"Commits:{ingestion_metrics.commits} | "
+            f"Entities committed:{ingestion_metrics.entities_committed} | "
+            f"Entities dropped:{ingestion_metrics.entities_dropped} | "
+            f"Last commit latency:{ingestion_metrics.last_commit_latency} | "
+            f"Average commit latency:{ingestion_metrics.average_commit_latency} | "
+            f"Max commit latency:{ingestion_metrics.max_commit_latency}"
+        )
+
+        bucket_cache_metrics = self.bucket_cache.get_metrics()
+        bt.logging.info(
+            f"Bucket cache entries:{bucket_cache_metrics.entries} | "
+            f"Size bytes:{bucket_cache_metrics.size_bytes} | "
+            f"Hits:{bucket_cache_metrics.hits} | "
+            f"Misses:{bucket_cache_metrics.misses}"
+        )
+
+        if self.retention_sweeper:
+            retention_metrics = self.retention_sweeper.get_metrics()
+            bt.logging.info(
+                f"Retention sweeps:{retention_metrics.sweeps} | "
+                f"Content bytes cleared:{retention_metrics.content_bytes_cleared} | "
+                f"Database bytes reclaimed:{retention_metrics.database_bytes_reclaimed} | "
+                f"Last sweep latency:{retention_metrics.last_sweep_latency}"
+            )
+
+        if self.storage_metrics:
+            self.storage_metrics.report(self.config.neuron.storage_metrics_file)
+
     async def get_index(self, synapse: GetMinerIndex) -> GetMinerIndex:
         """Runs after the GetMinerIndex synapse has been deserialized (i.e. after synapse.data is available)."""
         bt.logging.info(
@@ -258,21 +366,24 @@ class Miner(BaseNeuron):
         )
 
         if synapse.version and synapse.version >= 2:
-            # List all the data entity buckets that this miner currently has.
-            compressed_index = None
             # Return the appropriate amount of max buckets based on protocol of the requesting validator.
-            if synapse.version == 3:
-                compressed_index = self.storage.get_compressed_index(
-                    bucket_count_limit=constants.DATA_ENTITY_BUCKET_COUNT_LIMIT_PER_MINER_INDEX_PROTOCOL_3
-                )
-            else:
-                compressed_index = self.storage.get_compressed_index(
-                    bucket_count_limit=constants.DATA_ENTITY_BUCKET_COUNT_LIMIT_PER_MINER_INDEX
-                )
-            synapse.compressed_index_serialized = compressed_index.json()
+            bucket_count_limit = (
+                constants.DATA_ENTITY_BUCKET_COUNT_LIMIT_PER_MINER_INDEX_PROTOCOL_3
+                if synapse.version == 3
+                else constants.DATA_ENTITY_BUCKET_COUNT_LIMIT_PER_MINER_INDEX
+            )
+
+            # Serve the pre-serialized index, only building it here if the cache is not ready yet.
+            cached_index = self.index_cache.get(bucket_count_limit)
+            if cached_index is None:
+                bt.logging.debug("Compressed index cache not ready. Building index.")
+                self.index_cache.refresh()
+                cached_index = self.index_cache.get(bucket_count_limit)
+
+            synapse.compressed_index_serialized = cached_index.serialized
             bt.logging.success(
-                f"Returning compressed miner index of {CompressedMinerIndex.size_bytes(compressed_index)} bytes "
-                + f"across {CompressedMinerIndex.bucket_count(compressed_index)} buckets to {synapse.dendrite.hotkey}."
+                f"Returning compressed miner index of {cached_index.size_bytes} bytes "
+                + f"across {cached_index.bucket_count} buckets to {synapse.dendrite.hotkey}."
             )
         else:
             synapse.data_entity_buckets = self.storage.list_data_entity_buckets()
@@ -299,25 +410,31 @@ class Miner(BaseNeuron):
     async def get_index_priority(self, synapse: GetMinerIndex) -> float:
         return self.default_priority(synapse)
 
-    async def get_data_entity_bucket(
-        self, synapse: GetDataEntityBucket
-    ) -> GetDataEntityBucket:
+    async def get_data_entity_bucket(self, synapse: GetDataEntityBucket) -> Response:
         """Runs after the GetDataEntityBucket synapse has been deserialized (i.e. after synapse.data is available)."""
         bt.logging.info(
             f"Got to a GetDataEntityBucket request from {synapse.dendrite.hotkey} for Bucket ID: {str(synapse.data_entity_bucket_id)}."
         )
 
-        # List all the data entities that this miner has for the requested DataEntityBucket.
-        synapse.data_entities = self.storage.list_data_entities_in_data_entity_bucket(
-            synapse.data_entity_bucket_id
+        # Serialize all the data entities that this miner has for the requested DataEntityBucket straight from storage,
+        # unless the bucket is already cached.
+        data_entities = self.bucket_cache.get_or_load(
+            synapse.data_entity_bucket_id,
+            self.storage.get_serialized_data_entities_in_data_entity_bucket,
         )
         synapse.version = constants.PROTOCOL_VERSION
 
         bt.logging.success(
-            f"Returning Bucket ID: {str(synapse.data_entity_bucket_id)} with {len(synapse.data_entities)} entities to {synapse.dendrite.hotkey}."
+            f"Returning Bucket ID: {str(synapse.data_entity_bucket_id)} with {data_entities.count} entities to {synapse.dendrite.hotkey}."
         )
 
-        return synapse
+        # Return the serialized synapse as is, rather than having it validated and serialized again per DataEntity.
+        return Response(
+            content=synapse.json_with_serialized_data_entities(
+                data_entities.serialized
+            ),
+            media_type="application/json",
+        )
 
     async def get_data_entity_bucket_blacklist(
         self, synapse: GetDataEntityBucket
@@ -43,9 +43,12 @@ from neurons.config import NeuronType
 from rewards.data_value_calculator import DataValueCalculator
 from scraping.provider import ScraperProvider
 from scraping.scraper import ScraperId, ValidationResult
+from storage.validator.numpy_validator_storage import NumpyValidatorStorage
 from storage.validator.sqlite_memory_validator_storage import (
     SqliteMemoryValidatorStorage,
 )
+from storage.storage_metrics import VALIDATOR_STORAGE_OPERATIONS, StorageMetrics
+from storage.validator.storage_snapshotter import StorageSnapshotter
 from storage.validator.validator_storage import ValidatorStorage
 from vali_utils.miner_iterator import MinerIterator
 from vali_utils import utils as vali_utils
@@ -87,6 +90,12 @@ class Validator(BaseNeuron):
 
         # Setup storage in setup()
         self.storage: ValidatorStorage = None
+        self.storage_metrics: StorageMetrics = None
+        self.storage_snapshotter: StorageSnapshotter = None
+
+        # Rescores every miner on a background thread, started in setup().
+        self.score_refresh_thread: threading.Thread = None
+        self.score_refresh_stop_event = threading.Event()
 
         # Instantiate runners
         self.should_exit: bool = False
@@ -414,11 +423,40 @@ class Validator(BaseNeuron):
         bt.logging.info("Setting up validator.")
 
         # Setup the DB.
-        self.storage = SqliteMemoryValidatorStorage()
+        if self.config.neuron.storage_backend == "numpy":
+            self.storage = NumpyValidatorStorage()
+        else:
+            self.storage = SqliteMemoryValidatorStorage()
+        self.storage_metrics = None
+        if self.config.neuron.storage_metrics:
+            self.storage_metrics = StorageMetrics("validator_storage")
+            self.storage_metrics.instrument(self.storage, VALIDATOR_STORAGE_OPERATIONS)
+
+        # Restore miner indexes from the latest snapshot, rather than waiting hours to re-poll every miner.
+        self.storage_snapshotter = None
+        if self.config.neuron.storage_snapshot_minutes > 0:
+            self.storage_snapshotter = StorageSnapshotter(
+                storage=self.storage,
+                path=os.path.join(
+                    self.config.neuron.full_path,
+                    f"validator_storage.{self.config.neuron.storage_backend}.snapshot",
+                ),
+                snapshot_interval=dt.timedelta(
+                    minutes=self.config.neuron.storage_snapshot_minutes
+                ),
+            )
+            self.storage_snapshotter.load()
+            self.storage_snapshotter.run_in_background_thread()
 
         # Load any state from previous runs.
         self.load_state()
 
+        if self.config.neuron.score_refresh_minutes > 0:
+            self.score_refresh_thread = threading.Thread(
+                target=self._run_score_refresh, daemon=True
+            )
+            self.score_refresh_thread.start()
+
         # TODO: Configure this to expose access to data to neurons on certain subnets.
         # Serve axon to enable external connections.
         if not self.config.neuron.axon_off:
@@ -490,6 +528,9 @@ class Validator(BaseNeuron):
                 # Maybe sync the metagraph and potentially set weights.
                 self.sync()
 
+                if self.storage_metrics:
+                    self.storage_metrics.report(self.config.neuron.storage_metrics_file)
+
                 self.step += 1
 
                 wait_time = max(
@@ -577,6 +618,15 @@ class Validator(BaseNeuron):
             self.should_exit = True
             self.thread.join(5)
             self.is_running = False
+            self.score_refresh_stop_event.set()
+            if self.storage_snapshotter:
+                self.storage_snapshotter.stop()
+                try:
+                    self.storage_snapshotter.snapshot()
+                except Exception:
+                    bt.logging.error(
+                        f"Failed to snapshot the validator storage: {traceback.format_exc()}"
+                    )
             if self.wandb_run:
                 self.wandb_run.finish()
             bt.logging.debug("Stopped.")
@@ -656,6 +706,36 @@ class Validator(BaseNeuron):
 
         bt.logging.success("Finished setting weights.")
 
+    def _run_score_refresh(self):
+        """Blocking call to rescore every miner every score_refresh_minutes until the validator stops."""
+        interval = dt.timedelta(minutes=self.config.neuron.score_refresh_minutes)
+        while not self.score_refresh_stop_event.wait(timeout=interval.total_seconds()):
+            self._refresh_miner_scores()
+
+    def _refresh_miner_scores(self):
+        """Rescores every miner against the current indexes, reading one miner's buckets at a time."""
+        start = dt.datetime.now()
+        with self.lock:
+            hotkeys = list(self.metagraph.hotkeys)
+
+        for uid, hotkey in enumerate(hotkeys):
+            if self.score_refresh_stop_event.is_set():
+                return
+
+            try:
+                buckets = self.storage.read_scorable_buckets(hotkey)
+                if buckets is not None:
+                    self.scorer.on_miner_index_refreshed(uid, buckets)
+            except Exception:
+                # The miner keeps the score of its latest evaluation.
+                bt.logging.error(
+                    f"Failed to refresh the score of miner {uid}: {traceback.format_exc()}"
+                )
+
+        bt.logging.info(
+            f"Refreshed the scores of {len(hotkeys)} miners in {dt.datetime.now() - start}."
+        )
+
     def resync_metagraph(self):
         """Resyncs the metagraph and updates the hotkeys and moving averages based on the new metagraph."""
         bt.logging.info("Attempting to resync the metagraph.")
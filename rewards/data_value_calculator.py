@@ -1,7 +1,8 @@
 import datetime as dt
 from typing import Optional
+import numpy as np
 from common.data import DataLabel, DataSource, TimeBucket
-from common.data_v2 import ScorableDataEntityBucket
+from common.data_v2 import ScorableBuckets, ScorableDataEntityBucket
 from rewards.data import DataDesirabilityLookup
 
 from rewards import data_desirability_lookup
@@ -41,6 +42,39 @@ class DataValueCalculator:
             * scorable_data_entity_bucket.scorable_bytes
         )
 
+    def get_score_for_scorable_buckets(
+        self, scorable_buckets: ScorableBuckets
+    ) -> float:
+        """Returns the total score of the buckets, scoring each as get_score_for_data_entity_bucket does.
+
+        Vectorized over the buckets, so the scale factor of each source and label is only looked up once.
+        """
+        if len(scorable_buckets.scorable_bytes) == 0:
+            return 0.0
+
+        # Scale factors are looked up for each distinct (source, label id) pair.
+        pairs, inverse = np.unique(
+            (scorable_buckets.sources.astype(np.int64) << 32)
+            | scorable_buckets.label_ids.astype(np.int64),
+            return_inverse=True,
+        )
+        data_type_scale_factors = np.empty(len(pairs))
+        for i, pair in enumerate(pairs.tolist()):
+            label = scorable_buckets.labels[pair & 0xFFFFFFFF]
+            data_type_scale_factors[i] = self._scale_factor_for_source_and_label(
+                DataSource(pair >> 32),
+                DataLabel(value=label.casefold()) if label else None,
+            )
+
+        time_scalars = self._scale_factors_for_ages(scorable_buckets.time_bucket_ids)
+        return float(
+            np.sum(
+                data_type_scale_factors[inverse]
+                * time_scalars
+                * scorable_buckets.scorable_bytes
+            )
+        )
+
     def _scale_factor_for_source_and_label(
         self, data_source: DataSource, label: Optional[DataLabel]
     ) -> float:
@@ -67,3 +101,15 @@ class DataValueCalculator:
         if data_age_in_hours > self.model.max_age_in_hours:
             return 0.0
         return 1.0 - (data_age_in_hours / (2 * self.model.max_age_in_hours))
+
+    def _scale_factors_for_ages(self, time_bucket_ids: np.ndarray) -> np.ndarray:
+        """Returns the score scalar of each time bucket, as _scale_factor_for_age does."""
+        now = dt.datetime.now(tz=dt.timezone.utc).timestamp()
+        data_ages_in_hours = np.maximum(
+            0, (now - time_bucket_ids.astype(np.float64) * 3600) // 3600
+        )
+        return np.where(
+            data_ages_in_hours > self.model.max_age_in_hours,
+            0.0,
+            1.0 - (data_ages_in_hours / (2 * self.model.max_age_in_hours)),
+        )
@@ -4,7 +4,7 @@ import torch
 import bittensor as bt
 from common import constants
 
-from common.data_v2 import ScorableMinerIndex
+from common.data_v2 import ScorableBuckets, ScorableMinerIndex
 from rewards.data_value_calculator import DataValueCalculator
 from scraping.scraper import ValidationResult
 
@@ -32,6 +32,10 @@ class MinerScorer:
         self.miner_credibility = torch.full(
             (num_neurons, 1), MinerScorer.STARTING_CREDIBILITY, dtype=torch.float32
         )
+        # The score of each miner before its latest evaluation, and whether that evaluation scored an index, so the
+        # latest evaluation can be rescored as other miners' indexes change.
+        self.previous_scores = torch.zeros(num_neurons, dtype=torch.float32)
+        self.has_scored_index = torch.zeros(num_neurons, dtype=torch.bool)
         self.value_calculator = value_calculator
         self.alpha = alpha
 
@@ -45,6 +49,8 @@ class MinerScorer:
             {
                 "scores": self.scores,
                 "credibility": self.miner_credibility,
+                "previous_scores": self.previous_scores,
+                "has_scored_index": self.has_scored_index,
             },
             filepath,
         )
@@ -54,6 +60,11 @@ class MinerScorer:
         state = torch.load(filepath)
         self.scores = state["scores"]
         self.miner_credibility = state["credibility"]
+        # Older state files don't track the latest evaluation, so wait for the next one before rescoring.
+        self.previous_scores = state.get("previous_scores", self.scores.clone())
+        self.has_scored_index = state.get(
+            "has_scored_index", torch.zeros(self.scores.size(0), dtype=torch.bool)
+        )
 
     def get_scores(self) -> torch.Tensor:
         """Returns the raw scores of all miners."""
@@ -72,6 +83,8 @@ class MinerScorer:
         with self.lock:
             self.scores[uid] = 0.0
             self.miner_credibility[uid] = MinerScorer.STARTING_CREDIBILITY
+            self.previous_scores[uid] = 0.0
+            self.has_scored_index[uid] = False
 
     def get_miner_credibility(self, uid: int) -> float:
         """Returns the credibility of miner 'uid'."""
@@ -105,6 +118,12 @@ class MinerScorer:
             self.scores = torch.cat(
                 [self.scores, torch.zeros(to_add, dtype=torch.float32)]
             )
+            self.previous_scores = torch.cat(
+                [self.previous_scores, torch.zeros(to_add, dtype=torch.float32)]
+            )
+            self.has_scored_index = torch.cat(
+                [self.has_scored_index, torch.zeros(to_add, dtype=torch.bool)]
+            )
             self.miner_credibility = torch.cat(
                 [
                     self.miner_credibility,
@@ -138,22 +157,55 @@ class MinerScorer:
                 # First, update the miner's credibilty
                 self._update_credibility(uid, validation_results)
 
-                # Now score the miner based on the amount of data it has, scaled based on
-                # the reward distribution.
-                for bucket in index.scorable_data_entity_buckets:
-                    score += self.value_calculator.get_score_for_data_entity_bucket(
-                        bucket
-                    )
-
-                # Scale the miner's score by its credibility, squared.
-                score *= self.miner_credibility[uid] ** 2
+                # Now score the miner based on the amount of data it has.
+                score = self._score_index(uid, index)
 
             self._update_score(uid, score)
+            self.has_scored_index[uid] = index is not None
 
             bt.logging.success(
                 f"Evaluated Miner {uid}. Score={self.scores[uid].item()}. Credibility={self.miner_credibility[uid].item()}."
             )
 
+    def on_miner_index_refreshed(self, uid: int, buckets: ScorableBuckets) -> None:
+        """Rescores the latest evaluation of the miner against its freshly scored buckets.
+
+        A miner's scorable bytes shrink or grow as other miners change their indexes, so rescoring every miner
+        periodically keeps the scores in line with the current indexes. Credibility is left untouched.
+
+        Args:
+            uid (int): The miner's UID.
+            buckets (ScorableBuckets): The miner's latest scorable buckets.
+        """
+        # Value the buckets before taking the lock, so evaluations are not blocked behind it.
+        value = self.value_calculator.get_score_for_scorable_buckets(buckets)
+
+        with self.lock:
+            # Only rescore miners whose latest evaluation scored an index.
+            if uid >= self.scores.size(0) or not self.has_scored_index[uid]:
+                return
+
+            previous_score = self.scores[uid].item()
+            self.scores[uid] = self.previous_scores[uid]
+            # Scale the miner's score by its credibility, squared.
+            self._update_score(uid, value * self.miner_credibility[uid] ** 2)
+
+            bt.logging.trace(
+                f"Refreshed Miner {uid}. Score={previous_score} -> {self.scores[uid].item()}."
+            )
+
+    def _score_index(self, uid: int, index: ScorableMinerIndex) -> float:
+        """Scores the miner's index based on the amount of data it has, scaled by the reward distribution.
+
+        Requires: self.lock is held.
+        """
+        score = 0.0
+        for bucket in index.scorable_data_entity_buckets:
+            score += self.value_calculator.get_score_for_data_entity_bucket(bucket)
+
+        # Scale the miner's score by its credibility, squared.
+        return score * self.miner_credibility[uid] ** 2
+
     def _update_credibility(self, uid: int, validation_results: List[ValidationResult]):
         """Updates the miner's credibility based on the most recent set of validation_results.
 
@@ -193,6 +245,7 @@ class MinerScorer:
 
         Requires: self.lock is held.
         """
+        self.previous_scores[uid] = self.scores[uid]
         new_score = self.alpha * reward + (1 - self.alpha) * self.scores[uid]
 
         # If the score is over the growth limit threshold then ensure it isn't growing faster than the percent limit.
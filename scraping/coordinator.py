@@ -12,6 +12,7 @@ from pydantic import Field, PositiveInt
 from common.data import DataLabel, DataSource, StrictBaseModel, TimeBucket
 from scraping.provider import ScraperProvider
 from scraping.scraper import ScrapeConfig, ScraperId
+from storage.miner.ingestion_queue import IngestionQueue
 from storage.miner.miner_storage import MinerStorage
 
 
@@ -144,9 +145,11 @@ class ScraperCoordinator:
         scraper_provider: ScraperProvider,
         miner_storage: MinerStorage,
         config: CoordinatorConfig,
+        ingestion_queue: Optional[IngestionQueue] = None,
     ):
         self.provider = scraper_provider
         self.storage = miner_storage
+        self.ingestion_queue = ingestion_queue
         self.config = config
 
         self.tracker = ScraperCoordinator.Tracker(self.config, dt.datetime.utcnow())
@@ -221,7 +224,15 @@ class ScraperCoordinator:
 
                 # Perform the scrape
                 data_entities = await scrape_fn()
-                self.storage.store_data_entities(data_entities)
+
+                # Store off the event loop so other workers keep scraping. Putting to a full ingestion queue
+                # blocks this worker until the writer catches up.
+                if self.ingestion_queue:
+                    await asyncio.to_thread(self.ingestion_queue.put, data_entities)
+                else:
+                    await asyncio.to_thread(
+                        self.storage.store_data_entities, data_entities
+                    )
                 self.queue.task_done()
             except Exception as e:
                 bt.logging.error("Worker " + name + ": " + traceback.format_exc())
@@ -0,0 +1,116 @@
+"""
+Benchmarks the CPU cost of serving a GetDataEntityBucket request.
+
+Compares the previous path, which builds DataEntity models, assigns them to the synapse and serializes the response
+the way FastAPI does, with serializing the rows straight from storage.
+
+Run it from the data-universe folder:
+    python -m scripts.benchmark_bucket_serving --entities 10000
+"""
+import argparse
+import datetime as dt
+import json
+import os
+import tempfile
+import time
+
+from fastapi.encoders import jsonable_encoder
+
+from common.data import (
+    DataEntity,
+    DataEntityBucketId,
+    DataLabel,
+    DataSource,
+    TimeBucket,
+)
+from common.protocol import GetDataEntityBucket
+from storage.miner.sqlite_miner_storage import SqliteMinerStorage
+
+
+def serve_with_models(
+    storage: SqliteMinerStorage, bucket_id: DataEntityBucketId
+) -> str:
+    synapse = GetDataEntityBucket(data_entity_bucket_id=bucket_id)
+    synapse.data_entities = storage.list_data_entities_in_data_entity_bucket(bucket_id)
+    # FastAPI validates the returned synapse against the response model before encoding it.
+    synapse = GetDataEntityBucket(**synapse.dict())
+    return json.dumps(jsonable_encoder(synapse))
+
+
+def serve_serialized(storage: SqliteMinerStorage, bucket_id: DataEntityBucketId) -> str:
+    synapse = GetDataEntityBucket(data_entity_bucket_id=bucket_id)
+    data_entities = storage.get_serialized_data_entities_in_data_entity_bucket(
+        bucket_id
+    )
+    return synapse.json_with_serialized_data_entities(data_entities.serialized)
+
+
+def time_serving(serve, storage, bucket_id, repeats: int) -> float:
+    """Returns the average CPU seconds taken to serve the bucket."""
+    start = time.process_time()
+    for _ in range(repeats):
+        serve(storage, bucket_id)
+    return (time.process_time() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--entities",
+        type=int,
+        default=10_000,
+        help="The number of DataEntities in the bucket.",
+    )
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=10,
+        help="The number of times to serve the bucket.",
+    )
+    args = parser.parse_args()
+
+    now = dt.datetime.now(tz=dt.timezone.utc)
+    bucket_id = DataEntityBucketId(
+        time_bucket=TimeBucket.from_datetime(now),
+        source=DataSource.X,
+        label=DataLabel(value="#bittensor"),
+    )
+    entities = [
+        DataEntity(
+            uri=f"https://example.com/{i}",
+            datetime=now,
+            source=DataSource.X,
+            label=DataLabel(value="#bittensor"),
+            content=json.dumps({"id": i, "text": "x" * 200}).encode(),
+            content_size_bytes=220,
+        )
+        for i in range(args.entities)
+    ]
+
+    with tempfile.TemporaryDirectory() as directory:
+        storage = SqliteMinerStorage(
+            os.path.join(directory, "benchmark.sqlite"), max_database_size_gb_hint=10
+        )
+        storage.store_data_entities(entities)
+
+        model_seconds = time_serving(
+            serve_with_models, storage, bucket_id, args.repeats
+        )
+        serialized_seconds = time_serving(
+            serve_serialized, storage, bucket_id, args.repeats
+        )
+        storage.close()
+
+    print(
+        json.dumps(
+            {
+                "entities": args.entities,
+                "model_cpu_seconds": model_seconds,
+                "serialized_cpu_seconds": serialized_seconds,
+            }
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Benchmarks each available content codec against real scraped payloads from a miner database.
+
+Reports compression and decompression throughput (of uncompressed bytes) and the compression ratio, so miners
+can choose a --neuron.content_codec that fits their CPU and disk budget.
+
+Run it from the data-universe folder:
+    python -m scripts.benchmark_content_codecs --database SqliteMinerStorage.sqlite
+"""
+import argparse
+import contextlib
+import json
+import sqlite3
+import time
+from typing import List
+
+from storage.miner import content_codec
+from storage.miner.content_codec import ContentCodec
+
+
+def load_payloads(database: str, sample_size: int) -> List[bytes]:
+    """Loads a random sample of uncompressed DataEntity contents from the miner database."""
+    with contextlib.closing(sqlite3.connect(database)) as connection:
+        cursor = connection.cursor()
+        cursor.execute(
+            "SELECT content, contentCodec FROM DataEntity ORDER BY RANDOM() LIMIT ?",
+            [sample_size],
+        )
+        return [
+            content_codec.decompress(content, ContentCodec(codec))
+            for content, codec in cursor
+        ]
+
+
+def benchmark_codec(codec: ContentCodec, payloads: List[bytes]) -> dict:
+    """Measures the compression ratio and throughput of the codec over the payloads."""
+    total_bytes = sum(len(payload) for payload in payloads)
+
+    start = time.perf_counter()
+    compressed = [content_codec.compress(payload, codec) for payload in payloads]
+    compress_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for payload in compressed:
+        content_codec.decompress(payload, codec)
+    decompress_seconds = time.perf_counter() - start
+
+    compressed_bytes = sum(len(payload) for payload in compressed)
+    return {
+        "codec": codec.name,
+        "ratio": total_bytes / compressed_bytes,
+        "compress_mb_per_second": total_bytes / 1024 / 1024 / compress_seconds,
+        "decompress_mb_per_second": total_bytes / 1024 / 1024 / decompress_seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--database",
+        type=str,
+        default="SqliteMinerStorage.sqlite",
+        help="The miner database to sample payloads from.",
+    )
+    parser.add_argument(
+        "--sample_size",
+        type=int,
+        default=10_000,
+        help="The number of DataEntities to sample.",
+    )
+    args = parser.parse_args()
+
+    payloads = load_payloads(args.database, args.sample_size)
+    if not payloads:
+        raise ValueError(f"No DataEntities found in {args.database}.")
+
+    print(
+        f"Benchmarking {len(payloads)} payloads totalling {sum(len(p) for p in payloads)} bytes."
+    )
+    for codec in ContentCodec:
+        if not content_codec.is_available(codec):
+            print(f"Skipping {codec.name}: not available.")
+            continue
+
+        print(json.dumps(benchmark_codec(codec, payloads)))
+
+
+if __name__ == "__main__":
+    main()
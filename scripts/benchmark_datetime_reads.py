@@ -0,0 +1,141 @@
+"""
+Benchmarks reading DataEntityBuckets with datetimes stored as text (as written by older miners) versus as integer
+epoch microseconds.
+
+Fills a temporary miner database with synthetic DataEntities, times bucket reads while every datetime is stored in
+its legacy text form, migrates the database and times the same reads again. Also times the datetime conversions on
+their own, including the previous tz_aware_timestamp_adapter.
+
+Run it from the data-universe folder:
+    python -m scripts.benchmark_datetime_reads --entities 100000
+"""
+import argparse
+import datetime as dt
+import json
+import os
+import tempfile
+import time
+
+from common.data import (
+    DataEntity,
+    DataEntityBucketId,
+    DataLabel,
+    DataSource,
+    TimeBucket,
+)
+from storage.miner.sqlite_miner_storage import (
+    SqliteMinerStorage,
+    datetime_to_epoch_micros,
+    epoch_micros_to_datetime,
+)
+from storage.validator.sqlite_memory_validator_storage import (
+    tz_aware_timestamp_adapter,
+)
+
+
+def time_bucket_reads(
+    storage: SqliteMinerStorage, bucket_ids: list, repeats: int
+) -> float:
+    """Returns the average seconds taken to read all of the buckets."""
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for bucket_id in bucket_ids:
+            storage.list_data_entities_in_data_entity_bucket(bucket_id)
+    return (time.perf_counter() - start) / repeats
+
+
+def time_conversion(convert, values: list) -> float:
+    """Returns the microseconds taken per value to convert the values."""
+    start = time.perf_counter()
+    for value in values:
+        convert(value)
+    return (time.perf_counter() - start) * 1_000_000 / len(values)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--entities",
+        type=int,
+        default=100_000,
+        help="The number of DataEntities to generate.",
+    )
+    parser.add_argument(
+        "--buckets",
+        type=int,
+        default=10,
+        help="The number of buckets to spread them across.",
+    )
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=5,
+        help="The number of times to read each bucket.",
+    )
+    args = parser.parse_args()
+
+    start = dt.datetime.now(tz=dt.timezone.utc)
+    entities = [
+        DataEntity(
+            uri=f"https://example.com/{i}",
+            datetime=start - dt.timedelta(hours=i % args.buckets, microseconds=i),
+            source=DataSource.REDDIT,
+            label=DataLabel(value="label"),
+            # Unique content, since entities with duplicate content are not stored.
+            content=i.to_bytes(8, "little") + bytes(92),
+            content_size_bytes=100,
+        )
+        for i in range(args.entities)
+    ]
+    bucket_ids = [
+        DataEntityBucketId(
+            time_bucket=TimeBucket.from_datetime(start - dt.timedelta(hours=i)),
+            source=DataSource.REDDIT,
+            label=DataLabel(value="label"),
+        )
+        for i in range(args.buckets)
+    ]
+
+    with tempfile.TemporaryDirectory() as directory:
+        storage = SqliteMinerStorage(
+            os.path.join(directory, "benchmark.sqlite"), max_database_size_gb_hint=10
+        )
+        storage.store_data_entities(entities)
+
+        # Rewrite every datetime to the text form older miners stored.
+        with storage.write_lock, storage.write_connection as connection:
+            connection.executemany(
+                "UPDATE DataEntity SET datetime = ? WHERE uri = ?",
+                [[str(entity.datetime), entity.uri] for entity in entities],
+            )
+        text_seconds = time_bucket_reads(storage, bucket_ids, args.repeats)
+
+        storage.migrate_legacy_datetimes()
+        epoch_seconds = time_bucket_reads(storage, bucket_ids, args.repeats)
+        storage.close()
+
+    text_values = [str(entity.datetime) for entity in entities]
+    epoch_values = [datetime_to_epoch_micros(entity.datetime) for entity in entities]
+    print(
+        json.dumps(
+            {
+                "entities": args.entities,
+                "text_bucket_reads_seconds": text_seconds,
+                "epoch_bucket_reads_seconds": epoch_seconds,
+                "tz_aware_timestamp_adapter_us": time_conversion(
+                    tz_aware_timestamp_adapter,
+                    [value.encode() for value in text_values],
+                ),
+                "fromisoformat_us": time_conversion(
+                    dt.datetime.fromisoformat, text_values
+                ),
+                "epoch_micros_to_datetime_us": time_conversion(
+                    epoch_micros_to_datetime, epoch_values
+                ),
+            }
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""
+Benchmarks miner storage under a realistic volume of synthetic DataEntities.
+
+Generates DataEntities with a realistic mix of sources, a long tail of labels and datetimes skewed towards the
+present, then measures:
+    - store_data_entities throughput and batch latency.
+    - get_compressed_index latency for each supported bucket count limit.
+    - Bucket read latency for buckets of various sizes, both as DataEntities and serialized for the wire.
+    - The time taken to clear the oldest tenth of the content.
+
+Results are printed as a single json object, and appended as a json line to --output if provided, so runs can be
+compared across commits.
+
+Run it from the data-universe folder:
+    python -m scripts.benchmark_miner_storage --entities 10000000 --output benchmarks.jsonl
+"""
+import argparse
+import datetime as dt
+import itertools
+import json
+import math
+import os
+import random
+import subprocess
+import tempfile
+import time
+from typing import Iterator, List
+
+from common import constants
+from common.data import DataEntity, DataEntityBucket, DataLabel, DataSource
+from storage.miner.content_codec import ContentCodec
+from storage.miner.miner_storage import MinerStorage
+from storage.miner.partitioned_sqlite_miner_storage import (
+    PartitionedSqliteMinerStorage,
+)
+from storage.miner.segment_log_miner_storage import SegmentLogMinerStorage
+from storage.miner.sqlite_miner_storage import SqliteMinerStorage
+
+# The share of DataEntities scraped from each source.
+SOURCE_WEIGHTS = {DataSource.X: 0.6, DataSource.REDDIT: 0.4}
+
+# The share of X DataEntities without a hashtag.
+UNLABELED_X_SHARE = 0.1
+
+# The average age of a DataEntity. Ages are exponentially distributed and capped at the bucket age limit.
+MEAN_AGE = dt.timedelta(days=3)
+
+# The median content size, with sizes log-normally distributed around it.
+MEDIAN_CONTENT_SIZE_BYTES = 600
+
+WORDS = ["bittensor", "subnet", "miner", "validator", "data", "the", "a", "of", "to"]
+
+
+def generate_data_entities(
+    count: int, label_count: int, seed: int, now: dt.datetime
+) -> Iterator[DataEntity]:
+    """Yields synthetic DataEntities. Label popularity follows Zipf's law, so a few labels hold most of the data."""
+    rng = random.Random(seed)
+    sources = list(SOURCE_WEIGHTS.keys())
+    source_weights = list(SOURCE_WEIGHTS.values())
+    label_cum_weights = list(
+        itertools.accumulate(1 / rank for rank in range(1, label_count + 1))
+    )
+    max_age_seconds = constants.DATA_ENTITY_BUCKET_AGE_LIMIT_DAYS * 24 * 60 * 60
+
+    for i in range(count):
+        source = rng.choices(sources, source_weights)[0]
+        label_rank = rng.choices(range(label_count), cum_weights=label_cum_weights)[0]
+        if source == DataSource.REDDIT:
+            label = DataLabel(value=f"r/subreddit_{label_rank}")
+        elif rng.random() < UNLABELED_X_SHARE:
+            label = None
+        else:
+            label = DataLabel(value=f"#hashtag_{label_rank}")
+
+        age_seconds = min(
+            rng.expovariate(1 / MEAN_AGE.total_seconds()), max_age_seconds - 1
+        )
+
+        size = int(
+            min(
+                max(rng.lognormvariate(math.log(MEDIAN_CONTENT_SIZE_BYTES), 0.8), 100),
+                20_000,
+            )
+        )
+        text = " ".join(rng.choices(WORDS, k=size // 6))
+        content = json.dumps({"id": i, "text": text}).encode()
+
+        yield DataEntity(
+            uri=f"https://example.com/{source.name.lower()}/{i}",
+            datetime=now - dt.timedelta(seconds=age_seconds),
+            source=source,
+            label=label,
+            content=content,
+            content_size_bytes=len(content),
+        )
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """Returns the value at the provided percentile, using the nearest rank."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def benchmark_store(
+    storage: MinerStorage, entities: Iterator[DataEntity], batch_size: int
+) -> dict:
+    """Stores the DataEntities in batches, measuring throughput and batch latency."""
+    latencies = []
+    stored = 0
+    batch = []
+    start = time.perf_counter()
+    for entity in entities:
+        batch.append(entity)
+        if len(batch) == batch_size:
+            batch_start = time.perf_counter()
+            storage.store_data_entities(batch)
+            latencies.append(time.perf_counter() - batch_start)
+            stored += len(batch)
+            batch = []
+    if batch:
+        batch_start = time.perf_counter()
+        storage.store_data_entities(batch)
+        latencies.append(time.perf_counter() - batch_start)
+        stored += len(batch)
+    total_seconds = time.perf_counter() - start
+
+    return {
+        "entities": stored,
+        # Includes generating the DataEntities, so is a lower bound of the storage throughput.
+        "entities_per_second": stored / total_seconds,
+        "store_entities_per_second": stored / sum(latencies),
+        "batch_latency_p50_seconds": percentile(latencies, 50),
+        "batch_latency_p99_seconds": percentile(latencies, 99),
+        "batch_latency_max_seconds": max(latencies),
+    }
+
+
+def benchmark_compressed_index(storage: MinerStorage, repeats: int) -> dict:
+    """Times building the compressed index for each supported bucket count limit."""
+    results = {}
+    for limit in [
+        constants.DATA_ENTITY_BUCKET_COUNT_LIMIT_PER_MINER_INDEX,
+        constants.DATA_ENTITY_BUCKET_COUNT_LIMIT_PER_MINER_INDEX_PROTOCOL_3,
+    ]:
+        latencies = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            storage.get_compressed_index(bucket_count_limit=limit)
+            latencies.append(time.perf_counter() - start)
+        results[f"limit_{limit}_p50_seconds"] = percentile(latencies, 50)
+        results[f"limit_{limit}_max_seconds"] = max(latencies)
+    return results
+
+
+def benchmark_bucket_reads(
+    storage: MinerStorage, buckets: List[DataEntityBucket], repeats: int
+) -> List[dict]:
+    """Times reading buckets at several percentiles of bucket size."""
+    ordered = sorted(buckets, key=lambda bucket: bucket.size_bytes)
+    results = []
+    for percent in [50, 90, 99, 100]:
+        bucket = ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+        list_latencies = []
+        serialized_latencies = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            storage.list_data_entities_in_data_entity_bucket(bucket.id)
+            list_latencies.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            storage.get_serialized_data_entities_in_data_entity_bucket(bucket.id)
+            serialized_latencies.append(time.perf_counter() - start)
+
+        results.append(
+            {
+                "size_percentile": percent,
+                "size_bytes": bucket.size_bytes,
+                "list_p50_seconds": percentile(list_latencies, 50),
+                "serialized_p50_seconds": percentile(serialized_latencies, 50),
+            }
+        )
+    return results
+
+
+def benchmark_eviction(storage: MinerStorage) -> dict:
+    """Times clearing the oldest tenth of the stored content."""
+    content_bytes_to_clear = storage.get_total_content_size_bytes() // 10
+    start = time.perf_counter()
+    storage.clear_content_from_oldest(content_bytes_to_clear)
+    return {
+        "content_bytes_to_clear": content_bytes_to_clear,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def get_commit() -> str:
+    """Returns the current git commit, or None if it cannot be determined."""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def create_storage(args, directory: str) -> MinerStorage:
+    codec = ContentCodec[args.content_codec.upper()]
+    if args.storage_backend == "segment_log":
+        return SegmentLogMinerStorage(
+            os.path.join(directory, "segments"),
+            args.max_database_size_gb_hint,
+            codec,
+        )
+    if args.storage_backend == "partitioned_sqlite":
+        return PartitionedSqliteMinerStorage(
+            os.path.join(directory, "partitions"),
+            args.max_database_size_gb_hint,
+            content_codec=codec,
+        )
+    return SqliteMinerStorage(
+        os.path.join(directory, "benchmark.sqlite"),
+        args.max_database_size_gb_hint,
+        codec,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--entities",
+        type=int,
+        default=1_000_000,
+        help="The number of DataEntities to generate.",
+    )
+    parser.add_argument(
+        "--labels",
+        type=int,
+        default=1_000,
+        help="The number of distinct labels per source.",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=1_000,
+        help="The number of DataEntities per call to store_data_entities.",
+    )
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=3,
+        help="The number of times to repeat each read.",
+    )
+    parser.add_argument(
+        "--storage_backend",
+        type=str,
+        choices=["sqlite", "partitioned_sqlite", "segment_log"],
+        default="sqlite",
+        help="The miner storage to benchmark.",
+    )
+    parser.add_argument(
+        "--content_codec",
+        type=str,
+        choices=[codec.name.lower() for codec in ContentCodec],
+        default="none",
+        help="The codec to compress content with.",
+    )
+    parser.add_argument(
+        "--max_database_size_gb_hint",
+        type=int,
+        default=250,
+        help="The size limit of the storage. Defaults to large enough that nothing is cleared while storing.",
+    )
+    parser.add_argument(
+        "--directory",
+        type=str,
+        default=None,
+        help="Where to create the benchmark database. Defaults to a temporary directory.",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="The random seed.")
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="A file to append the results to as a json line.",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.directory) as directory:
+        storage = create_storage(args, directory)
+
+        entities = generate_data_entities(
+            args.entities, args.labels, args.seed, dt.datetime.now(tz=dt.timezone.utc)
+        )
+        results = {
+            "commit": get_commit(),
+            "timestamp": dt.datetime.now(tz=dt.timezone.utc).isoformat(),
+            "args": vars(args),
+            "store": benchmark_store(storage, entities, args.batch_size),
+            "compressed_index": benchmark_compressed_index(storage, args.repeats),
+            "bucket_reads": benchmark_bucket_reads(
+                storage, storage.list_data_entity_buckets(), args.repeats
+            ),
+            "eviction": benchmark_eviction(storage),
+        }
+        storage.close()
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "a") as output:
+            output.write(json.dumps(results) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Benchmarks validator storage under a realistic volume of synthetic miner indexes.
+
+Generates a compressed index for each miner, drawing buckets from a shared pool so miners overlap the way they do on
+the network, then measures for each storage backend:
+    - upsert_compressed_miner_index latency while filling the storage.
+    - read_miner_index latency once every miner is stored.
+    - read_scorable_buckets latency, summed over every miner as when refreshing all scores.
+    - upsert latency when replacing an index in a full storage.
+
+Results are printed as a single json object, and appended as a json line to --output if provided, so runs can be
+compared across commits.
+
+Run it from the data-universe folder:
+    python -m scripts.benchmark_validator_storage --miners 250 --buckets 250000 --output benchmarks.jsonl
+"""
+import argparse
+import datetime as dt
+import json
+import random
+import time
+from typing import Dict, List
+
+from common.data import CompressedEntityBucket, CompressedMinerIndex, DataSource
+from scripts.benchmark_miner_storage import get_commit, percentile
+from storage.validator.numpy_validator_storage import NumpyValidatorStorage
+from storage.validator.sqlite_memory_validator_storage import (
+    SqliteMemoryValidatorStorage,
+)
+from storage.validator.validator_storage import ValidatorStorage
+
+# The number of hours of time buckets miners serve from.
+TIME_BUCKET_COUNT = 30 * 24
+
+# The number of time buckets each miner serves per label.
+TIME_BUCKETS_PER_LABEL = 100
+
+STORAGES = {
+    "sqlite": SqliteMemoryValidatorStorage,
+    "numpy": NumpyValidatorStorage,
+}
+
+
+def generate_index(
+    rng: random.Random, label_count: int, buckets: int
+) -> CompressedMinerIndex:
+    """Generates a compressed index of roughly the provided number of buckets, with labels drawn from a shared pool."""
+    labels_per_source = max(1, buckets // TIME_BUCKETS_PER_LABEL // 2)
+    newest_time_bucket_id = int(dt.datetime.now(tz=dt.timezone.utc).timestamp()) // 3600
+    time_bucket_ids = range(
+        newest_time_bucket_id - TIME_BUCKET_COUNT, newest_time_bucket_id
+    )
+
+    sources: Dict[int, List[CompressedEntityBucket]] = {}
+    for source in [DataSource.REDDIT, DataSource.X]:
+        sources[int(source)] = [
+            CompressedEntityBucket(
+                label=f"label_{label}",
+                time_bucket_ids=sorted(
+                    rng.sample(time_bucket_ids, TIME_BUCKETS_PER_LABEL)
+                ),
+                sizes_bytes=[
+                    rng.randint(1, 10_000_000) for _ in range(TIME_BUCKETS_PER_LABEL)
+                ],
+            )
+            for label in rng.sample(
+                range(label_count), min(label_count, labels_per_source)
+            )
+        ]
+    return CompressedMinerIndex(sources=sources)
+
+
+def benchmark_storage(
+    storage: ValidatorStorage,
+    indexes: List[CompressedMinerIndex],
+    credibilities: List[float],
+    repeats: int,
+) -> dict:
+    """Fills the storage with the indexes, then measures reads and replacing an index."""
+    hotkeys = [f"hotkey_{i}" for i in range(len(indexes))]
+
+    upsert_latencies = []
+    for hotkey, index, credibility in zip(hotkeys, indexes, credibilities):
+        start = time.perf_counter()
+        storage.upsert_compressed_miner_index(index, hotkey, credibility)
+        upsert_latencies.append(time.perf_counter() - start)
+
+    read_latencies = []
+    for hotkey in hotkeys[:repeats]:
+        start = time.perf_counter()
+        storage.read_miner_index(hotkey)
+        read_latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for hotkey in hotkeys:
+        storage.read_scorable_buckets(hotkey)
+    read_all_seconds = time.perf_counter() - start
+
+    replace_latencies = []
+    for i in range(min(repeats, len(hotkeys))):
+        start = time.perf_counter()
+        storage.upsert_compressed_miner_index(
+            indexes[(i + 1) % len(indexes)], hotkeys[i], credibilities[i]
+        )
+        replace_latencies.append(time.perf_counter() - start)
+
+    return {
+        "fill_seconds": sum(upsert_latencies),
+        "upsert_p50_seconds": percentile(upsert_latencies, 50),
+        "upsert_max_seconds": max(upsert_latencies),
+        "read_p50_seconds": percentile(read_latencies, 50),
+        "read_max_seconds": max(read_latencies),
+        "read_all_seconds": read_all_seconds,
+        "replace_p50_seconds": percentile(replace_latencies, 50),
+        "replace_max_seconds": max(replace_latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--miners", type=int, default=50, help="The number of miners to store."
+    )
+    parser.add_argument(
+        "--buckets",
+        type=int,
+        default=100_000,
+        help="The number of buckets in each miner's index.",
+    )
+    parser.add_argument(
+        "--labels",
+        type=int,
+        default=10_000,
+        help="The number of distinct labels per source shared by all miners.",
+    )
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=5,
+        help="The number of reads and replacements to time.",
+    )
+    parser.add_argument(
+        "--storage_backends",
+        type=str,
+        nargs="+",
+        choices=list(STORAGES.keys()),
+        default=list(STORAGES.keys()),
+        help="The validator storages to benchmark.",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="The random seed.")
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="A file to append the results to as a json line.",
+    )
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    indexes = [
+        generate_index(rng, args.labels, args.buckets) for _ in range(args.miners)
+    ]
+    credibilities = [rng.random() for _ in range(args.miners)]
+
+    results = {
+        "commit": get_commit(),
+        "timestamp": dt.datetime.now(tz=dt.timezone.utc).isoformat(),
+        "args": vars(args),
+    }
+    for backend in args.storage_backends:
+        results[backend] = benchmark_storage(
+            STORAGES[backend](), indexes, credibilities, args.repeats
+        )
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "a") as output:
+            output.write(json.dumps(results) + "\n")
+
+
+if __name__ == "__main__":
+    main()
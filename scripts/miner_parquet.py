@@ -0,0 +1,89 @@
+"""
+Exports a miner database to Parquet files, or imports Parquet files into a miner database.
+
+Exports write one file per time bucket and source under --directory, laid out with hive partitioning
+(time_bucket_id=<id>/source=<source>/data.parquet) so they can be read directly by analytics tools. Imports read files
+in that layout back in batches. Memory use is bounded by --batch_size either way.
+
+Requires pyarrow: `pip install pyarrow`.
+
+Run it from the data-universe folder:
+    python -m scripts.miner_parquet export --database SqliteMinerStorage.sqlite --directory export
+    python -m scripts.miner_parquet import --database SqliteMinerStorage.sqlite --directory export
+"""
+import argparse
+import time
+
+from storage.miner import parquet_io
+from storage.miner.content_codec import ContentCodec
+from storage.miner.sqlite_miner_storage import SqliteMinerStorage
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument(
+        "--database",
+        type=str,
+        default="SqliteMinerStorage.sqlite",
+        help="The miner database to export from or import into.",
+    )
+    parser.add_argument(
+        "--directory",
+        type=str,
+        required=True,
+        help="The directory of Parquet files to write to or read from.",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=10_000,
+        help="The number of DataEntities to hold in memory at once.",
+    )
+    parser.add_argument(
+        "--compression",
+        type=str,
+        default="zstd",
+        help="The Parquet compression codec to export with.",
+    )
+    parser.add_argument(
+        "--max_database_size_gb_hint",
+        type=int,
+        default=250,
+        help="The size limit of the database when importing.",
+    )
+    parser.add_argument(
+        "--content_codec",
+        type=str,
+        choices=[codec.name.lower() for codec in ContentCodec],
+        default="none",
+        help="The codec to compress imported content with.",
+    )
+    args = parser.parse_args()
+
+    storage = SqliteMinerStorage(
+        args.database,
+        args.max_database_size_gb_hint,
+        ContentCodec[args.content_codec.upper()],
+    )
+    try:
+        start = time.perf_counter()
+        if args.command == "export":
+            count = parquet_io.export_to_parquet(
+                storage, args.directory, args.batch_size, args.compression
+            )
+        else:
+            count = parquet_io.import_from_parquet(
+                storage, args.directory, args.batch_size
+            )
+        print(
+            f"{args.command.capitalize()}ed {count} data entities in {time.perf_counter() - start:.1f}s."
+        )
+    finally:
+        storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -46,6 +46,7 @@ def read_requirements(path):
 
 
 requirements = read_requirements("requirements.txt")
+parquet_requirements = read_requirements("requirements-parquet.txt")
 here = path.abspath(path.dirname(__file__))
 
 with open(path.join(here, "README.md"), encoding="utf-8") as f:
@@ -75,6 +76,7 @@ setup(
     license="MIT",
     python_requires=">=3.10",
     install_requires=requirements,
+    extras_require={"parquet": parquet_requirements},
     classifiers=[
         "Development Status :: 3 - Alpha",
         "Intended Audience :: Developers",
@@ -0,0 +1,115 @@
+import collections
+import dataclasses
+import threading
+from typing import Callable, Dict, Optional, Set, Tuple
+from common.data import DataEntityBucketId
+from storage.miner.miner_storage import SerializedDataEntities
+
+
+@dataclasses.dataclass(frozen=True)
+class BucketCacheMetrics:
+    """A snapshot of the DataEntityBucketCache's state."""
+
+    # The number of buckets currently cached.
+    entries: int
+
+    # The total size in bytes of the cached buckets.
+    size_bytes: int
+
+    # The number of requests served from the cache.
+    hits: int
+
+    # The number of requests that had to read from storage.
+    misses: int
+
+
+class DataEntityBucketCache:
+    """A byte-budgeted LRU cache of serialized DataEntityBuckets.
+
+    Register on_write as a storage write listener so a bucket is dropped from the cache whenever its time bucket is
+    written to. Buckets larger than the whole budget are never cached.
+    """
+
+    def __init__(self, max_size_bytes: int):
+        self.max_size_bytes = max_size_bytes
+
+        self.lock = threading.Lock()
+        self.entries: collections.OrderedDict = collections.OrderedDict()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        # Counts the writes to each time bucket, so loads that raced with a write are not cached.
+        self.write_generations: Dict[int, int] = collections.defaultdict(int)
+
+    @staticmethod
+    def _key(
+        data_entity_bucket_id: DataEntityBucketId,
+    ) -> Tuple[int, int, Optional[str]]:
+        label = data_entity_bucket_id.label
+        return (
+            data_entity_bucket_id.time_bucket.id,
+            int(data_entity_bucket_id.source),
+            label.value if label is not None else None,
+        )
+
+    def get_or_load(
+        self,
+        data_entity_bucket_id: DataEntityBucketId,
+        load: Callable[[DataEntityBucketId], SerializedDataEntities],
+    ) -> SerializedDataEntities:
+        """Returns the cached bucket, otherwise loads it with the provided function and caches it."""
+        key = DataEntityBucketCache._key(data_entity_bucket_id)
+        time_bucket_id = key[0]
+
+        with self.lock:
+            cached = self.entries.get(key, None)
+            if cached is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return cached
+
+            self.misses += 1
+            generation = self.write_generations[time_bucket_id]
+
+        data_entities = load(data_entity_bucket_id)
+
+        size_bytes = len(data_entities.serialized)
+        if size_bytes > self.max_size_bytes:
+            return data_entities
+
+        with self.lock:
+            # Skip caching if the time bucket was written to while loading.
+            if (
+                self.write_generations[time_bucket_id] != generation
+                or key in self.entries
+            ):
+                return data_entities
+
+            self.entries[key] = data_entities
+            self.size_bytes += size_bytes
+
+            while self.size_bytes > self.max_size_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size_bytes -= len(evicted.serialized)
+
+        return data_entities
+
+    def on_write(self, time_bucket_ids: Set[int]):
+        """Notifies the cache that the storage has been written to in the provided time buckets."""
+        with self.lock:
+            for time_bucket_id in time_bucket_ids:
+                self.write_generations[time_bucket_id] += 1
+
+            for key in [key for key in self.entries if key[0] in time_bucket_ids]:
+                self.size_bytes -= len(self.entries.pop(key).serialized)
+
+    def get_metrics(self) -> BucketCacheMetrics:
+        """Returns the current size and hit statistics of the cache."""
+        with self.lock:
+            return BucketCacheMetrics(
+                entries=len(self.entries),
+                size_bytes=self.size_bytes,
+                hits=self.hits,
+                misses=self.misses,
+            )
@@ -0,0 +1,123 @@
+import dataclasses
+import datetime as dt
+import threading
+import traceback
+from typing import Dict, List, Optional, Set
+import bittensor as bt
+from common.data import CompressedMinerIndex
+from storage.miner.miner_storage import MinerStorage
+
+
+@dataclasses.dataclass(frozen=True)
+class CachedCompressedIndex:
+    """A CompressedMinerIndex that has already been serialized for the wire."""
+
+    # The CompressedMinerIndex in its serialized json form.
+    serialized: str
+
+    # The total size in bytes of the buckets in the index.
+    size_bytes: int
+
+    # The number of buckets in the index.
+    bucket_count: int
+
+    # When the index was built.
+    built_at: dt.datetime
+
+
+class CompressedIndexCache:
+    """Keeps a serialized CompressedMinerIndex ready to serve for each supported bucket count limit.
+
+    The indexes are rebuilt on a background thread every refresh_interval, or sooner once
+    refresh_after_writes writes have been made to the storage since the last refresh.
+    """
+
+    def __init__(
+        self,
+        storage: MinerStorage,
+        bucket_count_limits: List[int],
+        refresh_interval: dt.timedelta,
+        refresh_after_writes: int,
+    ):
+        self.storage = storage
+        self.bucket_count_limits = bucket_count_limits
+        self.refresh_interval = refresh_interval
+        self.refresh_after_writes = refresh_after_writes
+
+        self.lock = threading.Lock()
+        self.indexes_by_limit: Dict[int, CachedCompressedIndex] = {}
+        self.writes_since_refresh = 0
+
+        self.refresh_event = threading.Event()
+        self.is_running = False
+        self.thread: threading.Thread = None
+
+    def get(self, bucket_count_limit: int) -> Optional[CachedCompressedIndex]:
+        """Returns the cached index for the bucket count limit, or None if it has not been built yet."""
+        with self.lock:
+            return self.indexes_by_limit.get(bucket_count_limit, None)
+
+    def on_write(self, time_bucket_ids: Set[int]):
+        """Notifies the cache that the storage has been written to in the provided time buckets."""
+        with self.lock:
+            self.writes_since_refresh += 1
+            should_refresh = (
+                self.refresh_after_writes > 0
+                and self.writes_since_refresh >= self.refresh_after_writes
+            )
+
+        if should_refresh:
+            self.refresh_event.set()
+
+    def refresh(self):
+        """Rebuilds and serializes the index for every bucket count limit."""
+        with self.lock:
+            self.writes_since_refresh = 0
+
+        for bucket_count_limit in self.bucket_count_limits:
+            start = dt.datetime.now()
+            index = self.storage.get_compressed_index(
+                bucket_count_limit=bucket_count_limit
+            )
+            cached_index = CachedCompressedIndex(
+                serialized=index.json(),
+                size_bytes=CompressedMinerIndex.size_bytes(index),
+                bucket_count=CompressedMinerIndex.bucket_count(index),
+                built_at=dt.datetime.now(),
+            )
+
+            with self.lock:
+                self.indexes_by_limit[bucket_count_limit] = cached_index
+
+            bt.logging.trace(
+                f"Refreshed compressed index with limit {bucket_count_limit} of {cached_index.bucket_count} buckets in {dt.datetime.now() - start}."
+            )
+
+    def run_in_background_thread(self):
+        """Refreshes the cache on a background thread until stopped."""
+        assert not self.is_running, "CompressedIndexCache already running"
+
+        bt.logging.info("Starting CompressedIndexCache in a background thread.")
+
+        self.is_running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        """Blocking call to refresh the cache until stopped."""
+        while self.is_running:
+            try:
+                self.refresh()
+            except Exception:
+                bt.logging.error(
+                    f"Failed to refresh the compressed index: {traceback.format_exc()}"
+                )
+
+            # Wait for the next scheduled refresh or until enough writes have been made.
+            self.refresh_event.wait(timeout=self.refresh_interval.total_seconds())
+            self.refresh_event.clear()
+
+    def stop(self):
+        bt.logging.info("Stopping the CompressedIndexCache.")
+        self.is_running = False
+        self.refresh_event.set()
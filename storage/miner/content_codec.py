@@ -0,0 +1,91 @@
+import threading
+import zlib
+from enum import IntEnum
+from typing import Tuple
+
+# zstandard is an optional dependency. Install it with `pip install zstandard` to use ContentCodec.ZSTD.
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class ContentCodec(IntEnum):
+    """How the content of a DataEntity is encoded at rest. Stored per row, so codecs can be changed at any time."""
+
+    NONE = 0
+    ZLIB = 1
+    ZSTD = 2
+
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# zstandard compressors are not thread safe, so each thread reuses its own.
+_thread_local = threading.local()
+
+
+def _zstd_compressor():
+    check_available(ContentCodec.ZSTD)
+    if not hasattr(_thread_local, "zstd_compressor"):
+        _thread_local.zstd_compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+    return _thread_local.zstd_compressor
+
+
+def _zstd_decompressor():
+    check_available(ContentCodec.ZSTD)
+    if not hasattr(_thread_local, "zstd_decompressor"):
+        _thread_local.zstd_decompressor = zstandard.ZstdDecompressor()
+    return _thread_local.zstd_decompressor
+
+
+def is_available(codec: ContentCodec) -> bool:
+    """Returns whether the codec can be used in this environment."""
+    return codec != ContentCodec.ZSTD or zstandard is not None
+
+
+def check_available(codec: ContentCodec):
+    """Raises an ImportError naming the missing package if the codec cannot be used in this environment."""
+    if not is_available(codec):
+        raise ImportError(
+            f"Content codec {ContentCodec(codec).name} requires zstandard. Install it with `pip install zstandard`."
+        )
+
+
+def compress(content: bytes, codec: ContentCodec) -> bytes:
+    """Encodes the content with the provided codec."""
+    if codec == ContentCodec.NONE:
+        return content
+    if codec == ContentCodec.ZLIB:
+        return zlib.compress(content, ZLIB_LEVEL)
+    if codec == ContentCodec.ZSTD:
+        return _zstd_compressor().compress(content)
+
+    raise ValueError(f"Unknown content codec: {codec}")
+
+
+def decompress(content: bytes, codec: ContentCodec) -> bytes:
+    """Decodes content that was encoded with the provided codec."""
+    if codec == ContentCodec.NONE:
+        return content
+    if codec == ContentCodec.ZLIB:
+        return zlib.decompress(content)
+    if codec == ContentCodec.ZSTD:
+        return _zstd_decompressor().decompress(content)
+
+    raise ValueError(f"Unknown content codec: {codec}")
+
+
+def encode(content: bytes, codec: ContentCodec) -> Tuple[bytes, ContentCodec]:
+    """Compresses the content, falling back to storing it as is if compression does not make it smaller.
+
+    Returns a tuple of the encoded content and the codec that was actually used.
+    """
+    if codec == ContentCodec.NONE:
+        return content, ContentCodec.NONE
+
+    compressed = compress(content, codec)
+    if len(compressed) >= len(content):
+        return content, ContentCodec.NONE
+
+    return compressed, codec
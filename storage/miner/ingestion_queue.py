@@ -0,0 +1,190 @@
+import dataclasses
+import datetime as dt
+import queue
+import threading
+import time
+import traceback
+from typing import List
+import bittensor as bt
+from common.data import DataEntity
+from storage.miner.miner_storage import MinerStorage
+
+
+@dataclasses.dataclass(frozen=True)
+class IngestionMetrics:
+    """A snapshot of the IngestionQueue's state."""
+
+    # The number of batches waiting to be written.
+    queue_depth: int
+
+    # The number of storage transactions committed so far.
+    commits: int
+
+    # The number of DataEntities written so far.
+    entities_committed: int
+
+    # The number of DataEntities dropped because their batch failed to store, even on its own.
+    entities_dropped: int
+
+    # How long the most recent commit took.
+    last_commit_latency: dt.timedelta
+
+    # The longest any commit has taken.
+    max_commit_latency: dt.timedelta
+
+    # The average time commits have taken.
+    average_commit_latency: dt.timedelta
+
+
+class IngestionQueue:
+    """Write-behind queue between the scrapers and the MinerStorage.
+
+    Scraped batches are put on a bounded queue and written by a single writer thread, which merges the batches
+    waiting in the queue into one call to store_data_entities so many small scrapes share one transaction. If the
+    merged call fails, each batch is retried on its own so one bad batch does not drop the others with it.
+
+    put() blocks while the queue is full, which applies backpressure to the producers.
+    """
+
+    def __init__(
+        self,
+        storage: MinerStorage,
+        max_queued_batches: int = 100,
+        max_entities_per_commit: int = 10_000,
+    ):
+        self.storage = storage
+        self.max_entities_per_commit = max_entities_per_commit
+
+        self.queue: queue.Queue = queue.Queue(maxsize=max_queued_batches)
+
+        self.lock = threading.Lock()
+        self.commits = 0
+        self.entities_committed = 0
+        self.entities_dropped = 0
+        self.last_commit_latency = dt.timedelta()
+        self.max_commit_latency = dt.timedelta()
+        self.total_commit_latency = dt.timedelta()
+
+        self.is_running = False
+        self.thread: threading.Thread = None
+
+    def put(self, data_entities: List[DataEntity]):
+        """Queues the DataEntities to be stored, blocking while the queue is full."""
+        if data_entities:
+            self.queue.put(data_entities)
+
+    def get_metrics(self) -> IngestionMetrics:
+        """Returns the current queue depth and commit statistics."""
+        with self.lock:
+            return IngestionMetrics(
+                queue_depth=self.queue.qsize(),
+                commits=self.commits,
+                entities_committed=self.entities_committed,
+                entities_dropped=self.entities_dropped,
+                last_commit_latency=self.last_commit_latency,
+                max_commit_latency=self.max_commit_latency,
+                average_commit_latency=self.total_commit_latency / max(self.commits, 1),
+            )
+
+    def _take_batches(self, timeout: float) -> List[List[DataEntity]]:
+        """Waits up to timeout for a batch, then takes any other queued batches up to the commit limit."""
+        try:
+            batches = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        self.queue.task_done()
+
+        entity_count = len(batches[0])
+        while entity_count < self.max_entities_per_commit:
+            try:
+                batch = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            self.queue.task_done()
+
+            batches.append(batch)
+            entity_count += len(batch)
+
+        return batches
+
+    def _commit(self, batches: List[List[DataEntity]]):
+        """Stores the batches in a single call to the storage, retrying each batch on its own if that fails."""
+        data_entities = [entity for batch in batches for entity in batch]
+        try:
+            self._store(data_entities)
+            return
+        except Exception:
+            if len(batches) == 1:
+                self._drop(data_entities)
+                return
+
+            bt.logging.warning(
+                f"Failed to store {len(batches)} merged batches. Retrying each on its own: {traceback.format_exc()}"
+            )
+
+        for batch in batches:
+            try:
+                self._store(batch)
+            except Exception:
+                self._drop(batch)
+
+    def _drop(self, data_entities: List[DataEntity]):
+        """Records DataEntities that could not be stored. Must be called from an except block."""
+        with self.lock:
+            self.entities_dropped += len(data_entities)
+
+        bt.logging.error(
+            f"Failed to store {len(data_entities)} data entities: {traceback.format_exc()}"
+        )
+
+    def _store(self, data_entities: List[DataEntity]):
+        """Stores the DataEntities in a single call to the storage and records its latency."""
+        start = time.perf_counter()
+        self.storage.store_data_entities(data_entities)
+        latency = dt.timedelta(seconds=time.perf_counter() - start)
+
+        with self.lock:
+            self.commits += 1
+            self.entities_committed += len(data_entities)
+            self.last_commit_latency = latency
+            self.max_commit_latency = max(self.max_commit_latency, latency)
+            self.total_commit_latency += latency
+
+        bt.logging.trace(
+            f"Committed {len(data_entities)} data entities in {latency}. {self.queue.qsize()} batches queued."
+        )
+
+    def flush(self):
+        """Writes everything currently in the queue on the calling thread."""
+        while True:
+            batches = self._take_batches(timeout=0)
+            if not batches:
+                return
+            self._commit(batches)
+
+    def run_in_background_thread(self):
+        """Writes queued batches on a background thread until stopped."""
+        assert not self.is_running, "IngestionQueue already running"
+
+        bt.logging.info("Starting IngestionQueue in a background thread.")
+
+        self.is_running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        """Blocking call to write queued batches until stopped."""
+        while self.is_running:
+            batches = self._take_batches(timeout=1)
+            if batches:
+                self._commit(batches)
+
+    def stop(self):
+        """Stops the writer thread after writing any batches still in the queue."""
+        bt.logging.info("Stopping the IngestionQueue.")
+        self.is_running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+        self.flush()
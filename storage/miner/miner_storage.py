@@ -1,10 +1,27 @@
 from abc import ABC, abstractmethod
+import dataclasses
+import json
+from pydantic.json import pydantic_encoder
 from common.data import (
     CompressedMinerIndex,
     DataEntity,
     DataEntityBucketId,
 )
-from typing import List
+from typing import Callable, List, Set
+
+
+@dataclasses.dataclass(frozen=True)
+class SerializedDataEntities:
+    """DataEntities already serialized in the json form sent in GetDataEntityBucket.data_entities."""
+
+    # The json list of DataEntities.
+    serialized: str
+
+    # The number of DataEntities in the list.
+    count: int
+
+    # The total content size in bytes of the DataEntities.
+    content_size_bytes: int
 
 
 class MinerStorage(ABC):
@@ -22,7 +39,48 @@ class MinerStorage(ABC):
         """Lists from storage all DataEntities matching the provided DataEntityBucket."""
         raise NotImplemented
 
+    def get_serialized_data_entities_in_data_entity_bucket(
+        self, data_entity_bucket_id: DataEntityBucketId
+    ) -> SerializedDataEntities:
+        """Gets from storage all DataEntities matching the provided DataEntityBucket, serialized for the wire.
+
+        Implementations may override this to serialize straight from storage.
+        """
+        data_entities = self.list_data_entities_in_data_entity_bucket(
+            data_entity_bucket_id
+        )
+        return SerializedDataEntities(
+            serialized=json.dumps(
+                [data_entity.dict() for data_entity in data_entities],
+                default=pydantic_encoder,
+            ),
+            count=len(data_entities),
+            content_size_bytes=sum(
+                data_entity.content_size_bytes for data_entity in data_entities
+            ),
+        )
+
     @abstractmethod
     def get_compressed_index(self) -> CompressedMinerIndex:
         """Gets the compressed MinedIndex, which is a summary of all of the DataEntities that this MinerStorage is currently serving."""
         raise NotImplemented
+
+    @abstractmethod
+    def add_write_listener(self, listener: Callable[[Set[int]], None]):
+        """Registers a callback to be notified after every write to storage with the ids of the time buckets written."""
+        raise NotImplemented
+
+    @abstractmethod
+    def clear_content_from_oldest(self, content_bytes_to_clear: int):
+        """Deletes DataEntities starting from the oldest until the specified amount of content is cleared."""
+        raise NotImplemented
+
+    @abstractmethod
+    def delete_expired_data_entities(self) -> int:
+        """Deletes every DataEntity older than the age limit, returning the content bytes cleared."""
+        raise NotImplemented
+
+    @abstractmethod
+    def get_database_files(self) -> List[str]:
+        """Gets the paths of the files backing the storage on disk."""
+        raise NotImplemented
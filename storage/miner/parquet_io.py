@@ -0,0 +1,184 @@
+import os
+import re
+from typing import List, Tuple
+import bittensor as bt
+from storage.miner.sqlite_miner_storage import (
+    DataEntityRow,
+    SqliteMinerStorage,
+    epoch_micros_to_time_bucket_id,
+)
+
+# pyarrow is an optional dependency. Install it with `pip install -r requirements-parquet.txt`, or the parquet extra,
+# to export and import Parquet files.
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+TIME_BUCKET_DIRECTORY_PATTERN = re.compile(r"^time_bucket_id=(\d+)$")
+SOURCE_DIRECTORY_PATTERN = re.compile(r"^source=(\d+)$")
+
+
+def is_available() -> bool:
+    """Returns whether Parquet files can be exported and imported in this environment."""
+    return pyarrow is not None
+
+
+def _check_available():
+    if not is_available():
+        raise ImportError(
+            "Exporting and importing Parquet files requires pyarrow. Install it with `pip install -r requirements-parquet.txt`."
+        )
+
+
+def _schema():
+    # The time bucket and source are encoded in the path of each file rather than stored as columns.
+    return pyarrow.schema(
+        [
+            pyarrow.field("uri", pyarrow.string(), nullable=False),
+            pyarrow.field(
+                "datetime", pyarrow.timestamp("us", tz="UTC"), nullable=False
+            ),
+            pyarrow.field("label", pyarrow.string()),
+            pyarrow.field("content", pyarrow.binary(), nullable=False),
+            pyarrow.field("content_size_bytes", pyarrow.int64(), nullable=False),
+        ]
+    )
+
+
+def partition_path(directory: str, time_bucket_id: int, source: int) -> str:
+    """Returns the path of the Parquet file holding the DataEntities of a time bucket and source."""
+    return os.path.join(
+        directory,
+        f"time_bucket_id={time_bucket_id}",
+        f"source={source}",
+        "data.parquet",
+    )
+
+
+def export_to_parquet(
+    storage: SqliteMinerStorage,
+    directory: str,
+    batch_size: int = 10_000,
+    compression: str = "zstd",
+) -> int:
+    """Streams every DataEntity in the storage to Parquet files, returning the number exported.
+
+    Writes one file per time bucket and source, laid out with hive partitioning so analytics tools can read the
+    directory as a single dataset. Content is exported uncompressed by the storage's codec, but compressed by Parquet.
+    At most one batch of rows is held in memory, regardless of the size of the storage.
+    """
+    _check_available()
+
+    schema = _schema()
+    exported = 0
+    writer = None
+    current_partition = None
+    try:
+        for rows in storage.iter_data_entity_rows(batch_size):
+            # Batches never span more than one time bucket and source.
+            partition = (
+                epoch_micros_to_time_bucket_id(rows[0].datetime),
+                rows[0].source,
+            )
+            if partition != current_partition:
+                if writer is not None:
+                    writer.close()
+
+                path = partition_path(directory, *partition)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                writer = pyarrow.parquet.ParquetWriter(
+                    path, schema, compression=compression
+                )
+                current_partition = partition
+
+            writer.write_table(
+                pyarrow.Table.from_pydict(
+                    {
+                        "uri": [row.uri for row in rows],
+                        "datetime": [row.datetime for row in rows],
+                        "label": [row.label for row in rows],
+                        "content": [row.content for row in rows],
+                        "content_size_bytes": [row.content_size_bytes for row in rows],
+                    },
+                    schema=schema,
+                )
+            )
+            exported += len(rows)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    bt.logging.info(f"Exported {exported} data entities to {directory}.")
+    return exported
+
+
+def _find_partition_files(directory: str) -> List[Tuple[int, int, str]]:
+    """Returns (time bucket id, source, path) of every exported Parquet file, from the oldest time bucket."""
+    files = []
+    for time_bucket_directory in os.listdir(directory):
+        time_bucket_match = TIME_BUCKET_DIRECTORY_PATTERN.match(time_bucket_directory)
+        if not time_bucket_match:
+            continue
+
+        for source_directory in os.listdir(
+            os.path.join(directory, time_bucket_directory)
+        ):
+            source_match = SOURCE_DIRECTORY_PATTERN.match(source_directory)
+            if not source_match:
+                continue
+
+            path = os.path.join(directory, time_bucket_directory, source_directory)
+            for filename in sorted(os.listdir(path)):
+                if filename.endswith(".parquet"):
+                    files.append(
+                        (
+                            int(time_bucket_match.group(1)),
+                            int(source_match.group(1)),
+                            os.path.join(path, filename),
+                        )
+                    )
+
+    return sorted(files)
+
+
+def import_from_parquet(
+    storage: SqliteMinerStorage, directory: str, batch_size: int = 10_000
+) -> int:
+    """Bulk loads DataEntities from Parquet files written by export_to_parquet, returning the number read.
+
+    Rows are stored in batches straight from the Parquet columns, without building a DataEntity per row. Files are
+    loaded from the oldest time bucket, so if the storage fills up the newest data is kept. At most one batch of rows
+    is held in memory, regardless of the size of the export.
+    """
+    _check_available()
+
+    imported = 0
+    for _, source, path in _find_partition_files(directory):
+        parquet_file = pyarrow.parquet.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=batch_size):
+            table = pyarrow.Table.from_batches([batch])
+            rows = [
+                DataEntityRow(
+                    uri=uri,
+                    datetime=datetime,
+                    source=source,
+                    label=label,
+                    content=content,
+                    content_size_bytes=content_size_bytes,
+                )
+                for uri, datetime, label, content, content_size_bytes in zip(
+                    table.column("uri").to_pylist(),
+                    # Read timestamps as epoch microseconds, rather than converting each to a datetime.
+                    table.column("datetime").cast(pyarrow.int64()).to_pylist(),
+                    table.column("label").to_pylist(),
+                    table.column("content").to_pylist(),
+                    table.column("content_size_bytes").to_pylist(),
+                )
+            ]
+            storage.store_data_entity_rows(rows)
+            imported += len(rows)
+
+    bt.logging.info(f"Imported {imported} data entities from {directory}.")
+    return imported
@@ -0,0 +1,459 @@
+import contextlib
+import heapq
+import os
+import re
+import threading
+from collections import defaultdict
+from common import constants, utils
+from common.data import (
+    CompressedEntityBucket,
+    CompressedMinerIndex,
+    DataEntity,
+    DataEntityBucket,
+    DataEntityBucketId,
+    TimeBucket,
+)
+from storage.miner.content_codec import ContentCodec
+from storage.miner.miner_storage import MinerStorage, SerializedDataEntities
+from storage.miner.sqlite_miner_storage import SqliteMinerStorage
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+import datetime as dt
+import bittensor as bt
+
+
+class PartitionedSqliteMinerStorage(MinerStorage):
+    """MinerStorage that shards DataEntities into one SqliteMinerStorage file per time partition.
+
+    Each partition covers partition_hours consecutive TimeBuckets. Since a DataEntityBucket never spans partitions,
+    bucket reads go straight to a single file and data past the age limit is removed by deleting whole files.
+
+    Stores check for space against totals sampled across the partitions at most once per
+    SqliteMinerStorage.DATABASE_SIZE_SAMPLE_INTERVAL, plus the sizes stored since. Expired partitions are only dropped
+    by delete_expired_data_entities, which the RetentionSweeper calls on a schedule.
+
+    Note: An entity is only replaced by a later store of the same uri if it remains in the same partition.
+    """
+
+    PARTITION_FILE_PATTERN = re.compile(r"^partition_(\d+)\.sqlite$")
+
+    # The page cache and memory map sizes of each partition's connections. Smaller than a single SqliteMinerStorage's,
+    # since every partition holds its own connections.
+    PARTITION_CACHE_SIZE_KIB = 8 * 1024
+    PARTITION_MMAP_SIZE_BYTES = 128 * 1024 * 1024
+
+    def __init__(
+        self,
+        directory="SqliteMinerStorage",
+        max_database_size_gb_hint=250,
+        partition_hours=24,
+        content_codec=ContentCodec.NONE,
+    ):
+        self.directory = directory
+        self.max_database_size_gb_hint = max_database_size_gb_hint
+        self.partition_hours = partition_hours
+        self.content_codec = content_codec
+
+        self.database_max_content_size_bytes = utils.gb_to_bytes(
+            max_database_size_gb_hint
+        )
+        self.database_max_size_bytes = utils.gb_to_bytes(max_database_size_gb_hint)
+
+        # Lock to serialize writes and changes to the set of partitions.
+        self.lock = threading.RLock()
+
+        # The number of callers using each partition outside of the lock. A partition is only closed and deleted once
+        # no caller is using it.
+        self.partition_users: Dict[int, int] = defaultdict(int)
+        self.partition_users_condition = threading.Condition()
+
+        # Callbacks to notify after every write to storage.
+        self.write_listeners: List[Callable[[Set[int]], None]] = []
+
+        # The last sample of the total content and database sizes, plus the sizes of everything stored since.
+        self.sizes_lock = threading.Lock()
+        self.sampled_content_size_bytes = 0
+        self.sampled_database_size_bytes = 0
+        self.sizes_sampled_at: Optional[dt.datetime] = None
+
+        # Open all existing partitions.
+        os.makedirs(self.directory, exist_ok=True)
+        self.partitions: Dict[int, SqliteMinerStorage] = {}
+        for filename in os.listdir(self.directory):
+            match = PartitionedSqliteMinerStorage.PARTITION_FILE_PATTERN.match(filename)
+            if match:
+                self._open_partition(int(match.group(1)))
+
+        bt.logging.trace(
+            f"Opened {len(self.partitions)} partitions in {self.directory}."
+        )
+
+    def _partition_path(self, partition_id: int) -> str:
+        return os.path.join(self.directory, f"partition_{partition_id}.sqlite")
+
+    def _partition_id(self, time_bucket_id: int) -> int:
+        """Returns the id of the partition that holds the provided time bucket."""
+        return time_bucket_id // self.partition_hours
+
+    def _open_partition(self, partition_id: int) -> SqliteMinerStorage:
+        """Opens the partition, creating it if necessary. Must be called while holding the lock."""
+        partition = self.partitions.get(partition_id, None)
+        if partition is None:
+            partition = SqliteMinerStorage(
+                self._partition_path(partition_id),
+                self.max_database_size_gb_hint,
+                self.content_codec,
+                cache_size_kib=PartitionedSqliteMinerStorage.PARTITION_CACHE_SIZE_KIB,
+                mmap_size_bytes=PartitionedSqliteMinerStorage.PARTITION_MMAP_SIZE_BYTES,
+            )
+            partition.add_write_listener(self._notify_write_listeners)
+            self.partitions[partition_id] = partition
+
+        return partition
+
+    @contextlib.contextmanager
+    def _use_partition(
+        self, partition_id: int
+    ) -> Iterator[Optional[SqliteMinerStorage]]:
+        """Yields the partition if it exists, keeping it from being dropped until exited."""
+        with self.lock:
+            partition = self.partitions.get(partition_id, None)
+            if partition is not None:
+                with self.partition_users_condition:
+                    self.partition_users[partition_id] += 1
+
+        if partition is None:
+            yield None
+            return
+
+        try:
+            yield partition
+        finally:
+            with self.partition_users_condition:
+                self.partition_users[partition_id] -= 1
+                if self.partition_users[partition_id] == 0:
+                    del self.partition_users[partition_id]
+                    self.partition_users_condition.notify_all()
+
+    def _partition_time_bucket_ids(self, partition_id: int) -> Set[int]:
+        """Returns the ids of all time buckets held by the partition."""
+        return set(
+            range(
+                partition_id * self.partition_hours,
+                (partition_id + 1) * self.partition_hours,
+            )
+        )
+
+    def _drop_partition(self, partition_id: int):
+        """Closes the partition and deletes its files once no caller is using it. Must be called while holding the lock.
+
+        Holding the lock keeps new callers from using the partition, or from reopening it, while it is dropped.
+        """
+        partition = self.partitions.pop(partition_id)
+        with self.partition_users_condition:
+            self.partition_users_condition.wait_for(
+                lambda: partition_id not in self.partition_users
+            )
+        partition.close()
+
+        path = self._partition_path(partition_id)
+        for suffix in ["", "-wal", "-shm"]:
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+        bt.logging.debug(f"Dropped partition {partition_id}.")
+
+    def _get_sorted_partitions(self) -> List[tuple]:
+        """Returns (partition_id, partition) pairs sorted from oldest to newest.
+
+        The partitions may be dropped once the lock is released, so only use them while holding the lock.
+        """
+        with self.lock:
+            return sorted(self.partitions.items())
+
+    def _get_sorted_partition_ids(self) -> List[int]:
+        """Returns the ids of all partitions sorted from oldest to newest."""
+        with self.lock:
+            return sorted(self.partitions.keys())
+
+    def _sum_over_partitions(self, read: Callable[[SqliteMinerStorage], int]) -> int:
+        """Sums the provided read over every partition, skipping any dropped meanwhile."""
+        total = 0
+        for partition_id in self._get_sorted_partition_ids():
+            with self._use_partition(partition_id) as partition:
+                if partition is not None:
+                    total += read(partition)
+        return total
+
+    def close(self):
+        """Closes all partitions."""
+        with self.lock:
+            for partition in self.partitions.values():
+                partition.close()
+            self.partitions = {}
+
+    def add_write_listener(self, listener: Callable[[Set[int]], None]):
+        """Registers a callback to be notified after every write to storage with the ids of the time buckets written."""
+        self.write_listeners.append(listener)
+
+    def _notify_write_listeners(self, time_bucket_ids: Set[int]):
+        for listener in self.write_listeners:
+            listener(time_bucket_ids)
+
+    def get_total_content_size_bytes(self) -> int:
+        """Gets the total size in bytes of all stored content."""
+        return self._sum_over_partitions(
+            lambda partition: partition.get_total_content_size_bytes()
+        )
+
+    def get_database_size_bytes(self) -> int:
+        """Gets the size in bytes of all partition files on disk, including indexes, row overhead and free pages."""
+        return self._sum_over_partitions(
+            lambda partition: partition.get_database_size_bytes()
+        )
+
+    def _sample_sizes(self) -> Tuple[int, int]:
+        """Returns the total content and database sizes, summed over the partitions at most once per
+        SqliteMinerStorage.DATABASE_SIZE_SAMPLE_INTERVAL. Stores since the last sample are added to it.
+        """
+        now = dt.datetime.now()
+        with self.sizes_lock:
+            is_stale = (
+                self.sizes_sampled_at is None
+                or now - self.sizes_sampled_at
+                >= SqliteMinerStorage.DATABASE_SIZE_SAMPLE_INTERVAL
+            )
+
+        # Summed without holding the sizes lock, since it takes the lock over the partitions.
+        if is_stale:
+            content_size = self.get_total_content_size_bytes()
+            database_size = self.get_database_size_bytes()
+            with self.sizes_lock:
+                self.sampled_content_size_bytes = content_size
+                self.sampled_database_size_bytes = database_size
+                self.sizes_sampled_at = now
+
+        with self.sizes_lock:
+            return self.sampled_content_size_bytes, self.sampled_database_size_bytes
+
+    def _invalidate_sampled_sizes(self):
+        """Resamples the sizes on the next store, after content has been cleared."""
+        with self.sizes_lock:
+            self.sizes_sampled_at = None
+
+    def get_database_files(self) -> List[str]:
+        """Gets the paths of the files backing every partition."""
+        return [
+            self._partition_path(partition_id) + suffix
+            for partition_id in self._get_sorted_partition_ids()
+            for suffix in ["", "-wal", "-shm"]
+        ]
+
+    def store_data_entities(self, data_entities: List[DataEntity]):
+        """Stores any number of DataEntities, making space if necessary."""
+
+        added_content_size = 0
+        added_database_size = 0
+        entities_by_partition_id = defaultdict(list)
+        for data_entity in data_entities:
+            added_content_size += data_entity.content_size_bytes
+            added_database_size += SqliteMinerStorage.estimate_row_size_bytes(
+                data_entity.uri, data_entity.content
+            )
+            time_bucket_id = TimeBucket.from_datetime(data_entity.datetime).id
+            entities_by_partition_id[self._partition_id(time_bucket_id)].append(
+                data_entity
+            )
+
+        # If the total size of the store is larger than our maximum configured stored content size then except.
+        if added_content_size > self.database_max_content_size_bytes:
+            raise ValueError(
+                "Content size to store: "
+                + str(added_content_size)
+                + " exceeds configured max: "
+                + str(self.database_max_content_size_bytes)
+            )
+
+        # Sampled before taking the lock, so summing over the partitions never holds up other stores.
+        current_content_size, current_database_size = self._sample_sizes()
+
+        with self.lock:
+            # If we would exceed our maximum configured stored content size or database size then clear space.
+            content_bytes_to_clear = SqliteMinerStorage.get_content_bytes_to_clear(
+                current_content_size=current_content_size,
+                added_content_size=added_content_size,
+                max_content_size=self.database_max_content_size_bytes,
+                current_database_size=current_database_size,
+                added_database_size=added_database_size,
+                max_database_size=self.database_max_size_bytes,
+            )
+            if content_bytes_to_clear > 0:
+                self.clear_content_from_oldest(content_bytes_to_clear)
+
+            for partition_id, entities in entities_by_partition_id.items():
+                self._open_partition(partition_id).store_data_entities(entities)
+
+        with self.sizes_lock:
+            self.sampled_content_size_bytes += added_content_size
+            self.sampled_database_size_bytes += added_database_size
+
+    def clear_content_from_oldest(self, content_bytes_to_clear: int):
+        """Drops whole partitions starting from the oldest until we have cleared the specified amount of content.
+
+        If a partition holds more than the remaining content to clear, only its oldest time buckets are deleted.
+        """
+
+        bt.logging.debug(f"Database full. Clearing {content_bytes_to_clear} bytes.")
+
+        dropped_time_bucket_ids = set()
+        with self.lock:
+            for partition_id, partition in self._get_sorted_partitions():
+                if content_bytes_to_clear <= 0:
+                    break
+
+                partition_size = partition.get_total_content_size_bytes()
+                if partition_size <= content_bytes_to_clear:
+                    self._drop_partition(partition_id)
+                    dropped_time_bucket_ids |= self._partition_time_bucket_ids(
+                        partition_id
+                    )
+                else:
+                    partition.clear_content_from_oldest(content_bytes_to_clear)
+                content_bytes_to_clear -= partition_size
+
+        self._invalidate_sampled_sizes()
+        self._notify_write_listeners(dropped_time_bucket_ids)
+
+    def drop_expired_partitions(self) -> int:
+        """Drops every partition whose data is entirely older than the age limit. Returns the bytes cleared."""
+
+        oldest_time_bucket_id = TimeBucket.from_datetime(
+            dt.datetime.now()
+            - dt.timedelta(constants.DATA_ENTITY_BUCKET_AGE_LIMIT_DAYS)
+        ).id
+
+        cleared_bytes = 0
+        dropped_time_bucket_ids = set()
+        with self.lock:
+            for partition_id, partition in self._get_sorted_partitions():
+                # Partitions are sorted, so stop at the first that still holds data within the age limit.
+                newest_time_bucket_id = (partition_id + 1) * self.partition_hours - 1
+                if newest_time_bucket_id >= oldest_time_bucket_id:
+                    break
+
+                cleared_bytes += partition.get_total_content_size_bytes()
+                self._drop_partition(partition_id)
+                dropped_time_bucket_ids |= self._partition_time_bucket_ids(partition_id)
+
+        if dropped_time_bucket_ids:
+            self._invalidate_sampled_sizes()
+            self._notify_write_listeners(dropped_time_bucket_ids)
+
+        return cleared_bytes
+
+    def delete_expired_data_entities(self) -> int:
+        """Deletes every DataEntity older than the age limit, returning the content bytes cleared.
+
+        Whole partitions are dropped, then the expired time buckets of the oldest remaining partition are deleted in
+        batches without holding the lock, so stores to newer partitions are never blocked.
+        """
+        cleared_bytes = self.drop_expired_partitions()
+
+        sorted_partition_ids = self._get_sorted_partition_ids()
+        if sorted_partition_ids:
+            with self._use_partition(sorted_partition_ids[0]) as oldest_partition:
+                if oldest_partition is not None:
+                    cleared_bytes += oldest_partition.delete_expired_data_entities()
+
+        self._invalidate_sampled_sizes()
+        return cleared_bytes
+
+    def list_data_entities_in_data_entity_bucket(
+        self, data_entity_bucket_id: DataEntityBucketId
+    ) -> List[DataEntity]:
+        """Lists from storage all DataEntities matching the provided DataEntityBucketId."""
+        with self._use_partition(
+            self._partition_id(data_entity_bucket_id.time_bucket.id)
+        ) as partition:
+            if partition is None:
+                return []
+
+            return partition.list_data_entities_in_data_entity_bucket(
+                data_entity_bucket_id
+            )
+
+    def get_serialized_data_entities_in_data_entity_bucket(
+        self, data_entity_bucket_id: DataEntityBucketId
+    ) -> SerializedDataEntities:
+        """Gets from storage all DataEntities matching the provided DataEntityBucketId, serialized for the wire."""
+        with self._use_partition(
+            self._partition_id(data_entity_bucket_id.time_bucket.id)
+        ) as partition:
+            if partition is None:
+                return SerializedDataEntities(
+                    serialized="[]", count=0, content_size_bytes=0
+                )
+
+            return partition.get_serialized_data_entities_in_data_entity_bucket(
+                data_entity_bucket_id
+            )
+
+    def get_compressed_index(
+        self,
+        bucket_count_limit=constants.DATA_ENTITY_BUCKET_COUNT_LIMIT_PER_MINER_INDEX,
+    ) -> CompressedMinerIndex:
+        """Gets the compressed MinedIndex, which is a summary of all of the DataEntities that this MinerStorage is currently serving."""
+
+        # Each partition's index holds its largest buckets, so the overall largest buckets are among them.
+        buckets = []
+        for partition_id in self._get_sorted_partition_ids():
+            with self._use_partition(partition_id) as partition:
+                if partition is None:
+                    continue
+                index = partition.get_compressed_index(
+                    bucket_count_limit=bucket_count_limit
+                )
+            for source, compressed_buckets in index.sources.items():
+                for compressed_bucket in compressed_buckets:
+                    for time_bucket_id, size_bytes in zip(
+                        compressed_bucket.time_bucket_ids, compressed_bucket.sizes_bytes
+                    ):
+                        buckets.append(
+                            (
+                                size_bytes,
+                                source,
+                                compressed_bucket.label,
+                                time_bucket_id,
+                            )
+                        )
+
+        buckets_by_source_by_label = defaultdict(dict)
+        for size_bytes, source, label, time_bucket_id in heapq.nlargest(
+            bucket_count_limit, buckets, key=lambda bucket: bucket[0]
+        ):
+            bucket = buckets_by_source_by_label[source].get(
+                label, CompressedEntityBucket(label=label)
+            )
+            bucket.sizes_bytes.append(size_bytes)
+            bucket.time_bucket_ids.append(time_bucket_id)
+            buckets_by_source_by_label[source][label] = bucket
+
+        return CompressedMinerIndex(
+            sources={
+                source: list(labels_to_buckets.values())
+                for source, labels_to_buckets in buckets_by_source_by_label.items()
+            }
+        )
+
+    def list_data_entity_buckets(self) -> List[DataEntityBucket]:
+        """Lists all DataEntityBuckets for all the DataEntities that this MinerStorage is currently serving."""
+        data_entity_buckets = []
+        for partition_id in self._get_sorted_partition_ids():
+            with self._use_partition(partition_id) as partition:
+                if partition is not None:
+                    data_entity_buckets.extend(partition.list_data_entity_buckets())
+
+        return heapq.nlargest(
+            constants.DATA_ENTITY_BUCKET_COUNT_LIMIT_PER_MINER_INDEX,
+            data_entity_buckets,
+            key=lambda bucket: bucket.size_bytes,
+        )
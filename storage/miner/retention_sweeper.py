@@ -0,0 +1,121 @@
+import dataclasses
+import datetime as dt
+import os
+import threading
+import traceback
+from typing import Optional
+import bittensor as bt
+from storage.miner.miner_storage import MinerStorage
+
+
+@dataclasses.dataclass(frozen=True)
+class RetentionMetrics:
+    """A snapshot of the RetentionSweeper's state."""
+
+    # The number of sweeps completed so far.
+    sweeps: int
+
+    # The total content bytes of expired DataEntities deleted so far.
+    content_bytes_cleared: int
+
+    # The total bytes the storage's files have shrunk by on disk across sweeps so far.
+    database_bytes_reclaimed: int
+
+    # How long the most recent sweep took.
+    last_sweep_latency: Optional[dt.timedelta]
+
+
+class RetentionSweeper:
+    """Deletes DataEntities older than the age limit from the MinerStorage on a background thread.
+
+    Expired data is never served, so it is deleted on a schedule rather than only once the storage fills up. The
+    storage deletes in small batches, so a sweep never blocks scrapers or requests for long.
+    """
+
+    def __init__(self, storage: MinerStorage, sweep_interval: dt.timedelta):
+        self.storage = storage
+        self.sweep_interval = sweep_interval
+
+        self.lock = threading.Lock()
+        self.sweeps = 0
+        self.content_bytes_cleared = 0
+        self.database_bytes_reclaimed = 0
+        self.last_sweep_latency: Optional[dt.timedelta] = None
+
+        self.stop_event = threading.Event()
+        self.is_running = False
+        self.thread: threading.Thread = None
+
+    def sweep(self) -> int:
+        """Deletes all expired DataEntities from the storage, returning the content bytes cleared."""
+        start = dt.datetime.now()
+        disk_size_before = self._get_disk_size_bytes()
+
+        content_bytes_cleared = self.storage.delete_expired_data_entities()
+
+        database_bytes_reclaimed = max(
+            0, disk_size_before - self._get_disk_size_bytes()
+        )
+        latency = dt.datetime.now() - start
+        with self.lock:
+            self.sweeps += 1
+            self.content_bytes_cleared += content_bytes_cleared
+            self.database_bytes_reclaimed += database_bytes_reclaimed
+            self.last_sweep_latency = latency
+
+        bt.logging.info(
+            f"Retention sweep cleared {content_bytes_cleared} content bytes and reclaimed {database_bytes_reclaimed} bytes on disk in {latency}."
+        )
+        return content_bytes_cleared
+
+    def _get_disk_size_bytes(self) -> int:
+        """Returns the size on disk of the storage's files.
+
+        Unlike the storage's database size, this only shrinks once freed space has been returned to the file system.
+        """
+        size = 0
+        for path in self.storage.get_database_files():
+            try:
+                size += os.path.getsize(path)
+            except FileNotFoundError:
+                # The file was never created, or was dropped meanwhile.
+                pass
+        return size
+
+    def get_metrics(self) -> RetentionMetrics:
+        """Returns a snapshot of the sweeper's state."""
+        with self.lock:
+            return RetentionMetrics(
+                sweeps=self.sweeps,
+                content_bytes_cleared=self.content_bytes_cleared,
+                database_bytes_reclaimed=self.database_bytes_reclaimed,
+                last_sweep_latency=self.last_sweep_latency,
+            )
+
+    def run_in_background_thread(self):
+        """Sweeps the storage on a background thread until stopped."""
+        assert not self.is_running, "RetentionSweeper already running"
+
+        bt.logging.info("Starting RetentionSweeper in a background thread.")
+
+        self.is_running = True
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        """Blocking call to sweep the storage every sweep_interval until stopped."""
+        while self.is_running:
+            try:
+                self.sweep()
+            except Exception:
+                bt.logging.error(
+                    f"Failed to sweep expired data: {traceback.format_exc()}"
+                )
+
+            self.stop_event.wait(timeout=self.sweep_interval.total_seconds())
+
+    def stop(self):
+        bt.logging.info("Stopping the RetentionSweeper.")
+        self.is_running = False
+        self.stop_event.set()
@@ -0,0 +1,1279 @@
+import contextlib
+import hashlib
+import heapq
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import zlib
+from collections import OrderedDict, defaultdict
+import numpy as np
+from common import constants, utils
+from common.data import (
+    CompressedEntityBucket,
+    CompressedMinerIndex,
+    DataEntity,
+    DataEntityBucket,
+    DataEntityBucketId,
+    DataLabel,
+    DataSource,
+    TimeBucket,
+)
+from storage.miner import content_codec as content_codec_utils
+from storage.miner.content_codec import ContentCodec
+from storage.miner.miner_storage import MinerStorage, SerializedDataEntities
+from storage.miner.sqlite_miner_storage import (
+    SqliteMinerStorage,
+    datetime_to_epoch_micros,
+    epoch_micros_to_datetime,
+)
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+import datetime as dt
+import bittensor as bt
+
+# Identifies a DataEntityBucket in the index as (timeBucketId, source, label).
+BucketKey = Tuple[int, int, Optional[str]]
+
+# The location of a record within its segment as (offset, length, contentSizeBytes).
+RecordLocation = Tuple[int, int, int]
+
+# One entry per record, appended to the segment's index file as the record is appended to the segment. Unpadded and
+# little endian, so the file is read straight into an array on startup. The uri and content are identified by the
+# first 8 bytes of their hashes, which are checked against the record itself on a match.
+INDEX_ENTRY = np.dtype(
+    [
+        ("uri_hash", "<u8"),
+        ("content_hash", "<u8"),
+        ("sequence", "<i8"),
+        ("offset", "<u8"),
+        ("length", "<u4"),
+        ("content_size_bytes", "<i8"),
+        ("source", "u1"),
+        ("label_id", "<i4"),
+    ]
+)
+
+# The label id of entities without a label.
+NO_LABEL_ID = -1
+
+# Records are located across segments by a single int64, packing the time bucket id above the entry's row.
+ROW_BITS = 32
+MAX_ROW = (1 << ROW_BITS) - 1
+
+
+def pack_location(time_bucket_id: int, row: int) -> int:
+    """Packs the location of a segment's index entry into an int64."""
+    return (time_bucket_id << ROW_BITS) | row
+
+
+def unpack_location(location: int) -> Tuple[int, int]:
+    """Unpacks an int64 location into the (time_bucket_id, row) of the index entry."""
+    return location >> ROW_BITS, location & MAX_ROW
+
+
+def hash_uri(uri: str) -> int:
+    """Returns the key of a uri in the index."""
+    return int.from_bytes(
+        hashlib.blake2b(uri.encode(), digest_size=8).digest(), "little"
+    )
+
+
+def hash_content_key(content_hash: bytes) -> int:
+    """Returns the key of a sha1 content hash in the index."""
+    return int.from_bytes(content_hash[:8], "little")
+
+
+class _KeyIndex:
+    """Maps uint64 keys to non-negative int64 values, in 16 bytes per key.
+
+    Keys are held in a sorted array and found by binary search. Recent changes are held in a dict, with -1 marking a
+    removed key, until MAX_PENDING have built up and they are merged into the arrays.
+    """
+
+    MAX_PENDING = 1 << 16
+
+    def __init__(self, keys: np.ndarray, values: np.ndarray):
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order].astype(np.uint64)
+        self.values = values[order].astype(np.int64)
+        self.pending: Dict[int, int] = {}
+
+    def get(self, key: int) -> Optional[int]:
+        value = self.pending.get(key, None)
+        if value is None:
+            i = int(self.keys.searchsorted(np.uint64(key)))
+            if i < len(self.keys) and int(self.keys[i]) == key:
+                value = int(self.values[i])
+        return None if value is None or value < 0 else value
+
+    def set(self, key: int, value: int):
+        self.pending[key] = value
+        if len(self.pending) >= _KeyIndex.MAX_PENDING:
+            self._merge()
+
+    def remove(self, key: int):
+        self.set(key, -1)
+
+    def get_many(self, keys: np.ndarray) -> np.ndarray:
+        """Returns the value of each key, or -1 for keys that are not present."""
+        self._merge()
+        positions = np.searchsorted(self.keys, keys)
+        values = np.full(len(keys), -1, dtype=np.int64)
+        found = positions < len(self.keys)
+        found[found] = self.keys[positions[found]] == keys[found]
+        values[found] = self.values[positions[found]]
+        return values
+
+    def remove_many(self, keys: np.ndarray):
+        self._merge()
+        self._delete(keys)
+
+    def _delete(self, keys: np.ndarray):
+        positions = np.searchsorted(self.keys, keys)
+        found = positions < len(self.keys)
+        found[found] = self.keys[positions[found]] == keys[found]
+        self.keys = np.delete(self.keys, positions[found])
+        self.values = np.delete(self.values, positions[found])
+
+    def _merge(self):
+        """Merges the pending changes into the sorted arrays."""
+        if not self.pending:
+            return
+
+        keys = np.fromiter(
+            self.pending.keys(), dtype=np.uint64, count=len(self.pending)
+        )
+        values = np.fromiter(
+            self.pending.values(), dtype=np.int64, count=len(self.pending)
+        )
+        self.pending = {}
+
+        # Drop the old value of every changed key, then insert the current ones in order.
+        self._delete(keys)
+        keys, values = keys[values >= 0], values[values >= 0]
+        order = np.argsort(keys)
+        keys, values = keys[order], values[order]
+        positions = np.searchsorted(self.keys, keys)
+        self.keys = np.insert(self.keys, positions, keys)
+        self.values = np.insert(self.values, positions, values)
+
+
+class _Mapping:
+    """A read-only memory map of a segment, shared by readers.
+
+    The map holds its own file descriptor, so it is closed as soon as it has been retired and every reader has
+    released it, rather than whenever it is garbage collected.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.lock = threading.Lock()
+        self.users = 0
+        self.is_retired = False
+
+    def acquire(self) -> "_Mapping":
+        with self.lock:
+            self.users += 1
+        return self
+
+    def release(self):
+        with self.lock:
+            self.users -= 1
+            self._close_if_unused()
+
+    def retire(self):
+        """Closes the map once no reader is using it. It must not be acquired again."""
+        with self.lock:
+            self.is_retired = True
+            self._close_if_unused()
+
+    def _close_if_unused(self):
+        if self.is_retired and self.users == 0:
+            self.mmap.close()
+
+    def __enter__(self) -> mmap.mmap:
+        return self.mmap
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class _Segment:
+    """An append-only log file of the records of a single time bucket, read through a memory map.
+
+    The index file beside it holds an INDEX_ENTRY per record, in the same order. Its entries are also kept in memory,
+    along with whether each record is live or has been superseded.
+
+    There is a segment per time bucket, so file handles and maps are only held while a segment is in use. The storage
+    bounds how many segments hold each at once.
+    """
+
+    def __init__(self, path: str, index_path: str):
+        self.path = path
+        self.index_path = index_path
+        self.size = os.path.getsize(path) if os.path.exists(path) else 0
+
+        # Opened on the first append and closed by close_files.
+        self.file = None
+        self.index_file = None
+
+        # Whether records have been appended since the files were last synced to disk.
+        self.is_dirty = False
+
+        # Grown by doubling, so only the first count entries are in use.
+        self.entries = np.zeros(0, dtype=INDEX_ENTRY)
+        self.live = np.zeros(0, dtype=bool)
+        self.count = 0
+
+        # Replaced once the file has grown past the mapped size.
+        self.mapping: Optional[_Mapping] = None
+
+    @property
+    def index_size(self) -> int:
+        return self.count * INDEX_ENTRY.itemsize
+
+    @property
+    def is_open(self) -> bool:
+        return self.file is not None
+
+    @property
+    def is_mapped(self) -> bool:
+        return self.mapping is not None
+
+    def read_index(self) -> np.ndarray:
+        """Reads the entries of the index file, ignoring a partially written entry at its end."""
+        if not os.path.exists(self.index_path):
+            return np.zeros(0, dtype=INDEX_ENTRY)
+
+        count = os.path.getsize(self.index_path) // INDEX_ENTRY.itemsize
+        return np.fromfile(self.index_path, dtype=INDEX_ENTRY, count=count)
+
+    def load_index(self, entries: np.ndarray):
+        """Truncates the index file to the provided entries, which must be a prefix of it, and adds them to memory."""
+        with open(self.index_path, "ab") as file:
+            file.truncate(len(entries) * INDEX_ENTRY.itemsize)
+        self._add_entries(entries)
+
+    def _add_entries(self, entries: np.ndarray) -> int:
+        """Adds the entries to memory, returning the row of the first."""
+        row = self.count
+        if self.count + len(entries) > len(self.entries):
+            capacity = max(2 * len(self.entries), self.count + len(entries), 16)
+            self.entries = np.resize(self.entries, capacity)
+            self.live = np.resize(self.live, capacity)
+        self.entries[row : row + len(entries)] = entries
+        self.live[row : row + len(entries)] = False
+        self.count += len(entries)
+        return row
+
+    def append(self, data: bytes, entries: np.ndarray, sync: bool) -> int:
+        """Appends the records and then their index entries, returning the row of the first entry.
+
+        If sync, the records are synced to disk before their entries are written, so an entry never outlives its
+        record.
+        """
+        if self.file is None:
+            self.file = open(self.path, "ab")
+            self.index_file = open(self.index_path, "ab")
+
+        self.file.write(data)
+        self.size += len(data)
+        self.file.flush()
+        if sync:
+            os.fsync(self.file.fileno())
+
+        self.index_file.write(entries.tobytes())
+        self.index_file.flush()
+        if sync:
+            os.fsync(self.index_file.fileno())
+        else:
+            self.is_dirty = True
+
+        return self._add_entries(entries)
+
+    def close_files(self, sync: bool = True):
+        """Closes the files, first syncing records not yet synced to disk if sync."""
+        for file in (self.file, self.index_file):
+            if file is not None:
+                file.flush()
+                if sync and self.is_dirty:
+                    os.fsync(file.fileno())
+                file.close()
+        self.file = None
+        self.index_file = None
+        self.is_dirty = False
+
+    def acquire_mmap(self) -> _Mapping:
+        """Returns a memory map covering every record appended so far, which must be released after use."""
+        if self.mapping is None or len(self.mapping.mmap) < self.size:
+            self.release_mmap()
+            self.mapping = _Mapping(self.path)
+        return self.mapping.acquire()
+
+    def release_mmap(self):
+        """Retires the memory map, which is closed once its readers release it."""
+        if self.mapping is not None:
+            self.mapping.retire()
+            self.mapping = None
+
+    def truncate(self, size: int):
+        """Drops everything past size, e.g. a record torn by a crash. No reader may be using the map."""
+        self.release_mmap()
+        with open(self.path, "r+b") as file:
+            file.truncate(size)
+        self.size = size
+
+    def close(self, sync: bool = True):
+        self.close_files(sync)
+        self.release_mmap()
+
+
+class SegmentLogMinerStorage(MinerStorage):
+    """MinerStorage that appends DataEntities to one log file, or segment, per time bucket.
+
+    Scraped data is written once and expires by age, so records are only ever appended and space is reclaimed by
+    deleting whole segments. Each segment has an index file beside it with a fixed width entry per record, which is
+    read into compact arrays on startup. Only records past the end of an index file, e.g. after a crash, are scanned.
+    Bucket reads are slices of the segment's memory map.
+
+    Only the most recently written and read segments keep their files open and mapped, so the storage holds a bounded
+    number of file descriptors however many segments there are.
+
+    Storing a uri again appends a new record that supersedes the old one, which stays on disk until its segment is
+    dropped. By default, records and their index entries are synced to disk after every store. With
+    sync_every_store=False they are only flushed to the OS, and synced on close, so stores are faster but a power loss
+    can lose the most recent ones. A record torn by a crash is truncated away on startup.
+    """
+
+    SEGMENT_FILE_PATTERN = re.compile(r"^segment_(\d+)\.log$")
+
+    LABELS_FILE = "labels.jsonl"
+
+    # crc32 of the rest of the record, uri length, label length, content length, sequence, datetime in epoch
+    # microseconds, contentSizeBytes, source, contentCodec, whether there is a label and the sha1 of the content.
+    # Followed by the uri, label and content.
+    RECORD_HEADER = struct.Struct("<IIIIqqqBBB20s")
+
+    # The most segments to keep open for appending, and mapped for reading, at once. Each holds two and one file
+    # descriptors respectively.
+    MAX_OPEN_SEGMENTS = 8
+    MAX_MAPPED_SEGMENTS = 64
+
+    def __init__(
+        self,
+        directory="SegmentLogMinerStorage",
+        max_database_size_gb_hint=250,
+        content_codec=ContentCodec.NONE,
+        sync_every_store=True,
+    ):
+        self.directory = directory
+        self.sync_every_store = sync_every_store
+
+        # The codec used to compress newly stored content. contentSizeBytes always reports the uncompressed size.
+        content_codec_utils.check_available(content_codec)
+        self.content_codec = ContentCodec(content_codec)
+
+        self.database_max_content_size_bytes = utils.gb_to_bytes(
+            max_database_size_gb_hint
+        )
+        self.database_max_size_bytes = utils.gb_to_bytes(max_database_size_gb_hint)
+
+        # Lock to serialize writes and guard the index. Reads only hold it to snapshot the index.
+        self.lock = threading.RLock()
+
+        # Callbacks to notify after every write to storage.
+        self.write_listeners: List[Callable[[Set[int]], None]] = []
+
+        self.segments: Dict[int, _Segment] = {}
+
+        # The ids of the segments that are open for appending and that are mapped, from least to most recently used.
+        self.open_segment_ids: OrderedDict[int, None] = OrderedDict()
+        self.mapped_segment_ids: OrderedDict[int, None] = OrderedDict()
+        self.bucket_sizes: Dict[BucketKey, int] = defaultdict(int)
+        self.bucket_counts: Dict[BucketKey, int] = defaultdict(int)
+        self.bucket_keys_by_time_bucket: Dict[int, Set[BucketKey]] = defaultdict(set)
+        self.total_content_size_bytes = 0
+
+        # The packed location of the live record of each uri, and of the first uri stored with each content.
+        self.locations_by_uri = _KeyIndex(
+            np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64)
+        )
+        self.locations_by_content_hash = _KeyIndex(
+            np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64)
+        )
+
+        # Interns label values, so index entries store a small integer. Labels are never removed, so ids are stable.
+        self.labels: List[str] = []
+        self.label_ids: Dict[str, int] = {}
+        self.labels_file = None
+
+        # Orders all records, so the latest record for a uri wins when rebuilding the index.
+        self.next_sequence = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_labels()
+        self._load_segments()
+
+    def _segment_path(self, time_bucket_id: int) -> str:
+        return os.path.join(self.directory, f"segment_{time_bucket_id}.log")
+
+    def _index_path(self, time_bucket_id: int) -> str:
+        return os.path.join(self.directory, f"segment_{time_bucket_id}.idx")
+
+    def _load_labels(self):
+        """Reads the labels file, dropping a line torn by a crash."""
+        path = os.path.join(self.directory, SegmentLogMinerStorage.LABELS_FILE)
+        valid_size = 0
+        if os.path.exists(path):
+            with open(path, "rb") as file:
+                data = file.read()
+            for line in data.splitlines(keepends=True):
+                if not line.endswith(b"\n"):
+                    break
+                label = sys.intern(json.loads(line))
+                self.label_ids[label] = len(self.labels)
+                self.labels.append(label)
+                valid_size += len(line)
+
+        self.labels_file = open(path, "ab")
+        self.labels_file.truncate(valid_size)
+
+    def _get_or_add_label_id(self, label: Optional[str]) -> int:
+        """Returns the id of the label value, adding it to the labels file if new. Must be called while holding the lock."""
+        if label is None:
+            return NO_LABEL_ID
+
+        label_id = self.label_ids.get(label, None)
+        if label_id is None:
+            self.labels_file.write(json.dumps(label).encode() + b"\n")
+            self.labels_file.flush()
+            if self.sync_every_store:
+                os.fsync(self.labels_file.fileno())
+
+            label_id = len(self.labels)
+            self.label_ids[label] = label_id
+            self.labels.append(sys.intern(label))
+
+        return label_id
+
+    def _get_label(self, label_id: int) -> Optional[str]:
+        return None if label_id == NO_LABEL_ID else self.labels[label_id]
+
+    def _load_segments(self):
+        """Opens every existing segment and rebuilds the in-memory index from their index files."""
+        for filename in os.listdir(self.directory):
+            match = SegmentLogMinerStorage.SEGMENT_FILE_PATTERN.match(filename)
+            if not match:
+                continue
+
+            time_bucket_id = int(match.group(1))
+            segment = _Segment(
+                self._segment_path(time_bucket_id), self._index_path(time_bucket_id)
+            )
+            self.segments[time_bucket_id] = segment
+
+            # Trust the index entries up to the first whose record or label was lost, then scan the records after it.
+            entries = segment.read_index()
+            is_valid = (entries["offset"] + entries["length"] <= segment.size) & (
+                entries["label_id"] < len(self.labels)
+            )
+            if not is_valid.all():
+                entries = entries[: np.argmin(is_valid)]
+            segment.load_index(entries)
+
+            indexed_size = (
+                int(entries["offset"][-1]) + int(entries["length"][-1])
+                if len(entries)
+                else 0
+            )
+            if indexed_size < segment.size:
+                self._index_segment_tail(segment, indexed_size)
+
+        self._rebuild_index()
+
+        bt.logging.trace(
+            f"Opened {len(self.segments)} segments holding {len(self.locations_by_uri.keys)} data entities in {self.directory}."
+        )
+
+    def _index_segment_tail(self, segment: _Segment, offset: int):
+        """Scans the records from offset to the end of the segment, appending an index entry for each.
+
+        Records past the index are not trusted, so each is checked and a torn record is truncated away.
+        """
+        bt.logging.info(
+            f"Indexing records from offset {offset} of {segment.path}. This may take a while for large segments."
+        )
+
+        entries = []
+        with segment.acquire_mmap() as view:
+            while offset < segment.size:
+                record = self._read_record(view, offset, segment.size)
+                if record is None:
+                    break
+
+                (
+                    uri,
+                    label,
+                    sequence,
+                    content_size,
+                    content_hash,
+                    source,
+                    length,
+                ) = record
+                entries.append(
+                    (
+                        hash_uri(uri),
+                        hash_content_key(content_hash),
+                        sequence,
+                        offset,
+                        length,
+                        content_size,
+                        source,
+                        self._get_or_add_label_id(label),
+                    )
+                )
+                offset += length
+
+        if offset < segment.size:
+            bt.logging.warning(
+                f"Truncating torn record at offset {offset} of {segment.path}."
+            )
+            segment.truncate(offset)
+
+        segment.append(b"", np.array(entries, dtype=INDEX_ENTRY), sync=True)
+        segment.close_files()
+
+    def _rebuild_index(self):
+        """Marks the latest record of each uri as live and indexes it, across every segment's entries."""
+        if not self.segments:
+            return
+
+        time_bucket_ids = list(self.segments)
+        entries = np.concatenate(
+            [
+                self.segments[i].entries[: self.segments[i].count]
+                for i in time_bucket_ids
+            ]
+        )
+        locations = np.concatenate(
+            [
+                (np.int64(i) << ROW_BITS)
+                | np.arange(self.segments[i].count, dtype=np.int64)
+                for i in time_bucket_ids
+            ]
+        )
+        if len(entries) == 0:
+            return
+        self.next_sequence = int(entries["sequence"].max()) + 1
+
+        # Sort by uri then sequence, so the last entry of each uri is its latest record.
+        order = np.lexsort((entries["sequence"], entries["uri_hash"]))
+        uri_hashes = entries["uri_hash"][order]
+        is_latest = np.append(uri_hashes[1:] != uri_hashes[:-1], True)
+        live = order[is_latest]
+
+        self.locations_by_uri = _KeyIndex(uri_hashes[is_latest], locations[live])
+        content_hashes, first = np.unique(
+            entries["content_hash"][live], return_index=True
+        )
+        self.locations_by_content_hash = _KeyIndex(
+            content_hashes, locations[live][first]
+        )
+
+        # Mark the live entries of each segment and total up their buckets.
+        is_live = np.zeros(len(entries), dtype=bool)
+        is_live[live] = True
+        start = 0
+        for time_bucket_id in time_bucket_ids:
+            segment = self.segments[time_bucket_id]
+            segment.live[: segment.count] = is_live[start : start + segment.count]
+            start += segment.count
+
+            live_entries = segment.entries[: segment.count][
+                segment.live[: segment.count]
+            ]
+            bucket_ids, inverse = np.unique(
+                (live_entries["label_id"].astype(np.int64) << 8)
+                | live_entries["source"],
+                return_inverse=True,
+            )
+            sizes = np.bincount(
+                inverse,
+                weights=live_entries["content_size_bytes"],
+                minlength=len(bucket_ids),
+            )
+            counts = np.bincount(inverse, minlength=len(bucket_ids))
+            for bucket_id, size, count in zip(bucket_ids, sizes, counts):
+                key = (
+                    time_bucket_id,
+                    int(bucket_id) & 0xFF,
+                    self._get_label(int(bucket_id) >> 8),
+                )
+                self.bucket_sizes[key] = int(size)
+                self.bucket_counts[key] = int(count)
+                self.bucket_keys_by_time_bucket[time_bucket_id].add(key)
+                self.total_content_size_bytes += int(size)
+
+    def _read_record(self, view: mmap.mmap, offset: int, size: int) -> Optional[tuple]:
+        """Reads the record at offset for indexing, or returns None if it is incomplete or corrupt."""
+        header = SegmentLogMinerStorage.RECORD_HEADER
+        if offset + header.size > size:
+            return None
+
+        (
+            crc,
+            uri_length,
+            label_length,
+            content_length,
+            sequence,
+            _,
+            content_size,
+            source,
+            _,
+            has_label,
+            content_hash,
+        ) = header.unpack_from(view, offset)
+        length = header.size + uri_length + label_length + content_length
+        if offset + length > size:
+            return None
+
+        with memoryview(view) as record:
+            if zlib.crc32(record[offset + 4 : offset + length]) != crc:
+                return None
+
+        uri_offset = offset + header.size
+        uri = view[uri_offset : uri_offset + uri_length].decode()
+        label = None
+        if has_label:
+            label = sys.intern(
+                view[
+                    uri_offset + uri_length : uri_offset + uri_length + label_length
+                ].decode()
+            )
+
+        return uri, label, sequence, content_size, content_hash, source, length
+
+    def _acquire_mmap(self, time_bucket_id: int) -> _Mapping:
+        """Returns the segment's memory map, which must be released after use. Must be called while holding the lock.
+
+        Retires the maps of the least recently used segments beyond MAX_MAPPED_SEGMENTS.
+        """
+        mapping = self.segments[time_bucket_id].acquire_mmap()
+        self.mapped_segment_ids[time_bucket_id] = None
+        self.mapped_segment_ids.move_to_end(time_bucket_id)
+        while len(self.mapped_segment_ids) > SegmentLogMinerStorage.MAX_MAPPED_SEGMENTS:
+            lru_time_bucket_id, _ = self.mapped_segment_ids.popitem(last=False)
+            self.segments[lru_time_bucket_id].release_mmap()
+        return mapping
+
+    def _append_to_segment(
+        self, time_bucket_id: int, data: bytes, entries: np.ndarray
+    ) -> int:
+        """Appends to the segment, returning the row of the first entry. Must be called while holding the lock.
+
+        Closes the files of the least recently written segments beyond MAX_OPEN_SEGMENTS.
+        """
+        row = self.segments[time_bucket_id].append(
+            data, entries, sync=self.sync_every_store
+        )
+        self.open_segment_ids[time_bucket_id] = None
+        self.open_segment_ids.move_to_end(time_bucket_id)
+        while len(self.open_segment_ids) > SegmentLogMinerStorage.MAX_OPEN_SEGMENTS:
+            lru_time_bucket_id, _ = self.open_segment_ids.popitem(last=False)
+            self.segments[lru_time_bucket_id].close_files()
+        return row
+
+    def _read_uri_and_content_hash(self, location: int) -> Tuple[str, bytes]:
+        """Reads the uri and the sha1 of the content of the record at the location. Must be called while holding the lock."""
+        time_bucket_id, row = unpack_location(location)
+        offset = int(self.segments[time_bucket_id].entries[row]["offset"])
+        header = SegmentLogMinerStorage.RECORD_HEADER
+        with self._acquire_mmap(time_bucket_id) as view:
+            fields = header.unpack_from(view, offset)
+            uri_offset = offset + header.size
+            return view[uri_offset : uri_offset + fields[1]].decode(), fields[10]
+
+    def _get_location_by_uri(self, uri: str) -> Optional[int]:
+        """Returns the location of the uri's live record, if any. Must be called while holding the lock."""
+        location = self.locations_by_uri.get(hash_uri(uri))
+        if location is None or self._read_uri_and_content_hash(location)[0] != uri:
+            return None
+        return location
+
+    def _get_uri_by_content_hash(self, content_hash: bytes) -> Optional[str]:
+        """Returns the uri stored with the content, if any. Must be called while holding the lock."""
+        location = self.locations_by_content_hash.get(hash_content_key(content_hash))
+        if location is None:
+            return None
+
+        uri, stored_content_hash = self._read_uri_and_content_hash(location)
+        return uri if stored_content_hash == content_hash else None
+
+    def _encode_record(
+        self, data_entity: DataEntity, sequence: int, content_hash: bytes
+    ) -> bytes:
+        """Encodes the DataEntity as a record to append to its segment."""
+        uri = data_entity.uri.encode()
+        label = b"" if data_entity.label is None else data_entity.label.value.encode()
+        content, content_codec = content_codec_utils.encode(
+            data_entity.content, self.content_codec
+        )
+
+        body = (
+            SegmentLogMinerStorage.RECORD_HEADER.pack(
+                0,
+                len(uri),
+                len(label),
+                len(content),
+                sequence,
+                datetime_to_epoch_micros(data_entity.datetime),
+                data_entity.content_size_bytes,
+                data_entity.source,
+                content_codec,
+                data_entity.label is not None,
+                content_hash,
+            )[4:]
+            + uri
+            + label
+            + content
+        )
+        return struct.pack("<I", zlib.crc32(body)) + body
+
+    def _get_bucket_key(self, time_bucket_id: int, entry) -> BucketKey:
+        return (
+            time_bucket_id,
+            int(entry["source"]),
+            self._get_label(int(entry["label_id"])),
+        )
+
+    def _index_record(self, location: int):
+        """Marks the record at the location as its uri's live record. Must be called while holding the lock."""
+        time_bucket_id, row = unpack_location(location)
+        segment = self.segments[time_bucket_id]
+        entry = segment.entries[row]
+        segment.live[row] = True
+
+        key = self._get_bucket_key(time_bucket_id, entry)
+        content_size = int(entry["content_size_bytes"])
+        self.bucket_sizes[key] += content_size
+        self.bucket_counts[key] += 1
+        self.bucket_keys_by_time_bucket[time_bucket_id].add(key)
+        self.total_content_size_bytes += content_size
+
+        self.locations_by_uri.set(int(entry["uri_hash"]), location)
+        if self.locations_by_content_hash.get(int(entry["content_hash"])) is None:
+            self.locations_by_content_hash.set(int(entry["content_hash"]), location)
+
+    def _unindex_record(self, location: int) -> BucketKey:
+        """Removes the live record at the location from the index, returning its bucket.
+
+        Must be called while holding the lock.
+        """
+        time_bucket_id, row = unpack_location(location)
+        segment = self.segments[time_bucket_id]
+        entry = segment.entries[row]
+        segment.live[row] = False
+
+        key = self._get_bucket_key(time_bucket_id, entry)
+        content_size = int(entry["content_size_bytes"])
+        self.bucket_sizes[key] -= content_size
+        self.bucket_counts[key] -= 1
+        self.total_content_size_bytes -= content_size
+        if self.bucket_counts[key] == 0:
+            del self.bucket_sizes[key]
+            del self.bucket_counts[key]
+            self.bucket_keys_by_time_bucket[time_bucket_id].discard(key)
+
+        self.locations_by_uri.remove(int(entry["uri_hash"]))
+        if self.locations_by_content_hash.get(int(entry["content_hash"])) == location:
+            self.locations_by_content_hash.remove(int(entry["content_hash"]))
+
+        return key
+
+    def close(self):
+        """Syncs and closes all segments."""
+        with self.lock:
+            for segment in self.segments.values():
+                segment.close()
+            self.segments = {}
+            self.open_segment_ids.clear()
+            self.mapped_segment_ids.clear()
+            self.labels_file.close()
+
+    def add_write_listener(self, listener: Callable[[Set[int]], None]):
+        """Registers a callback to be notified after every write to storage with the ids of the time buckets written."""
+        self.write_listeners.append(listener)
+
+    def _notify_write_listeners(self, time_bucket_ids: Set[int]):
+        for listener in self.write_listeners:
+            listener(time_bucket_ids)
+
+    def get_total_content_size_bytes(self) -> int:
+        """Gets the total size in bytes of all stored content."""
+        with self.lock:
+            return self.total_content_size_bytes
+
+    def get_database_size_bytes(self) -> int:
+        """Gets the size in bytes of all segments and their index files, including records since superseded."""
+        with self.lock:
+            return sum(
+                segment.size + segment.index_size for segment in self.segments.values()
+            )
+
+    def get_database_files(self) -> List[str]:
+        """Gets the paths of every segment, its index file and the labels file."""
+        with self.lock:
+            return [
+                path
+                for segment in self.segments.values()
+                for path in (segment.path, segment.index_path)
+            ] + [self.labels_file.name]
+
+    def store_data_entities(self, data_entities: List[DataEntity]):
+        """Stores any number of DataEntities, making space if necessary."""
+
+        added_content_size = 0
+        for data_entity in data_entities:
+            added_content_size += data_entity.content_size_bytes
+
+        # If the total size of the store is larger than our maximum configured stored content size then except.
+        if added_content_size > self.database_max_content_size_bytes:
+            raise ValueError(
+                "Content size to store: "
+                + str(added_content_size)
+                + " exceeds configured max: "
+                + str(self.database_max_content_size_bytes)
+            )
+
+        # Only the last entity for each uri is stored, then only the first uri for each content.
+        entities_by_uri = {
+            data_entity.uri: data_entity for data_entity in data_entities
+        }
+        entities_by_content_hash: Dict[bytes, DataEntity] = {}
+        for data_entity in entities_by_uri.values():
+            entities_by_content_hash.setdefault(
+                hashlib.sha1(data_entity.content).digest(), data_entity
+            )
+
+        written_time_bucket_ids = set()
+        with self.lock:
+            # Drop any segments that have aged out before checking for space.
+            self.drop_expired_segments()
+
+            records = []
+            for content_hash, data_entity in entities_by_content_hash.items():
+                records.append(
+                    (
+                        data_entity,
+                        content_hash,
+                        self.next_sequence,
+                        self._encode_record(
+                            data_entity, self.next_sequence, content_hash
+                        ),
+                    )
+                )
+                self.next_sequence += 1
+
+            # If we would exceed our maximum configured stored content size or database size then clear space.
+            content_bytes_to_clear = SqliteMinerStorage.get_content_bytes_to_clear(
+                current_content_size=self.total_content_size_bytes,
+                added_content_size=added_content_size,
+                max_content_size=self.database_max_content_size_bytes,
+                current_database_size=self.get_database_size_bytes(),
+                added_database_size=sum(
+                    len(record) + INDEX_ENTRY.itemsize for *_, record in records
+                ),
+                max_database_size=self.database_max_size_bytes,
+            )
+            if content_bytes_to_clear > 0:
+                self.clear_content_from_oldest(content_bytes_to_clear)
+
+            # Drop entities whose content is already stored under a different uri, grouping the rest by segment.
+            records_by_time_bucket = defaultdict(list)
+            for record in records:
+                data_entity, content_hash = record[0], record[1]
+                if self._get_uri_by_content_hash(content_hash) in (
+                    None,
+                    data_entity.uri,
+                ):
+                    records_by_time_bucket[
+                        TimeBucket.from_datetime(data_entity.datetime).id
+                    ].append(record)
+
+            stored_count = sum(len(group) for group in records_by_time_bucket.values())
+            if stored_count < len(data_entities):
+                bt.logging.trace(
+                    f"Dropped {len(data_entities) - stored_count} data entities with duplicate content."
+                )
+
+            for time_bucket_id, records in records_by_time_bucket.items():
+                segment = self.segments.get(time_bucket_id, None)
+                if segment is None:
+                    segment = _Segment(
+                        self._segment_path(time_bucket_id),
+                        self._index_path(time_bucket_id),
+                    )
+                    segment.load_index(np.zeros(0, dtype=INDEX_ENTRY))
+                    self.segments[time_bucket_id] = segment
+
+                entries = np.zeros(len(records), dtype=INDEX_ENTRY)
+                offset = segment.size
+                for i, (data_entity, content_hash, sequence, record) in enumerate(
+                    records
+                ):
+                    entries[i] = (
+                        hash_uri(data_entity.uri),
+                        hash_content_key(content_hash),
+                        sequence,
+                        offset,
+                        len(record),
+                        data_entity.content_size_bytes,
+                        data_entity.source,
+                        self._get_or_add_label_id(
+                            None
+                            if data_entity.label is None
+                            else data_entity.label.value
+                        ),
+                    )
+                    offset += len(record)
+
+                # Append all the segment's records in one write.
+                row = self._append_to_segment(
+                    time_bucket_id, b"".join(record for *_, record in records), entries
+                )
+
+                for i, (data_entity, *_) in enumerate(records):
+                    location = self._get_location_by_uri(data_entity.uri)
+                    if location is not None:
+                        written_time_bucket_ids.add(self._unindex_record(location)[0])
+                    self._index_record(pack_location(time_bucket_id, row + i))
+
+                written_time_bucket_ids.add(time_bucket_id)
+
+        self._notify_write_listeners(written_time_bucket_ids)
+
+    def _drop_segment(self, time_bucket_id: int) -> int:
+        """Removes the segment from the index and deletes its files, returning the content bytes cleared.
+
+        Must be called while holding the lock.
+        """
+        cleared_bytes = 0
+        for key in self.bucket_keys_by_time_bucket.pop(time_bucket_id, set()):
+            cleared_bytes += self.bucket_sizes.pop(key)
+            del self.bucket_counts[key]
+        self.total_content_size_bytes -= cleared_bytes
+
+        segment = self.segments.pop(time_bucket_id)
+        live_entries = segment.entries[: segment.count][segment.live[: segment.count]]
+        self.locations_by_uri.remove_many(live_entries["uri_hash"])
+        content_locations = self.locations_by_content_hash.get_many(
+            live_entries["content_hash"]
+        )
+        self.locations_by_content_hash.remove_many(
+            live_entries["content_hash"][
+                (content_locations >= 0)
+                & (unpack_location(content_locations)[0] == time_bucket_id)
+            ]
+        )
+
+        segment.close(sync=False)
+        self.open_segment_ids.pop(time_bucket_id, None)
+        self.mapped_segment_ids.pop(time_bucket_id, None)
+        os.remove(segment.path)
+        os.remove(segment.index_path)
+
+        bt.logging.trace(f"Dropped segment {time_bucket_id}.")
+        return cleared_bytes
+
+    def clear_content_from_oldest(self, content_bytes_to_clear: int):
+        """Drops whole segments starting from the oldest until we have cleared the specified amount of content."""
+
+        bt.logging.debug(f"Database full. Clearing {content_bytes_to_clear} bytes.")
+
+        cleared_bytes = 0
+        cleared_time_bucket_ids = set()
+        with self.lock:
+            for time_bucket_id in sorted(self.segments):
+                if cleared_bytes >= content_bytes_to_clear:
+                    break
+
+                cleared_bytes += self._drop_segment(time_bucket_id)
+                cleared_time_bucket_ids.add(time_bucket_id)
+
+        bt.logging.debug(
+            f"Cleared {cleared_bytes} bytes across {len(cleared_time_bucket_ids)} time buckets."
+        )
+
+        self._notify_write_listeners(cleared_time_bucket_ids)
+
+    def drop_expired_segments(self) -> int:
+        """Drops every segment older than the age limit. Returns the bytes cleared."""
+
+        oldest_time_bucket_id = TimeBucket.from_datetime(
+            dt.datetime.now()
+            - dt.timedelta(constants.DATA_ENTITY_BUCKET_AGE_LIMIT_DAYS)
+        ).id
+
+        cleared_bytes = 0
+        dropped_time_bucket_ids = set()
+        with self.lock:
+            for time_bucket_id in sorted(self.segments):
+                if time_bucket_id >= oldest_time_bucket_id:
+                    break
+
+                cleared_bytes += self._drop_segment(time_bucket_id)
+                dropped_time_bucket_ids.add(time_bucket_id)
+
+        if dropped_time_bucket_ids:
+            self._notify_write_listeners(dropped_time_bucket_ids)
+
+        return cleared_bytes
+
+    def delete_expired_data_entities(self) -> int:
+        """Deletes every DataEntity older than the age limit, returning the content bytes cleared.
+
+        Each segment holds a single time bucket, so this drops whole segment files and there is nothing to vacuum.
+        """
+        return self.drop_expired_segments()
+
+    @contextlib.contextmanager
+    def _read_data_entity_bucket_records(
+        self, data_entity_bucket_id: DataEntityBucketId
+    ) -> Iterator[Tuple[Optional[mmap.mmap], List[Tuple[str, RecordLocation]]]]:
+        """Yields the segment's memory map and the uri and location of each record in the bucket, ordered by uri.
+
+        Only includes records up to the max DataEntityBucket size, taken in uri order like SqliteMinerStorage. The map
+        is only valid until the context exits.
+        """
+        time_bucket_id = data_entity_bucket_id.time_bucket.id
+        label = (
+            None
+            if data_entity_bucket_id.label is None
+            else data_entity_bucket_id.label.value
+        )
+
+        mapping = None
+        with self.lock:
+            segment = self.segments.get(time_bucket_id, None)
+            label_id = NO_LABEL_ID if label is None else self.label_ids.get(label, None)
+            if segment is not None and label_id is not None:
+                entries = segment.entries[: segment.count]
+                entries = entries[
+                    segment.live[: segment.count]
+                    & (entries["source"] == int(data_entity_bucket_id.source))
+                    & (entries["label_id"] == label_id)
+                ]
+                if len(entries) > 0:
+                    bucket_size = self.bucket_sizes[
+                        (time_bucket_id, int(data_entity_bucket_id.source), label)
+                    ]
+                    mapping = self._acquire_mmap(time_bucket_id)
+
+        if mapping is None:
+            yield None, []
+            return
+
+        with mapping as view:
+            yield view, self._read_bucket_uris(view, entries, bucket_size)
+
+    def _read_bucket_uris(
+        self, view: mmap.mmap, entries: np.ndarray, bucket_size: int
+    ) -> List[Tuple[str, RecordLocation]]:
+        """Returns the uri and location of each record, ordered by uri and capped at the max DataEntityBucket size."""
+        # The uris are only stored in the records, so read them back to order the bucket.
+        header = SegmentLogMinerStorage.RECORD_HEADER
+        locations = []
+        for offset, length, content_size in zip(
+            entries["offset"].tolist(),
+            entries["length"].tolist(),
+            entries["content_size_bytes"].tolist(),
+        ):
+            uri_length = header.unpack_from(view, offset)[1]
+            uri_offset = offset + header.size
+            locations.append(
+                (
+                    view[uri_offset : uri_offset + uri_length].decode(),
+                    (offset, length, content_size),
+                )
+            )
+
+        locations.sort()
+        if bucket_size >= constants.DATA_ENTITY_BUCKET_SIZE_LIMIT_BYTES:
+            capped_locations = []
+            running_size = 0
+            for location in locations:
+                running_size += location[1][2]
+                if running_size >= constants.DATA_ENTITY_BUCKET_SIZE_LIMIT_BYTES:
+                    break
+                capped_locations.append(location)
+            locations = capped_locations
+
+        return locations
+
+    def _read_content(
+        self, view: mmap.mmap, offset: int
+    ) -> Tuple[int, int, memoryview]:
+        """Reads the datetime and the still encoded content of the record, without copying the content.
+
+        Returns (datetime in epoch microseconds, content codec, content). The content must be released after use.
+        """
+        header = SegmentLogMinerStorage.RECORD_HEADER
+        (
+            _,
+            uri_length,
+            label_length,
+            content_length,
+            _,
+            datetime,
+            _,
+            _,
+            content_codec,
+            _,
+            _,
+        ) = header.unpack_from(view, offset)
+        content_offset = offset + header.size + uri_length + label_length
+        return (
+            datetime,
+            content_codec,
+            memoryview(view)[content_offset : content_offset + content_length],
+        )
+
+    def list_data_entities_in_data_entity_bucket(
+        self, data_entity_bucket_id: DataEntityBucketId
+    ) -> List[DataEntity]:
+        """Lists from storage all DataEntities matching the provided DataEntityBucketId."""
+        data_entities = []
+        with self._read_data_entity_bucket_records(data_entity_bucket_id) as (
+            view,
+            records,
+        ):
+            for uri, (offset, _, content_size) in records:
+                datetime, content_codec, content = self._read_content(view, offset)
+                with content:
+                    data_entities.append(
+                        DataEntity(
+                            uri=uri,
+                            datetime=epoch_micros_to_datetime(datetime),
+                            source=data_entity_bucket_id.source,
+                            label=data_entity_bucket_id.label,
+                            content=bytes(
+                                content_codec_utils.decompress(content, content_codec)
+                            ),
+                            content_size_bytes=content_size,
+                        )
+                    )
+
+        bt.logging.trace(
+            f"Returning {len(data_entities)} data entities for bucket {data_entity_bucket_id}"
+        )
+        return data_entities
+
+    def get_serialized_data_entities_in_data_entity_bucket(
+        self, data_entity_bucket_id: DataEntityBucketId
+    ) -> SerializedDataEntities:
+        """Gets from storage all DataEntities matching the provided DataEntityBucketId, serialized for the wire.
+
+        Uncompressed content is decoded straight out of the segment's memory map.
+        """
+        label = (
+            None
+            if data_entity_bucket_id.label is None
+            else {"value": data_entity_bucket_id.label.value}
+        )
+
+        entities = []
+        content_size_bytes = 0
+        with self._read_data_entity_bucket_records(data_entity_bucket_id) as (
+            view,
+            records,
+        ):
+            for uri, (offset, _, content_size) in records:
+                datetime, content_codec, content = self._read_content(view, offset)
+                with content:
+                    entities.append(
+                        {
+                            "uri": uri,
+                            "datetime": epoch_micros_to_datetime(datetime).isoformat(),
+                            "source": int(data_entity_bucket_id.source),
+                            "label": label,
+                            "content": str(
+                                content_codec_utils.decompress(content, content_codec),
+                                "utf-8",
+                            ),
+                            "content_size_bytes": content_size,
+                        }
+                    )
+                content_size_bytes += content_size
+
+        return SerializedDataEntities(
+            serialized=json.dumps(entities),
+            count=len(entities),
+            content_size_bytes=content_size_bytes,
+        )
+
+    def get_compressed_index(
+        self,
+        bucket_count_limit=constants.DATA_ENTITY_BUCKET_COUNT_LIMIT_PER_MINER_INDEX,
+    ) -> CompressedMinerIndex:
+        """Gets the compressed MinedIndex, which is a summary of all of the DataEntities that this MinerStorage is currently serving."""
+
+        buckets_by_source_by_label = defaultdict(dict)
+        for key, size in self._get_largest_buckets(bucket_count_limit):
+            time_bucket_id, source, label = key
+            bucket = buckets_by_source_by_label[DataSource(source)].get(
+                label, CompressedEntityBucket(label=label)
+            )
+            bucket.sizes_bytes.append(size)
+            bucket.time_bucket_ids.append(time_bucket_id)
+            buckets_by_source_by_label[DataSource(source)][label] = bucket
+
+        return CompressedMinerIndex(
+            sources={
+                source: list(labels_to_buckets.values())
+                for source, labels_to_buckets in buckets_by_source_by_label.items()
+            }
+        )
+
+    def list_data_entity_buckets(self) -> List[DataEntityBucket]:
+        """Lists all DataEntityBuckets for all the DataEntities that this MinerStorage is currently serving."""
+        return [
+            DataEntityBucket(
+                id=DataEntityBucketId(
+                    time_bucket=TimeBucket(id=time_bucket_id),
+                    source=DataSource(source),
+                    label=None if label is None else DataLabel(value=label),
+                ),
+                size_bytes=size,
+            )
+            for (time_bucket_id, source, label), size in self._get_largest_buckets(
+                constants.DATA_ENTITY_BUCKET_COUNT_LIMIT_PER_MINER_INDEX
+            )
+        ]
+
+    def _get_largest_buckets(self, bucket_count_limit: int) -> List[tuple]:
+        """Returns (key, size) of the largest buckets within the age limit, with sizes capped at the bucket limit."""
+        oldest_time_bucket_id = TimeBucket.from_datetime(
+            dt.datetime.now()
+            - dt.timedelta(constants.DATA_ENTITY_BUCKET_AGE_LIMIT_DAYS)
+        ).id
+
+        with self.lock:
+            buckets = heapq.nlargest(
+                bucket_count_limit,
+                (
+                    (key, size)
+                    for key, size in self.bucket_sizes.items()
+                    if key[0] >= oldest_time_bucket_id
+                ),
+                key=lambda bucket: bucket[1],
+            )
+
+        # Ensure the miner does not attempt to report more than the max DataEntityBucket size.
+        return [
+            (key, min(size, constants.DATA_ENTITY_BUCKET_SIZE_LIMIT_BYTES))
+            for key, size in buckets
+        ]
@@ -1,4 +1,6 @@
 from collections import defaultdict
+import hashlib
+import json
 import threading
 from common import constants, utils
 from common.data import (
@@ -11,114 +13,524 @@ from common.data import (
     DataSource,
     TimeBucket,
 )
-from storage.miner.miner_storage import MinerStorage
-from typing import Dict, List
+from storage.miner import content_codec as content_codec_utils
+from storage.miner.content_codec import ContentCodec
+from storage.miner.miner_storage import MinerStorage, SerializedDataEntities
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Set
 import datetime as dt
 import sqlite3
 import contextlib
 import bittensor as bt
 
 
-# Use a timezone aware adapter for timestamp columns.
-def tz_aware_timestamp_adapter(val):
-    datepart, timepart = val.split(b" ")
-    year, month, day = map(int, datepart.split(b"-"))
+# DataEntity datetimes are stored as integer microseconds since the epoch, in UTC.
+EPOCH = dt.datetime(1970, 1, 1, tzinfo=dt.timezone.utc)
+ONE_MICROSECOND = dt.timedelta(microseconds=1)
 
-    if b"+" in timepart:
-        timepart, tz_offset = timepart.rsplit(b"+", 1)
-        if tz_offset == b"00:00":
-            tzinfo = dt.timezone.utc
-        else:
-            hours, minutes = map(int, tz_offset.split(b":", 1))
-            tzinfo = dt.timezone(dt.timedelta(hours=hours, minutes=minutes))
-    elif b"-" in timepart:
-        timepart, tz_offset = timepart.rsplit(b"-", 1)
-        if tz_offset == b"00:00":
-            tzinfo = dt.timezone.utc
-        else:
-            hours, minutes = map(int, tz_offset.split(b":", 1))
-            tzinfo = dt.timezone(dt.timedelta(hours=-hours, minutes=-minutes))
-    else:
-        tzinfo = None
 
-    timepart_full = timepart.split(b".")
-    hours, minutes, seconds = map(int, timepart_full[0].split(b":"))
+def datetime_to_epoch_micros(datetime: dt.datetime) -> int:
+    """Converts a datetime to microseconds since the epoch. Naive datetimes are assumed to be in local time."""
+    return (datetime.astimezone(dt.timezone.utc) - EPOCH) // ONE_MICROSECOND
 
-    if len(timepart_full) == 2:
-        microseconds = int("{:0<6.6}".format(timepart_full[1].decode()))
-    else:
-        microseconds = 0
 
-    val = dt.datetime(year, month, day, hours, minutes, seconds, microseconds, tzinfo)
+def epoch_micros_to_datetime(value) -> dt.datetime:
+    """Converts a stored DataEntity datetime back to a timezone aware UTC datetime.
 
-    return val
+    Rows written before datetimes were stored as integers hold the text form of the datetime instead.
+    """
+    if isinstance(value, int):
+        # Exact to the microsecond: a double holds current epoch seconds to well under half a microsecond.
+        return dt.datetime.fromtimestamp(value / 1_000_000, dt.timezone.utc)
+
+    return dt.datetime.fromisoformat(value)
+
+
+def epoch_micros_to_time_bucket_id(value: int) -> int:
+    """Returns the id of the TimeBucket holding the datetime stored as epoch microseconds."""
+    return value // 3_600_000_000
+
+
+class DataEntityRow(NamedTuple):
+    """A DataEntity in the form it is stored in, for bulk loads and exports that skip building DataEntities."""
+
+    uri: str
+
+    # Microseconds since the epoch, in UTC.
+    datetime: int
+
+    source: int
+
+    # The label value, or None if the DataEntity has no label.
+    label: Optional[str]
+
+    # The uncompressed content.
+    content: bytes
+
+    content_size_bytes: int
 
 
 class SqliteMinerStorage(MinerStorage):
     """Sqlite backed MinerStorage"""
 
     # TODO Consider CHECK expression to limit source to expected ENUM values.
-    # Sqlite type converters handle the mapping from Python datetime to Timestamp.
+    # datetime holds microseconds since the epoch, in UTC. See datetime_to_epoch_micros.
     DATA_ENTITY_TABLE_CREATE = """CREATE TABLE IF NOT EXISTS DataEntity (
                                 uri                 TEXT            PRIMARY KEY,
-                                datetime            TIMESTAMP(6)    NOT NULL,
+                                datetime            INTEGER         NOT NULL,
                                 timeBucketId        INTEGER         NOT NULL,
                                 source              INTEGER         NOT NULL,
-                                label               CHAR(32)                ,
+                                labelId             INTEGER         NOT NULL,
                                 content             BLOB            NOT NULL,
-                                contentSizeBytes    INTEGER         NOT NULL
+                                contentSizeBytes    INTEGER         NOT NULL,
+                                contentCodec        INTEGER         NOT NULL    DEFAULT 0,
+                                contentHash         BLOB
                                 ) WITHOUT ROWID"""
 
+    # Adds the codec column to databases that predate it. Existing rows are uncompressed.
+    DATA_ENTITY_TABLE_ADD_CODEC = """ALTER TABLE DataEntity
+                                ADD COLUMN contentCodec INTEGER NOT NULL DEFAULT 0"""
+
+    # Adds the content hash column to databases that predate it. Existing rows are hashed in the background.
+    DATA_ENTITY_TABLE_ADD_HASH = (
+        """ALTER TABLE DataEntity ADD COLUMN contentHash BLOB"""
+    )
+
+    # Validators reject a DataEntityBucket containing two entities with the same content hash, so never store
+    # the same content under two uris.
+    DATA_ENTITY_CONTENT_HASH_INDEX = """CREATE UNIQUE INDEX IF NOT EXISTS data_entity_content_hash_index
+                                ON DataEntity (contentHash) WHERE contentHash IS NOT NULL"""
+
     DELETE_OLD_INDEX = """DROP INDEX IF EXISTS data_entity_bucket_index"""
 
-    DATA_ENTITY_TABLE_INDEX = """CREATE INDEX IF NOT EXISTS data_entity_bucket_index2
-                                ON DataEntity (timeBucketId, source, label, contentSizeBytes)"""
+    DELETE_LABEL_INDEX = """DROP INDEX IF EXISTS data_entity_bucket_index2"""
+
+    DATA_ENTITY_TABLE_INDEX = """CREATE INDEX IF NOT EXISTS data_entity_bucket_index3
+                                ON DataEntity (timeBucketId, source, labelId, contentSizeBytes)"""
+
+    # Interns label values, so DataEntity and its indexes store a small integer per row instead of the label text.
+    # Entities without a label use the value "NULL". Labels are never deleted, so ids are stable.
+    LABEL_TABLE_CREATE = """CREATE TABLE IF NOT EXISTS Label (
+                                labelId             INTEGER         PRIMARY KEY,
+                                value               TEXT            NOT NULL    UNIQUE
+                                )"""
+
+    # Adds the labelId column to databases that predate the Label table.
+    DATA_ENTITY_TABLE_ADD_LABEL_ID = (
+        """ALTER TABLE DataEntity ADD COLUMN labelId INTEGER"""
+    )
+
+    # Retires the label column of databases that predate the Label table. Renaming only edits the schema, whereas
+    # dropping the column would rewrite the whole table in a single transaction. The legacy column is only read to
+    # migrate its values to ids in the background, which sets it to NULL as it goes.
+    DATA_ENTITY_TABLE_RETIRE_LABEL = (
+        """ALTER TABLE DataEntity RENAME COLUMN label TO legacyLabel"""
+    )
+
+    # Single row ledger of the total content stored, so that capacity checks do not need to scan DataEntity.
+    CONTENT_SIZE_LEDGER_TABLE_CREATE = """CREATE TABLE IF NOT EXISTS ContentSizeLedger (
+                                id                  INTEGER         PRIMARY KEY CHECK (id = 0),
+                                totalBytes          INTEGER         NOT NULL,
+                                rowCount            INTEGER         NOT NULL
+                                )"""
+
+    # Populates the ledger from scratch. Ignored if the ledger row already exists.
+    CONTENT_SIZE_LEDGER_POPULATE = """INSERT OR IGNORE INTO ContentSizeLedger (id, totalBytes, rowCount)
+                                SELECT 0, IFNULL(SUM(contentSizeBytes), 0), COUNT(*) FROM DataEntity"""
+
+    # Triggers keep the ledger up to date within the same transaction as every write to DataEntity.
+    # Note: Rows deleted by REPLACE only fire the delete trigger when recursive_triggers is enabled.
+    CONTENT_SIZE_LEDGER_INSERT_TRIGGER = """CREATE TRIGGER IF NOT EXISTS content_size_ledger_insert
+                                AFTER INSERT ON DataEntity
+                                BEGIN
+                                    UPDATE ContentSizeLedger
+                                    SET totalBytes = totalBytes + NEW.contentSizeBytes, rowCount = rowCount + 1
+                                    WHERE id = 0;
+                                END"""
+
+    CONTENT_SIZE_LEDGER_DELETE_TRIGGER = """CREATE TRIGGER IF NOT EXISTS content_size_ledger_delete
+                                AFTER DELETE ON DataEntity
+                                BEGIN
+                                    UPDATE ContentSizeLedger
+                                    SET totalBytes = totalBytes - OLD.contentSizeBytes, rowCount = rowCount - 1
+                                    WHERE id = 0;
+                                END"""
+
+    CONTENT_SIZE_LEDGER_UPDATE_TRIGGER = """CREATE TRIGGER IF NOT EXISTS content_size_ledger_update
+                                AFTER UPDATE OF contentSizeBytes ON DataEntity
+                                BEGIN
+                                    UPDATE ContentSizeLedger
+                                    SET totalBytes = totalBytes - OLD.contentSizeBytes + NEW.contentSizeBytes
+                                    WHERE id = 0;
+                                END"""
+
+    # Pre-aggregated size of every DataEntityBucket, so that index generation does not need to scan DataEntity.
+    BUCKET_SUMMARY_TABLE_CREATE = """CREATE TABLE IF NOT EXISTS BucketSummary (
+                                timeBucketId        INTEGER         NOT NULL,
+                                source              INTEGER         NOT NULL,
+                                labelId             INTEGER         NOT NULL,
+                                totalBytes          INTEGER         NOT NULL,
+                                rowCount            INTEGER         NOT NULL,
+                                PRIMARY KEY(timeBucketId, source, labelId)
+                                ) WITHOUT ROWID"""
+
+    BUCKET_SUMMARY_POPULATE = """INSERT INTO BucketSummary (timeBucketId, source, labelId, totalBytes, rowCount)
+                                SELECT timeBucketId, source, labelId, SUM(contentSizeBytes), COUNT(*) FROM DataEntity
+                                WHERE labelId IS NOT NULL GROUP BY timeBucketId, source, labelId"""
+
+    # Triggers keep the summary up to date within the same transaction as every write to DataEntity.
+    BUCKET_SUMMARY_INSERT_TRIGGER = """CREATE TRIGGER IF NOT EXISTS bucket_summary_insert
+                                AFTER INSERT ON DataEntity
+                                BEGIN
+                                    INSERT INTO BucketSummary (timeBucketId, source, labelId, totalBytes, rowCount)
+                                    VALUES (NEW.timeBucketId, NEW.source, NEW.labelId, NEW.contentSizeBytes, 1)
+                                    ON CONFLICT (timeBucketId, source, labelId) DO UPDATE
+                                    SET totalBytes = totalBytes + excluded.totalBytes, rowCount = rowCount + 1;
+                                END"""
+
+    BUCKET_SUMMARY_DELETE_TRIGGER = """CREATE TRIGGER IF NOT EXISTS bucket_summary_delete
+                                AFTER DELETE ON DataEntity
+                                BEGIN
+                                    UPDATE BucketSummary
+                                    SET totalBytes = totalBytes - OLD.contentSizeBytes, rowCount = rowCount - 1
+                                    WHERE timeBucketId = OLD.timeBucketId AND source = OLD.source AND labelId = OLD.labelId;
+                                    DELETE FROM BucketSummary
+                                    WHERE timeBucketId = OLD.timeBucketId AND source = OLD.source AND labelId = OLD.labelId
+                                    AND rowCount <= 0;
+                                END"""
+
+    BUCKET_SUMMARY_UPDATE_TRIGGER = """CREATE TRIGGER IF NOT EXISTS bucket_summary_update
+                                AFTER UPDATE OF timeBucketId, source, labelId, contentSizeBytes ON DataEntity
+                                BEGIN
+                                    UPDATE BucketSummary
+                                    SET totalBytes = totalBytes - OLD.contentSizeBytes, rowCount = rowCount - 1
+                                    WHERE timeBucketId = OLD.timeBucketId AND source = OLD.source AND labelId = OLD.labelId;
+                                    DELETE FROM BucketSummary
+                                    WHERE timeBucketId = OLD.timeBucketId AND source = OLD.source AND labelId = OLD.labelId
+                                    AND rowCount <= 0;
+                                    INSERT INTO BucketSummary (timeBucketId, source, labelId, totalBytes, rowCount)
+                                    VALUES (NEW.timeBucketId, NEW.source, NEW.labelId, NEW.contentSizeBytes, 1)
+                                    ON CONFLICT (timeBucketId, source, labelId) DO UPDATE
+                                    SET totalBytes = totalBytes + excluded.totalBytes, rowCount = rowCount + 1;
+                                END"""
+
+    # Pragmas applied to every connection. Durability on power loss is traded for faster commits, which is
+    # safe for scraped data that is regularly rescraped anyway.
+    SYNCHRONOUS = "NORMAL"
+    CACHE_SIZE_KIB = 64 * 1024
+    MMAP_SIZE_BYTES = utils.gb_to_bytes(1)
+
+    # The maximum number of rows to delete in a single transaction.
+    DELETE_BATCH_SIZE = 50_000
+
+    # The maximum number of free pages to return to the file system in a single transaction.
+    VACUUM_BATCH_PAGES = 1024
+
+    # How long truncating the write-ahead log may wait on readers before giving up until the next vacuum.
+    WAL_TRUNCATE_TIMEOUT_SECONDS = 0.1
+
+    # How often the store path samples the database file size. Stores in between add their estimated size to it.
+    DATABASE_SIZE_SAMPLE_INTERVAL = dt.timedelta(seconds=10)
+
+    # The user_version of databases whose DataEntity datetimes are all stored as epoch microseconds.
+    EPOCH_DATETIME_USER_VERSION = 1
+
+    # The maximum number of rows to migrate to epoch datetimes in a single transaction.
+    DATETIME_MIGRATION_BATCH_SIZE = 10_000
+
+    # The user_version of databases where every DataEntity also has a contentHash.
+    CONTENT_HASH_USER_VERSION = 2
+
+    # The maximum number of rows to hash in a single transaction.
+    CONTENT_HASH_MIGRATION_BATCH_SIZE = 10_000
+
+    # The user_version of databases where every DataEntity has a labelId.
+    LABEL_ID_USER_VERSION = 3
+
+    # The maximum number of rows to migrate to label ids in a single transaction.
+    LABEL_MIGRATION_BATCH_SIZE = 50_000
+
+    # The maximum number of content hashes to look up in a single query.
+    CONTENT_HASH_LOOKUP_BATCH_SIZE = 500
+
+    # Estimated bytes on disk per row beyond its uri and content, across the table and its indexes.
+    ESTIMATED_ROW_OVERHEAD_BYTES = 100
 
     def __init__(
         self,
         database="SqliteMinerStorage.sqlite",
         max_database_size_gb_hint=250,
+        content_codec=ContentCodec.NONE,
+        cache_size_kib=CACHE_SIZE_KIB,
+        mmap_size_bytes=MMAP_SIZE_BYTES,
     ):
-        sqlite3.register_converter("timestamp", tz_aware_timestamp_adapter)
         self.database = database
 
-        # TODO Account for non-content columns when restricting total database size.
+        # The page cache and memory map sizes of every connection.
+        self.cache_size_kib = cache_size_kib
+        self.mmap_size_bytes = mmap_size_bytes
+
+        # The codec used to compress newly stored content. contentSizeBytes always reports the uncompressed size.
+        content_codec_utils.check_available(content_codec)
+        self.content_codec = ContentCodec(content_codec)
+
+        # Both the stored content and the database file itself, including indexes and row overhead, are limited.
         self.database_max_content_size_bytes = utils.gb_to_bytes(
             max_database_size_gb_hint
         )
+        self.database_max_size_bytes = utils.gb_to_bytes(max_database_size_gb_hint)
 
         with contextlib.closing(self._create_connection()) as connection:
             cursor = connection.cursor()
 
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'DataEntity'"
+            )
+            data_entity_exists = cursor.fetchone() is not None
+
+            # Let new databases return the pages freed by clearing space to the file system.
+            # This can only be enabled before the first table is created.
+            if not data_entity_exists:
+                cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
+            # Free pages can only be returned to the file system when auto_vacuum is INCREMENTAL (2).
+            cursor.execute("PRAGMA auto_vacuum")
+            self.is_incremental_vacuum = cursor.fetchone()[0] == 2
+
+            # Use write-ahead logging so that readers never wait on a writer's commit.
+            cursor.execute("PRAGMA journal_mode = WAL")
+
             # Create the DataEntity table (if it does not already exist).
             cursor.execute(SqliteMinerStorage.DATA_ENTITY_TABLE_CREATE)
 
-            # Delete the old index (if it exists).
+            # Add the contentCodec column (if it does not already exist).
+            cursor.execute("PRAGMA table_info(DataEntity)")
+            data_entity_columns = [row["name"] for row in cursor.fetchall()]
+
+            # New databases, and those created with label ids, only ever hold epoch datetimes, hashed content and
+            # label ids.
+            if not data_entity_exists or (
+                "label" not in data_entity_columns
+                and "legacyLabel" not in data_entity_columns
+            ):
+                cursor.execute(
+                    f"PRAGMA user_version = {SqliteMinerStorage.LABEL_ID_USER_VERSION}"
+                )
+            cursor.execute("PRAGMA user_version")
+            user_version = cursor.fetchone()[0]
+            if "contentCodec" not in data_entity_columns:
+                cursor.execute(SqliteMinerStorage.DATA_ENTITY_TABLE_ADD_CODEC)
+
+            # Add the contentHash column (if it does not already exist).
+            if "contentHash" not in data_entity_columns:
+                cursor.execute(SqliteMinerStorage.DATA_ENTITY_TABLE_ADD_HASH)
+
+            # Create the Label table and retire the label column of databases that predate it.
+            cursor.execute(SqliteMinerStorage.LABEL_TABLE_CREATE)
+            if "label" in data_entity_columns:
+                self._retire_label_column(cursor, data_entity_columns)
+
+            # Delete the old indexes (if they exist).
             cursor.execute(SqliteMinerStorage.DELETE_OLD_INDEX)
+            cursor.execute(SqliteMinerStorage.DELETE_LABEL_INDEX)
 
-            # Create the Index (if it does not already exist).
+            # Create the Indexes (if they do not already exist).
             cursor.execute(SqliteMinerStorage.DATA_ENTITY_TABLE_INDEX)
+            cursor.execute(SqliteMinerStorage.DATA_ENTITY_CONTENT_HASH_INDEX)
+
+            # Create the content size ledger, populating it once for databases that predate it.
+            cursor.execute(SqliteMinerStorage.CONTENT_SIZE_LEDGER_TABLE_CREATE)
+            cursor.execute(SqliteMinerStorage.CONTENT_SIZE_LEDGER_POPULATE)
+            cursor.execute(SqliteMinerStorage.CONTENT_SIZE_LEDGER_INSERT_TRIGGER)
+            cursor.execute(SqliteMinerStorage.CONTENT_SIZE_LEDGER_DELETE_TRIGGER)
+            cursor.execute(SqliteMinerStorage.CONTENT_SIZE_LEDGER_UPDATE_TRIGGER)
+
+            # Create the bucket summary, building it once for databases that predate it.
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'BucketSummary'"
+            )
+            bucket_summary_exists = cursor.fetchone() is not None
+            cursor.execute(SqliteMinerStorage.BUCKET_SUMMARY_TABLE_CREATE)
+            if not bucket_summary_exists:
+                bt.logging.info("Building the BucketSummary table for existing data.")
+                cursor.execute(SqliteMinerStorage.BUCKET_SUMMARY_POPULATE)
+            cursor.execute(SqliteMinerStorage.BUCKET_SUMMARY_INSERT_TRIGGER)
+            cursor.execute(SqliteMinerStorage.BUCKET_SUMMARY_DELETE_TRIGGER)
+            cursor.execute(SqliteMinerStorage.BUCKET_SUMMARY_UPDATE_TRIGGER)
+            connection.commit()
+
+        # A single dedicated connection performs all writes, guarded by a lock.
+        # Reentrant since clearing space happens within a store.
+        self.write_lock = threading.RLock()
+        self.write_connection = self._create_connection()
+
+        # Each reading thread opens its own connection once and reuses it.
+        self.thread_local = threading.local()
+        self.read_connections: List[sqlite3.Connection] = []
+        self.read_connections_lock = threading.Lock()
 
-        # Lock to avoid concurrency issues on clearing space when full
-        self.clearing_space_lock = threading.Lock()
+        # Callbacks to notify after every write to the DataEntity table.
+        self.write_listeners: List[Callable[[Set[int]], None]] = []
+
+        # The last sample of the database size, plus the estimated size of everything stored since.
+        self.database_size_lock = threading.Lock()
+        self.sampled_database_size_bytes = 0
+        self.database_size_sampled_at: Optional[dt.datetime] = None
+
+        # In-process cache of the Label table in both directions. Only added to after a label is committed.
+        self.label_ids: Dict[str, int] = {}
+        self.label_values: Dict[int, str] = {}
+        with contextlib.closing(self.write_connection.cursor()) as cursor:
+            cursor.execute("SELECT labelId, value FROM Label")
+            for row in cursor:
+                self.label_ids[row["value"]] = row["labelId"]
+                self.label_values[row["labelId"]] = row["value"]
+
+        # Migrate rows stored with text datetimes, without a content hash or without a label id in the background.
+        # Reads handle both datetime forms meanwhile, and serve rows without a label id once they are migrated.
+        self.is_closed = False
+        self.migration_thread: threading.Thread = None
+        if user_version < SqliteMinerStorage.LABEL_ID_USER_VERSION:
+            self.migration_thread = threading.Thread(
+                target=self._migrate_legacy_rows, args=[user_version], daemon=True
+            )
+            self.migration_thread.start()
+
+    def _retire_label_column(
+        self, cursor: sqlite3.Cursor, data_entity_columns: List[str]
+    ):
+        """Renames the label column of DataEntity to legacyLabel and adds the labelId column in its place.
+
+        Only edits the schema. Rows are migrated to label ids in the background by migrate_legacy_labels.
+        """
+        bt.logging.info(
+            f"Retiring the label column of {self.database}. Rows are migrated to label ids in the background."
+        )
+
+        # Drop everything that references the label column. The bucket summary is rebuilt as rows are migrated.
+        cursor.execute(SqliteMinerStorage.DELETE_LABEL_INDEX)
+        cursor.execute("DROP TRIGGER IF EXISTS bucket_summary_insert")
+        cursor.execute("DROP TRIGGER IF EXISTS bucket_summary_delete")
+        cursor.execute("DROP TRIGGER IF EXISTS bucket_summary_update")
+        cursor.execute("DROP TABLE IF EXISTS BucketSummary")
+
+        if "labelId" not in data_entity_columns:
+            cursor.execute(SqliteMinerStorage.DATA_ENTITY_TABLE_ADD_LABEL_ID)
+        cursor.execute(SqliteMinerStorage.DATA_ENTITY_TABLE_RETIRE_LABEL)
+
+    def _get_label_id(self, label: str) -> Optional[int]:
+        """Returns the id of the label value, or None if no DataEntity has ever been stored with it."""
+        return self.label_ids.get(label, None)
+
+    def _get_or_insert_label_ids(self, labels: Set[str]) -> Dict[str, int]:
+        """Returns the ids of the label values, adding any new values to the Label table.
+
+        Must be called while holding the write lock.
+        """
+        new_labels = [label for label in labels if label not in self.label_ids]
+        if new_labels:
+            with self.write_connection as connection:
+                connection.executemany(
+                    "INSERT OR IGNORE INTO Label (value) VALUES (?)",
+                    [[label] for label in new_labels],
+                )
+                rows = connection.execute(
+                    f"SELECT labelId, value FROM Label WHERE value IN ({','.join('?' * len(new_labels))})",
+                    new_labels,
+                ).fetchall()
+
+            for row in rows:
+                self.label_ids[row["value"]] = row["labelId"]
+                self.label_values[row["labelId"]] = row["value"]
+
+        return {label: self.label_ids[label] for label in labels}
+
+    def _get_label_value(self, label_id: int) -> str:
+        """Returns the label value for the id."""
+        return self.label_values[label_id]
 
     def _create_connection(self):
         # Create the database if it doesn't exist, defaulting to the local directory.
-        # Use PARSE_DECLTYPES to convert accessed values into the appropriate type.
+        # Connections may be closed from a different thread than the one using them.
         connection = sqlite3.connect(
-            self.database, detect_types=sqlite3.PARSE_DECLTYPES, timeout=60.0
+            self.database,
+            timeout=60.0,
+            check_same_thread=False,
         )
         # Allow this connection to parse results from returned rows by column name.
         connection.row_factory = sqlite3.Row
+        # Ensure rows removed by REPLACE fire the delete triggers that maintain the ledger.
+        connection.execute("PRAGMA recursive_triggers = ON")
+        connection.execute(f"PRAGMA synchronous = {SqliteMinerStorage.SYNCHRONOUS}")
+        connection.execute(f"PRAGMA cache_size = -{self.cache_size_kib}")
+        connection.execute(f"PRAGMA mmap_size = {self.mmap_size_bytes}")
+
+        return connection
+
+    def _get_read_connection(self) -> sqlite3.Connection:
+        """Gets the calling thread's read connection, opening it on first use.
+
+        Raises once the storage is closed, rather than reopening the database file, which may have been deleted.
+        """
+        if self.is_closed:
+            raise sqlite3.ProgrammingError(
+                f"Cannot operate on closed storage {self.database}."
+            )
+
+        connection = getattr(self.thread_local, "connection", None)
+        if connection is None:
+            connection = self._create_connection()
+            # Guard against accidental writes outside of the write connection.
+            connection.execute("PRAGMA query_only = ON")
+            self.thread_local.connection = connection
+            with self.read_connections_lock:
+                self.read_connections.append(connection)
 
         return connection
 
+    def close(self):
+        """Closes all connections held by this storage."""
+        # Stop any migration between batches before closing its connection.
+        self.is_closed = True
+        if self.migration_thread is not None:
+            self.migration_thread.join()
+            self.migration_thread = None
+
+        with self.read_connections_lock:
+            for connection in self.read_connections:
+                connection.close()
+            self.read_connections = []
+
+        with self.write_lock:
+            self.write_connection.close()
+
     def store_data_entities(self, data_entities: List[DataEntity]):
         """Stores any number of DataEntities, making space if necessary."""
+        self.store_data_entity_rows(
+            [
+                DataEntityRow(
+                    uri=data_entity.uri,
+                    datetime=datetime_to_epoch_micros(data_entity.datetime),
+                    source=int(data_entity.source),
+                    label=None
+                    if data_entity.label is None
+                    else data_entity.label.value,
+                    content=data_entity.content,
+                    content_size_bytes=data_entity.content_size_bytes,
+                )
+                for data_entity in data_entities
+            ]
+        )
+
+    def store_data_entity_rows(self, rows: List[DataEntityRow]):
+        """Stores any number of DataEntityRows, making space if necessary.
+
+        Skips constructing and validating DataEntities, so the rows must already be valid, e.g. as exported from a
+        miner database.
+        """
 
         added_content_size = 0
-        for data_entity in data_entities:
-            added_content_size += data_entity.content_size_bytes
+        for row in rows:
+            added_content_size += row.content_size_bytes
 
         # If the total size of the store is larger than our maximum configured stored content size then ecept.
         if added_content_size > self.database_max_content_size_bytes:
@@ -129,112 +541,606 @@ class SqliteMinerStorage(MinerStorage):
                 + str(self.database_max_content_size_bytes)
             )
 
-        with contextlib.closing(self._create_connection()) as connection:
-            # Ensure only one thread is clearing space when necessary.
-            with self.clearing_space_lock:
-                # If we would exceed our maximum configured stored content size then clear space.
-                cursor = connection.cursor()
-                cursor.execute("SELECT SUM(contentSizeBytes) FROM DataEntity")
-
-                # If there are no rows we convert the None result to 0
-                result = cursor.fetchone()
-                current_content_size = result[0] if result[0] else 0
-
-                if (
-                    current_content_size + added_content_size
-                    > self.database_max_content_size_bytes
-                ):
-                    content_bytes_to_clear = (
-                        self.database_max_content_size_bytes // 10
-                        if self.database_max_content_size_bytes // 10
-                        > added_content_size
-                        else added_content_size
-                    )
-                    self.clear_content_from_oldest(content_bytes_to_clear)
+        # Parse every row into an list of value lists for inserting, dropping any with duplicate content.
+        # Only the last row for each uri is stored, so a superseded row's content is not counted as stored.
+        values = []
+        uris_by_content_hash: Dict[bytes, str] = {}
+        rows_by_uri = {row.uri: row for row in rows}
+
+        for row in rows_by_uri.values():
+            content_hash = hashlib.sha1(row.content).digest()
+            if uris_by_content_hash.setdefault(content_hash, row.uri) != row.uri:
+                continue
+
+            label = "NULL" if (row.label is None) else row.label
+            content, content_codec = content_codec_utils.encode(
+                row.content, self.content_codec
+            )
+            values.append(
+                [
+                    row.uri,
+                    row.datetime,
+                    epoch_micros_to_time_bucket_id(row.datetime),
+                    row.source,
+                    label,
+                    content,
+                    row.content_size_bytes,
+                    content_codec,
+                    content_hash,
+                ]
+            )
+
+        added_database_size = sum(
+            SqliteMinerStorage.estimate_row_size_bytes(value[0], value[5])
+            for value in values
+        )
+
+        # Sampled before taking the write lock, so reading the page stats never holds up other writers.
+        current_database_size = self._sample_database_size_bytes()
 
-            # Parse every DataEntity into an list of value lists for inserting.
-            values = []
+        # Ensure only one thread is writing, and clearing space when necessary.
+        with self.write_lock, contextlib.closing(
+            self.write_connection.cursor()
+        ) as cursor:
+            # If we would exceed our maximum configured stored content size or database size then clear space.
+            content_bytes_to_clear = SqliteMinerStorage.get_content_bytes_to_clear(
+                current_content_size=self._get_ledger_content_size(cursor),
+                added_content_size=added_content_size,
+                max_content_size=self.database_max_content_size_bytes,
+                current_database_size=current_database_size,
+                added_database_size=added_database_size,
+                max_database_size=self.database_max_size_bytes,
+            )
+            if content_bytes_to_clear > 0:
+                self._clear_content_from_oldest(cursor, content_bytes_to_clear)
 
-            for data_entity in data_entities:
-                label = (
-                    "NULL" if (data_entity.label is None) else data_entity.label.value
+            # Drop entities whose content is already stored under a different uri.
+            stored_uris_by_content_hash = self._get_uris_by_content_hash(
+                cursor, [value[8] for value in values]
+            )
+            values = [
+                value
+                for value in values
+                if stored_uris_by_content_hash.get(value[8], value[0]) == value[0]
+            ]
+            if len(values) < len(rows):
+                bt.logging.trace(
+                    f"Dropped {len(rows) - len(values)} data entities with duplicate content."
                 )
-                time_bucket_id = TimeBucket.from_datetime(data_entity.datetime).id
-                values.append(
-                    [
-                        data_entity.uri,
-                        data_entity.datetime,
-                        time_bucket_id,
-                        data_entity.source,
-                        label,
-                        data_entity.content,
-                        data_entity.content_size_bytes,
-                    ]
+
+            # Replace each label value with its id.
+            label_ids = self._get_or_insert_label_ids({value[4] for value in values})
+            for value in values:
+                value[4] = label_ids[value[4]]
+
+            # Insert overwriting duplicate keys (in case of updated content), committing on success.
+            with self.write_connection:
+                cursor.executemany(
+                    """REPLACE INTO DataEntity (uri, datetime, timeBucketId, source, labelId, content, contentSizeBytes, contentCodec, contentHash)
+                        VALUES (?,?,?,?,?,?,?,?,?)""",
+                    values,
                 )
 
-            # Insert overwriting duplicate keys (in case of updated content).
-            cursor.executemany("REPLACE INTO DataEntity VALUES (?,?,?,?,?,?,?)", values)
+        with self.database_size_lock:
+            self.sampled_database_size_bytes += added_database_size
 
-            # Commit the insert.
-            connection.commit()
+        # The insert reused the pages freed by clearing space first. Return the rest outside of the write lock.
+        if content_bytes_to_clear > 0:
+            self._vacuum_free_pages()
 
-    def list_data_entities_in_data_entity_bucket(
+        self._notify_write_listeners({value[2] for value in values})
+
+    def _get_uris_by_content_hash(
+        self, cursor: sqlite3.Cursor, content_hashes: List[bytes]
+    ) -> Dict[bytes, str]:
+        """Returns the uri already stored with each of the content hashes that are present."""
+        uris_by_content_hash = {}
+        batch_size = SqliteMinerStorage.CONTENT_HASH_LOOKUP_BATCH_SIZE
+        for i in range(0, len(content_hashes), batch_size):
+            batch = content_hashes[i : i + batch_size]
+            cursor.execute(
+                f"SELECT contentHash, uri FROM DataEntity WHERE contentHash IN ({','.join('?' * len(batch))})",
+                batch,
+            )
+            for row in cursor:
+                uris_by_content_hash[row["contentHash"]] = row["uri"]
+
+        return uris_by_content_hash
+
+    def add_write_listener(self, listener: Callable[[Set[int]], None]):
+        """Registers a callback to be notified after every write to storage with the ids of the time buckets written."""
+        self.write_listeners.append(listener)
+
+    def _notify_write_listeners(self, time_bucket_ids: Set[int]):
+        for listener in self.write_listeners:
+            listener(time_bucket_ids)
+
+    def _get_ledger_content_size(self, cursor: sqlite3.Cursor) -> int:
+        """Reads the total content size in bytes from the ledger."""
+        cursor.execute("SELECT totalBytes FROM ContentSizeLedger WHERE id = 0")
+        result = cursor.fetchone()
+        return result[0] if result else 0
+
+    @staticmethod
+    def estimate_row_size_bytes(uri: str, content: bytes) -> int:
+        """Estimates the bytes on disk a DataEntity row will take, including its index entries."""
+        return len(uri) + len(content) + SqliteMinerStorage.ESTIMATED_ROW_OVERHEAD_BYTES
+
+    @staticmethod
+    def get_content_bytes_to_clear(
+        current_content_size: int,
+        added_content_size: int,
+        max_content_size: int,
+        current_database_size: int,
+        added_database_size: int,
+        max_database_size: int,
+    ) -> int:
+        """Returns how many bytes of content to clear before adding to storage, or 0 if everything fits.
+
+        Space is cleared in chunks of a tenth of the limit that would be exceeded, or the added size if larger.
+        """
+        content_bytes_to_clear = 0
+        if current_content_size + added_content_size > max_content_size:
+            content_bytes_to_clear = max(max_content_size // 10, added_content_size)
+
+        if current_database_size + added_database_size > max_database_size:
+            # Eviction is measured in content, so convert using the current ratio of content to database size.
+            database_bytes_to_clear = max(max_database_size // 10, added_database_size)
+            content_bytes_to_clear = max(
+                content_bytes_to_clear,
+                database_bytes_to_clear
+                * current_content_size
+                // max(current_database_size, 1),
+            )
+
+        return content_bytes_to_clear
+
+    def _get_database_size_bytes(self, cursor: sqlite3.Cursor) -> int:
+        """Reads the size in bytes of the database file, including free pages. Only reads the database header."""
+        cursor.execute("PRAGMA page_count")
+        page_count = cursor.fetchone()[0]
+        cursor.execute("PRAGMA page_size")
+        page_size = cursor.fetchone()[0]
+        return page_count * page_size
+
+    def get_database_size_bytes(self) -> int:
+        """Gets the size in bytes of the database file on disk, including indexes, row overhead and free pages."""
+        with contextlib.closing(self._get_read_connection().cursor()) as cursor:
+            return self._get_database_size_bytes(cursor)
+
+    def get_database_files(self) -> List[str]:
+        """Gets the paths of the files backing the database, including its write-ahead log."""
+        return [self.database + suffix for suffix in ["", "-wal", "-shm"]]
+
+    def _sample_database_size_bytes(self) -> int:
+        """Returns the size the database file would grow from, sampled at most once per DATABASE_SIZE_SAMPLE_INTERVAL.
+
+        Stores since the last sample are added to it as estimates. Unless auto_vacuum is INCREMENTAL, free pages can
+        never be returned to the file system and are reused before the file grows, so they are not counted.
+        """
+        with self.database_size_lock:
+            now = dt.datetime.now()
+            if (
+                self.database_size_sampled_at is None
+                or now - self.database_size_sampled_at
+                >= SqliteMinerStorage.DATABASE_SIZE_SAMPLE_INTERVAL
+            ):
+                with contextlib.closing(self._get_read_connection().cursor()) as cursor:
+                    database_size = self._get_database_size_bytes(cursor)
+                    if not self.is_incremental_vacuum:
+                        cursor.execute("PRAGMA freelist_count")
+                        freelist_count = cursor.fetchone()[0]
+                        cursor.execute("PRAGMA page_size")
+                        database_size -= freelist_count * cursor.fetchone()[0]
+
+                self.sampled_database_size_bytes = database_size
+                self.database_size_sampled_at = now
+
+            return self.sampled_database_size_bytes
+
+    def get_total_content_size_bytes(self) -> int:
+        """Gets the total size in bytes of all stored content."""
+        with contextlib.closing(self._get_read_connection().cursor()) as cursor:
+            return self._get_ledger_content_size(cursor)
+
+    def rebuild_content_size_ledger(self) -> bool:
+        """Rebuilds the content size ledger from scratch.
+
+        Returns whether the ledger was consistent with the stored DataEntities before the rebuild.
+        """
+        # Hold the write lock so no capacity check reads the ledger while it is rebuilt.
+        with self.write_lock, self.write_connection as connection:
+            with contextlib.closing(connection.cursor()) as cursor:
+                cursor.execute(
+                    "SELECT totalBytes, rowCount FROM ContentSizeLedger WHERE id = 0"
+                )
+                ledger = cursor.fetchone()
+
+                cursor.execute("DELETE FROM ContentSizeLedger")
+                cursor.execute(SqliteMinerStorage.CONTENT_SIZE_LEDGER_POPULATE)
+                cursor.execute(
+                    "SELECT totalBytes, rowCount FROM ContentSizeLedger WHERE id = 0"
+                )
+                actual = cursor.fetchone()
+
+        is_consistent = ledger is not None and tuple(ledger) == tuple(actual)
+        if not is_consistent:
+            bt.logging.warning(
+                f"Content size ledger was inconsistent. Ledger: {tuple(ledger) if ledger else None}. Actual: {tuple(actual)}."
+            )
+        return is_consistent
+
+    def rebuild_bucket_summary(self) -> bool:
+        """Rebuilds the bucket summary from scratch.
+
+        Returns whether the summary was consistent with the stored DataEntities before the rebuild.
+        """
+        with self.write_lock, self.write_connection as connection:
+            with contextlib.closing(connection.cursor()) as cursor:
+                # Count the buckets that differ in either direction between the summary and DataEntity.
+                cursor.execute(
+                    """SELECT COUNT(*) FROM (
+                            SELECT timeBucketId, source, labelId, totalBytes, rowCount FROM BucketSummary
+                            UNION
+                            SELECT timeBucketId, source, labelId, SUM(contentSizeBytes), COUNT(*) FROM DataEntity
+                            WHERE labelId IS NOT NULL GROUP BY timeBucketId, source, labelId
+                        )"""
+                )
+                union_count = cursor.fetchone()[0]
+                cursor.execute("SELECT COUNT(*) FROM BucketSummary")
+                summary_count = cursor.fetchone()[0]
+
+                cursor.execute("DELETE FROM BucketSummary")
+                cursor.execute(SqliteMinerStorage.BUCKET_SUMMARY_POPULATE)
+                cursor.execute("SELECT COUNT(*) FROM BucketSummary")
+                actual_count = cursor.fetchone()[0]
+
+        is_consistent = union_count == summary_count == actual_count
+        if not is_consistent:
+            bt.logging.warning(
+                f"Bucket summary was inconsistent. Summary buckets: {summary_count}. Actual buckets: {actual_count}."
+            )
+        return is_consistent
+
+    def _migrate_legacy_rows(self, user_version: int):
+        """Runs each migration the database at user_version still needs, in order."""
+        if user_version < SqliteMinerStorage.EPOCH_DATETIME_USER_VERSION:
+            self.migrate_legacy_datetimes()
+        if user_version < SqliteMinerStorage.CONTENT_HASH_USER_VERSION:
+            self.migrate_legacy_content_hashes()
+        self.migrate_legacy_labels()
+
+    def migrate_legacy_datetimes(self) -> int:
+        """Converts rows stored with text datetimes to epoch microseconds, in batches so writes can interleave.
+
+        Safe to interrupt and rerun. Returns the number of rows migrated.
+        """
+        migrated_rows = 0
+        last_uri = ""
+        with contextlib.closing(self._create_connection()) as connection:
+            while not self.is_closed:
+                with self.write_lock, self.write_connection:
+                    # Walk the primary key so each batch resumes where the last one stopped.
+                    rows = connection.execute(
+                        "SELECT uri, datetime FROM DataEntity WHERE uri > ? ORDER BY uri LIMIT ?",
+                        [last_uri, SqliteMinerStorage.DATETIME_MIGRATION_BATCH_SIZE],
+                    ).fetchall()
+                    if not rows:
+                        self.write_connection.execute(
+                            f"PRAGMA user_version = {SqliteMinerStorage.EPOCH_DATETIME_USER_VERSION}"
+                        )
+                        break
+
+                    values = [
+                        [
+                            datetime_to_epoch_micros(
+                                dt.datetime.fromisoformat(row["datetime"])
+                            ),
+                            row["uri"],
+                        ]
+                        for row in rows
+                        if isinstance(row["datetime"], str)
+                    ]
+                    self.write_connection.executemany(
+                        "UPDATE DataEntity SET datetime = ? WHERE uri = ?", values
+                    )
+
+                migrated_rows += len(values)
+                last_uri = rows[-1]["uri"]
+
+        bt.logging.info(
+            f"Migrated {migrated_rows} rows of {self.database} to epoch datetimes."
+        )
+        return migrated_rows
+
+    def migrate_legacy_content_hashes(self) -> int:
+        """Hashes the content of rows stored before contentHash existed, in batches so writes can interleave.
+
+        Rows whose content is already stored under another uri are deleted, since validators reject a
+        DataEntityBucket with duplicate content. Safe to interrupt and rerun. Returns the number of rows hashed.
+        """
+        hashed_rows = 0
+        deleted_rows = 0
+        last_uri = ""
+        with contextlib.closing(self._create_connection()) as connection:
+            while not self.is_closed:
+                # Walk the primary key so each batch resumes where the last one stopped.
+                batch_last_uri = connection.execute(
+                    "SELECT MAX(uri) FROM (SELECT uri FROM DataEntity WHERE uri > ? ORDER BY uri LIMIT ?)",
+                    [last_uri, SqliteMinerStorage.CONTENT_HASH_MIGRATION_BATCH_SIZE],
+                ).fetchone()[0]
+                if batch_last_uri is None:
+                    with self.write_lock, self.write_connection:
+                        self.write_connection.execute(
+                            f"PRAGMA user_version = {SqliteMinerStorage.CONTENT_HASH_USER_VERSION}"
+                        )
+                    break
+
+                # Hash outside of the write lock. Rows replaced meanwhile already have a hash, so are skipped below.
+                rows = connection.execute(
+                    """SELECT uri, timeBucketId, content, contentCodec FROM DataEntity
+                        WHERE uri > ? AND uri <= ? AND contentHash IS NULL""",
+                    [last_uri, batch_last_uri],
+                ).fetchall()
+                content_hashes = [
+                    hashlib.sha1(
+                        content_codec_utils.decompress(
+                            row["content"], ContentCodec(row["contentCodec"])
+                        )
+                    ).digest()
+                    for row in rows
+                ]
+
+                deleted_time_bucket_ids = set()
+                with self.write_lock, contextlib.closing(
+                    self.write_connection.cursor()
+                ) as cursor:
+                    uris_by_content_hash = self._get_uris_by_content_hash(
+                        cursor, content_hashes
+                    )
+                    updates = []
+                    deletes = []
+                    for row, content_hash in zip(rows, content_hashes):
+                        if (
+                            uris_by_content_hash.setdefault(content_hash, row["uri"])
+                            == row["uri"]
+                        ):
+                            updates.append([content_hash, row["uri"]])
+                        else:
+                            deletes.append([row["uri"]])
+                            deleted_time_bucket_ids.add(row["timeBucketId"])
+
+                    with self.write_connection:
+                        cursor.executemany(
+                            "UPDATE DataEntity SET contentHash = ? WHERE uri = ? AND contentHash IS NULL",
+                            updates,
+                        )
+                        cursor.executemany(
+                            "DELETE FROM DataEntity WHERE uri = ? AND contentHash IS NULL",
+                            deletes,
+                        )
+
+                if deleted_time_bucket_ids:
+                    self._notify_write_listeners(deleted_time_bucket_ids)
+
+                hashed_rows += len(updates)
+                deleted_rows += len(deletes)
+                last_uri = batch_last_uri
+
+        bt.logging.info(
+            f"Hashed the content of {hashed_rows} rows of {self.database}. Deleted {deleted_rows} rows with duplicate content."
+        )
+        return hashed_rows
+
+    def migrate_legacy_labels(self) -> int:
+        """Replaces the legacyLabel of rows stored before the Label table with ids into it, in batches so writes can
+        interleave.
+
+        legacyLabel is set to NULL as each row is migrated, so its space is reused. Rows are only served once
+        migrated. Safe to interrupt and rerun. Returns the number of rows migrated.
+        """
+        migrated_rows = 0
+        last_uri = ""
+        with contextlib.closing(self._create_connection()) as connection:
+            while not self.is_closed:
+                # Walk the primary key so each batch resumes where the last one stopped.
+                batch_last_uri = connection.execute(
+                    "SELECT MAX(uri) FROM (SELECT uri FROM DataEntity WHERE uri > ? ORDER BY uri LIMIT ?)",
+                    [last_uri, SqliteMinerStorage.LABEL_MIGRATION_BATCH_SIZE],
+                ).fetchone()[0]
+                if batch_last_uri is None:
+                    with self.write_lock, self.write_connection:
+                        self.write_connection.execute(
+                            f"PRAGMA user_version = {SqliteMinerStorage.LABEL_ID_USER_VERSION}"
+                        )
+                    break
+
+                # Rows stored meanwhile already have a label id, so are skipped below.
+                rows = connection.execute(
+                    """SELECT DISTINCT timeBucketId, IFNULL(legacyLabel, 'NULL') AS label FROM DataEntity
+                        WHERE uri > ? AND uri <= ? AND labelId IS NULL""",
+                    [last_uri, batch_last_uri],
+                ).fetchall()
+
+                with self.write_lock:
+                    # Intern the labels first, so every migrated row's id can be read back as a label.
+                    self._get_or_insert_label_ids({row["label"] for row in rows})
+                    with self.write_connection:
+                        cursor = self.write_connection.execute(
+                            """UPDATE DataEntity
+                                SET labelId = IFNULL(
+                                    labelId,
+                                    (SELECT labelId FROM Label WHERE value = IFNULL(DataEntity.legacyLabel, 'NULL'))
+                                ), legacyLabel = NULL
+                                WHERE uri > ? AND uri <= ? AND (labelId IS NULL OR legacyLabel IS NOT NULL)""",
+                            [last_uri, batch_last_uri],
+                        )
+                        migrated_rows += cursor.rowcount
+
+                # The migrated rows are now served in their buckets.
+                if rows:
+                    self._notify_write_listeners({row["timeBucketId"] for row in rows})
+
+                last_uri = batch_last_uri
+
+        bt.logging.info(
+            f"Migrated {migrated_rows} rows of {self.database} to label ids."
+        )
+        return migrated_rows
+
+    def _read_data_entity_bucket_rows(
         self, data_entity_bucket_id: DataEntityBucketId
-    ) -> List[DataEntity]:
-        """Lists from storage all DataEntities matching the provided DataEntityBucketId."""
+    ) -> List[sqlite3.Row]:
+        """Reads the rows of the DataEntityBucket, up to the max DataEntityBucket size."""
         # Get rows that match the DataEntityBucketId.
-        label = (
+        label_id = self._get_label_id(
             "NULL"
             if (data_entity_bucket_id.label is None)
             else data_entity_bucket_id.label.value
         )
+        if label_id is None:
+            return []
 
-        with contextlib.closing(self._create_connection()) as connection:
-            cursor = connection.cursor()
+        with contextlib.closing(self._get_read_connection().cursor()) as cursor:
+            # Find the rows within the max DataEntityBucket size using only the covering index, so that content past
+            # the limit is never read. Order by uri so repeated requests for a bucket return the same subset.
             cursor.execute(
-                """SELECT * FROM DataEntity 
-                        WHERE timeBucketId = ? AND source = ? AND label = ?""",
+                """WITH CappedBucket AS (
+                        SELECT uri FROM (
+                            SELECT uri, SUM(contentSizeBytes) OVER (
+                                ORDER BY uri ROWS UNBOUNDED PRECEDING
+                            ) AS runningSize
+                            FROM DataEntity
+                            WHERE timeBucketId = ? AND source = ? AND labelId = ?
+                        )
+                        WHERE runningSize < ?
+                    )
+                    SELECT uri, datetime, source, labelId, content, contentSizeBytes, contentCodec
+                    FROM CappedBucket
+                    JOIN DataEntity USING (uri)
+                    ORDER BY uri""",
                 [
                     data_entity_bucket_id.time_bucket.id,
                     data_entity_bucket_id.source,
-                    label,
+                    label_id,
+                    constants.DATA_ENTITY_BUCKET_SIZE_LIMIT_BYTES,
                 ],
             )
+            return cursor.fetchall()
 
-            # Convert the rows into DataEntity objects and return them up to the configured max chuck size.
-            data_entities = []
+    def list_data_entities_in_data_entity_bucket(
+        self, data_entity_bucket_id: DataEntityBucketId
+    ) -> List[DataEntity]:
+        """Lists from storage all DataEntities matching the provided DataEntityBucketId."""
+        # Convert the rows into DataEntity objects.
+        data_entities = []
 
-            running_size = 0
+        for row in self._read_data_entity_bucket_rows(data_entity_bucket_id):
+            # Construct the new DataEntity with all non null columns.
+            data_entity = DataEntity(
+                uri=row["uri"],
+                datetime=epoch_micros_to_datetime(row["datetime"]),
+                source=DataSource(row["source"]),
+                content=content_codec_utils.decompress(
+                    row["content"], row["contentCodec"]
+                ),
+                content_size_bytes=row["contentSizeBytes"],
+            )
 
-            for row in cursor:
-                if (
-                    running_size + row["contentSizeBytes"]
-                    >= constants.DATA_ENTITY_BUCKET_SIZE_LIMIT_BYTES
-                ):
-                    # If we would go over the max DataEntityBucket size instead return early.
-                    return data_entities
-                else:
-                    # Construct the new DataEntity with all non null columns.
-                    data_entity = DataEntity(
-                        uri=row["uri"],
-                        datetime=row["datetime"],
-                        source=DataSource(row["source"]),
-                        content=row["content"],
-                        content_size_bytes=row["contentSizeBytes"],
-                    )
+            # Add the optional Label field if not null.
+            label = self._get_label_value(row["labelId"])
+            if label != "NULL":
+                data_entity.label = DataLabel(value=label)
 
-                    # Add the optional Label field if not null.
-                    if row["label"] != "NULL":
-                        data_entity.label = DataLabel(value=row["label"])
+            data_entities.append(data_entity)
 
-                    data_entities.append(data_entity)
-                    running_size += row["contentSizeBytes"]
+        bt.logging.trace(
+            f"Returning {len(data_entities)} data entities for bucket {data_entity_bucket_id}"
+        )
+        return data_entities
 
-            # If we reach the end of the cursor then return all of the data entities for this DataEntityBucket.
-            bt.logging.trace(
-                f"Returning {len(data_entities)} data entities for bucket {data_entity_bucket_id}"
+    def get_serialized_data_entities_in_data_entity_bucket(
+        self, data_entity_bucket_id: DataEntityBucketId
+    ) -> SerializedDataEntities:
+        """Gets from storage all DataEntities matching the provided DataEntityBucketId, serialized for the wire.
+
+        Builds the json straight from the rows, in the same form pydantic would serialize each DataEntity, without
+        constructing and validating a DataEntity per row.
+        """
+        entities = []
+        content_size_bytes = 0
+
+        for row in self._read_data_entity_bucket_rows(data_entity_bucket_id):
+            label = self._get_label_value(row["labelId"])
+            entities.append(
+                {
+                    "uri": row["uri"],
+                    "datetime": epoch_micros_to_datetime(row["datetime"]).isoformat(),
+                    "source": row["source"],
+                    "label": None if label == "NULL" else {"value": label},
+                    "content": content_codec_utils.decompress(
+                        row["content"], row["contentCodec"]
+                    ).decode(),
+                    "content_size_bytes": row["contentSizeBytes"],
+                }
+            )
+            content_size_bytes += row["contentSizeBytes"]
+
+        return SerializedDataEntities(
+            serialized=json.dumps(entities),
+            count=len(entities),
+            content_size_bytes=content_size_bytes,
+        )
+
+    def iter_data_entity_rows(
+        self, batch_size: int = 10_000
+    ) -> Iterator[List[DataEntityRow]]:
+        """Yields every stored DataEntity as DataEntityRows, in batches of up to batch_size.
+
+        Rows are ordered by time bucket then source, and a batch never spans more than one time bucket and source.
+        Each time bucket and source is read with its own query, so an export of a large database does not hold a
+        single read transaction open throughout.
+        """
+        with contextlib.closing(self._get_read_connection().cursor()) as cursor:
+            cursor.execute(
+                "SELECT DISTINCT timeBucketId, source FROM BucketSummary ORDER BY timeBucketId, source"
             )
-            return data_entities
+            time_bucket_sources = cursor.fetchall()
+
+            for time_bucket_id, source in time_bucket_sources:
+                cursor.execute(
+                    """SELECT uri, datetime, source, labelId, content, contentSizeBytes, contentCodec FROM DataEntity
+                        WHERE timeBucketId = ? AND source = ?""",
+                    [time_bucket_id, source],
+                )
+                while True:
+                    batch = cursor.fetchmany(batch_size)
+                    if not batch:
+                        break
+
+                    rows = []
+                    for row in batch:
+                        label = self._get_label_value(row["labelId"])
+                        rows.append(
+                            DataEntityRow(
+                                uri=row["uri"],
+                                # Rows not yet migrated from text datetimes are converted as they are read.
+                                datetime=(
+                                    row["datetime"]
+                                    if isinstance(row["datetime"], int)
+                                    else datetime_to_epoch_micros(
+                                        epoch_micros_to_datetime(row["datetime"])
+                                    )
+                                ),
+                                source=row["source"],
+                                label=None if label == "NULL" else label,
+                                content=content_codec_utils.decompress(
+                                    row["content"], row["contentCodec"]
+                                ),
+                                content_size_bytes=row["contentSizeBytes"],
+                            )
+                        )
+                    yield rows
 
     def get_compressed_index(
         self,
@@ -242,19 +1148,16 @@ class SqliteMinerStorage(MinerStorage):
     ) -> CompressedMinerIndex:
         """Gets the compressed MinedIndex, which is a summary of all of the DataEntities that this MinerStorage is currently serving."""
 
-        with contextlib.closing(self._create_connection()) as connection:
-            cursor = connection.cursor()
-
+        with contextlib.closing(self._get_read_connection().cursor()) as cursor:
             oldest_time_bucket_id = TimeBucket.from_datetime(
                 dt.datetime.now()
                 - dt.timedelta(constants.DATA_ENTITY_BUCKET_AGE_LIMIT_DAYS)
             ).id
 
-            # Get sum of content_size_bytes for all rows grouped by DataEntityBucket.
+            # Get the pre-aggregated size of each DataEntityBucket.
             cursor.execute(
-                """SELECT SUM(contentSizeBytes) AS bucketSize, timeBucketId, source, label FROM DataEntity
+                """SELECT totalBytes AS bucketSize, timeBucketId, source, labelId FROM BucketSummary
                         WHERE timeBucketId >= ?
-                        GROUP BY timeBucketId, source, label
                         ORDER BY bucketSize DESC
                         LIMIT ?
                         """,
@@ -275,7 +1178,9 @@ class SqliteMinerStorage(MinerStorage):
                     else row["bucketSize"]
                 )
 
-                label = row["label"] if row["label"] != "NULL" else None
+                label = self._get_label_value(row["labelId"])
+                if label == "NULL":
+                    label = None
 
                 bucket = buckets_by_source_by_label[DataSource(row["source"])].get(
                     label, CompressedEntityBucket(label=label)
@@ -293,47 +1198,196 @@ class SqliteMinerStorage(MinerStorage):
             )
 
     def clear_content_from_oldest(self, content_bytes_to_clear: int):
-        """Deletes entries starting from the oldest until we have cleared the specified amount of content."""
+        """Deletes whole time buckets starting from the oldest until we have cleared the specified amount of content."""
+
+        with self.write_lock, contextlib.closing(
+            self.write_connection.cursor()
+        ) as cursor:
+            self._clear_content_from_oldest(cursor, content_bytes_to_clear)
+
+        self._vacuum_free_pages()
+
+    def _clear_content_from_oldest(
+        self, cursor: sqlite3.Cursor, content_bytes_to_clear: int
+    ):
+        """Deletes whole time buckets starting from the oldest, leaving the freed pages for reuse.
+
+        Must be called while holding the write lock.
+        """
 
         bt.logging.debug(f"Database full. Clearing {content_bytes_to_clear} bytes.")
 
-        with contextlib.closing(self._create_connection()) as connection:
-            cursor = connection.cursor()
+        # Get the oldest time buckets, up to the first whose cumulative size covers the content to clear.
+        cursor.execute(
+            """SELECT timeBucketId, bucketSize FROM (
+                    SELECT timeBucketId, SUM(totalBytes) AS bucketSize,
+                    SUM(SUM(totalBytes)) OVER (ORDER BY timeBucketId) - SUM(totalBytes) AS precedingBytes
+                    FROM BucketSummary
+                    GROUP BY timeBucketId
+                )
+                WHERE precedingBytes < ?
+                ORDER BY timeBucketId ASC""",
+            [content_bytes_to_clear],
+        )
+        time_buckets_to_clear = [tuple(row) for row in cursor.fetchall()]
+
+        cleared_bytes = 0
+        for time_bucket_id, bucket_size in time_buckets_to_clear:
+            self._delete_time_bucket(cursor, time_bucket_id)
+            cleared_bytes += bucket_size
+
+        self.write_connection.commit()
+
+        bt.logging.debug(
+            f"Cleared {cleared_bytes} bytes across {len(time_buckets_to_clear)} time buckets."
+        )
 
-            # TODO Investigate way to select last X bytes worth of entries in a single query.
-            # Get the contentSizeBytes of each row by timestamp desc.
+        self._notify_write_listeners(
+            {time_bucket_id for time_bucket_id, _ in time_buckets_to_clear}
+        )
+
+    def _delete_time_bucket(self, cursor: sqlite3.Cursor, time_bucket_id: int):
+        """Deletes all DataEntities in a time bucket, committing in batches to keep each transaction bounded.
+
+        Must be called while holding the write lock.
+        """
+        while (
+            self._delete_time_bucket_batch(cursor, time_bucket_id)
+            == SqliteMinerStorage.DELETE_BATCH_SIZE
+        ):
+            pass
+
+    def _delete_time_bucket_batch(
+        self, cursor: sqlite3.Cursor, time_bucket_id: int
+    ) -> int:
+        """Deletes and commits up to DELETE_BATCH_SIZE DataEntities in a time bucket, returning the number deleted.
+
+        Must be called while holding the write lock.
+        """
+        cursor.execute(
+            """DELETE FROM DataEntity WHERE uri IN (
+                    SELECT uri FROM DataEntity WHERE timeBucketId = ? LIMIT ?
+                )""",
+            [time_bucket_id, SqliteMinerStorage.DELETE_BATCH_SIZE],
+        )
+        deleted_rows = cursor.rowcount
+        self.write_connection.commit()
+        return deleted_rows
+
+    def delete_expired_data_entities(self) -> int:
+        """Deletes every DataEntity older than the age limit, returning the content bytes cleared.
+
+        Deletes in batches and releases the write lock between them, so stores are never blocked for long. Freed pages
+        are then returned to the file system in batches too.
+        """
+        oldest_time_bucket_id = TimeBucket.from_datetime(
+            dt.datetime.now()
+            - dt.timedelta(constants.DATA_ENTITY_BUCKET_AGE_LIMIT_DAYS)
+        ).id
+
+        with contextlib.closing(self._get_read_connection().cursor()) as cursor:
             cursor.execute(
-                "SELECT contentSizeBytes, datetime FROM DataEntity ORDER BY datetime ASC"
+                """SELECT timeBucketId, SUM(totalBytes) FROM BucketSummary
+                        WHERE timeBucketId < ?
+                        GROUP BY timeBucketId
+                        ORDER BY timeBucketId ASC""",
+                [oldest_time_bucket_id],
             )
+            expired_time_buckets = [tuple(row) for row in cursor.fetchall()]
 
-            running_bytes = 0
-            earliest_datetime_to_clear = dt.datetime.min
-            # Iterate over rows until we have found bytes to clear or we reach the end and fail.
-            for row in cursor:
-                running_bytes += row["contentSizeBytes"]
-                earliest_datetime_to_clear = row["datetime"]
-                # Once we have enough content to clear then we do so.
-                if running_bytes >= content_bytes_to_clear:
-                    cursor.execute(
-                        "DELETE FROM DataEntity WHERE datetime <= ?",
-                        [earliest_datetime_to_clear],
+        for time_bucket_id, _ in expired_time_buckets:
+            deleted_rows = SqliteMinerStorage.DELETE_BATCH_SIZE
+            while deleted_rows == SqliteMinerStorage.DELETE_BATCH_SIZE:
+                with self.write_lock, contextlib.closing(
+                    self.write_connection.cursor()
+                ) as cursor:
+                    deleted_rows = self._delete_time_bucket_batch(
+                        cursor, time_bucket_id
                     )
-                    connection.commit()
+
+        self._vacuum_free_pages()
+
+        if expired_time_buckets:
+            bt.logging.debug(
+                f"Deleted {len(expired_time_buckets)} expired time buckets."
+            )
+            self._notify_write_listeners(
+                {time_bucket_id for time_bucket_id, _ in expired_time_buckets}
+            )
+
+        return sum(bucket_size for _, bucket_size in expired_time_buckets)
+
+    def _vacuum_free_pages(self):
+        """Returns the free pages to the file system in batches, releasing the write lock between them.
+
+        Also resamples the database size on the next store, since deleting rows shrinks it.
+        """
+        while self._incremental_vacuum_batch() > 0:
+            pass
+
+        # The database file is only truncated once the vacuumed pages are checkpointed out of the write-ahead log.
+        # A passive checkpoint never waits, so it is safe under the write lock, but stops at frames a reader still needs.
+        with self.write_lock, contextlib.closing(
+            self.write_connection.cursor()
+        ) as cursor:
+            cursor.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+        self._truncate_wal()
+
+        with self.database_size_lock:
+            self.database_size_sampled_at = None
+
+    def _truncate_wal(self):
+        """Checkpoints the whole write-ahead log and truncates it, since deletes grow it.
+
+        Runs on its own connection without the write lock, and gives up after WAL_TRUNCATE_TIMEOUT_SECONDS if readers
+        or a writer are still using the log, so stores are never blocked behind a long read.
+        """
+        try:
+            with contextlib.closing(
+                sqlite3.connect(
+                    self.database,
+                    timeout=SqliteMinerStorage.WAL_TRUNCATE_TIMEOUT_SECONDS,
+                )
+            ) as connection:
+                connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.OperationalError:
+            bt.logging.trace(
+                "Skipped truncating the write-ahead log while it is in use."
+            )
+
+    def _incremental_vacuum_batch(self) -> int:
+        """Returns up to VACUUM_BATCH_PAGES free pages to the file system, returning the number of free pages left.
+
+        Returns 0 unless auto_vacuum is INCREMENTAL, since free pages are otherwise kept for reuse.
+        """
+        if not self.is_incremental_vacuum:
+            return 0
+
+        with self.write_lock, contextlib.closing(
+            self.write_connection.cursor()
+        ) as cursor:
+            # The pragma returns no rows, so execute would only step it once, freeing a single page. executescript
+            # runs it to completion in its own transaction.
+            self.write_connection.executescript(
+                f"PRAGMA incremental_vacuum({SqliteMinerStorage.VACUUM_BATCH_PAGES})"
+            )
+
+            cursor.execute("PRAGMA freelist_count")
+            return cursor.fetchone()[0]
 
     def list_data_entity_buckets(self) -> List[DataEntityBucket]:
         """Lists all DataEntityBuckets for all the DataEntities that this MinerStorage is currently serving."""
 
-        with contextlib.closing(self._create_connection()) as connection:
-            cursor = connection.cursor()
+        with contextlib.closing(self._get_read_connection().cursor()) as cursor:
             oldest_time_bucket_id = TimeBucket.from_datetime(
                 dt.datetime.now()
                 - dt.timedelta(constants.DATA_ENTITY_BUCKET_AGE_LIMIT_DAYS)
             ).id
-            # Get sum of content_size_bytes for all rows grouped by DataEntityBucket.
+            # Get the pre-aggregated size of each DataEntityBucket.
             cursor.execute(
-                """SELECT SUM(contentSizeBytes) AS bucketSize, timeBucketId, source, label FROM DataEntity
+                """SELECT totalBytes AS bucketSize, timeBucketId, source, labelId FROM BucketSummary
                         WHERE timeBucketId >= ?
-                        GROUP BY timeBucketId, source, label
                         ORDER BY bucketSize DESC
                         LIMIT ?
                         """,
@@ -361,8 +1415,9 @@ class SqliteMinerStorage(MinerStorage):
                 )
 
                 # Add the optional Label field if not null.
-                if row["label"] != "NULL":
-                    data_entity_bucket_id.label = DataLabel(value=row["label"])
+                label = self._get_label_value(row["labelId"])
+                if label != "NULL":
+                    data_entity_bucket_id.label = DataLabel(value=label)
 
                 data_entity_bucket = DataEntityBucket(
                     id=data_entity_bucket_id, size_bytes=size
@@ -0,0 +1,281 @@
+import bisect
+import dataclasses
+import datetime as dt
+import functools
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import bittensor as bt
+
+
+# The upper bounds in seconds of the latency histogram buckets, doubling from 100us to ~105s.
+LATENCY_BUCKET_BOUNDS = [0.0001 * 2**i for i in range(21)]
+
+
+# Returns the (rows, bytes) handled by a call, given its args, kwargs and result.
+OperationSizer = Callable[[tuple, dict, Any], Tuple[int, int]]
+
+
+def _first_arg(args: tuple, kwargs: dict) -> Any:
+    return args[0] if args else next(iter(kwargs.values()), None)
+
+
+def _size_data_entities(data_entities) -> Tuple[int, int]:
+    return len(data_entities), sum(
+        data_entity.content_size_bytes for data_entity in data_entities
+    )
+
+
+def _size_compressed_index(index) -> Tuple[int, int]:
+    compressed_buckets = [
+        compressed_bucket
+        for compressed_buckets in index.sources.values()
+        for compressed_bucket in compressed_buckets
+    ]
+    return sum(len(bucket.time_bucket_ids) for bucket in compressed_buckets), sum(
+        sum(bucket.sizes_bytes) for bucket in compressed_buckets
+    )
+
+
+# The public MinerStorage operations to instrument, and how to size each call.
+MINER_STORAGE_OPERATIONS: Dict[str, OperationSizer] = {
+    "store_data_entities": lambda args, kwargs, result: _size_data_entities(
+        _first_arg(args, kwargs)
+    ),
+    "store_data_entity_rows": lambda args, kwargs, result: _size_data_entities(
+        _first_arg(args, kwargs)
+    ),
+    "list_data_entities_in_data_entity_bucket": lambda args, kwargs, result: _size_data_entities(
+        result
+    ),
+    "get_serialized_data_entities_in_data_entity_bucket": lambda args, kwargs, result: (
+        result.count,
+        len(result.serialized),
+    ),
+    "get_compressed_index": lambda args, kwargs, result: _size_compressed_index(result),
+    "list_data_entity_buckets": lambda args, kwargs, result: (
+        len(result),
+        sum(bucket.size_bytes for bucket in result),
+    ),
+    "clear_content_from_oldest": lambda args, kwargs, result: (
+        0,
+        _first_arg(args, kwargs),
+    ),
+    "delete_expired_data_entities": lambda args, kwargs, result: (0, result),
+}
+
+# The public ValidatorStorage operations to instrument, and how to size each call.
+VALIDATOR_STORAGE_OPERATIONS: Dict[str, OperationSizer] = {
+    "upsert_miner_index": lambda args, kwargs, result: (
+        len(_first_arg(args, kwargs).data_entity_buckets),
+        sum(
+            bucket.size_bytes for bucket in _first_arg(args, kwargs).data_entity_buckets
+        ),
+    ),
+    "upsert_compressed_miner_index": lambda args, kwargs, result: _size_compressed_index(
+        _first_arg(args, kwargs)
+    ),
+    "read_miner_index": lambda args, kwargs, result: (
+        (
+            len(result.scorable_data_entity_buckets),
+            sum(bucket.size_bytes for bucket in result.scorable_data_entity_buckets),
+        )
+        if result
+        else (0, 0)
+    ),
+    "read_scorable_buckets": lambda args, kwargs, result: (
+        (len(result.scorable_bytes), int(result.scorable_bytes.sum()))
+        if result
+        else (0, 0)
+    ),
+    "delete_miner": lambda args, kwargs, result: (0, 0),
+    "read_miner_last_updated": lambda args, kwargs, result: (0, 0),
+}
+
+
+class LatencyHistogram:
+    """A histogram of latencies in fixed, exponentially sized buckets. Not thread safe."""
+
+    def __init__(self):
+        # The last count is for latencies above every bound.
+        self.counts = [0] * (len(LATENCY_BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def record(self, seconds: float):
+        self.counts[bisect.bisect_left(LATENCY_BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def percentile(self, percent: float) -> float:
+        """Returns an upper bound of the latency at the provided percentile, or 0 if nothing has been recorded."""
+        if self.count == 0:
+            return 0.0
+
+        rank = max(1, self.count * percent / 100)
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                if i == len(LATENCY_BUCKET_BOUNDS):
+                    return self.max_seconds
+                return min(LATENCY_BUCKET_BOUNDS[i], self.max_seconds)
+        return self.max_seconds
+
+
+@dataclasses.dataclass(frozen=True)
+class OperationMetrics:
+    """A snapshot of the metrics of one storage operation."""
+
+    # The number of calls made.
+    calls: int
+
+    # The number of calls that raised an exception.
+    errors: int
+
+    # The total rows read or written.
+    rows: int
+
+    # The total bytes read or written.
+    bytes: int
+
+    # The total time spent in the operation.
+    total_seconds: float
+
+    # Upper bounds of the median and 99th percentile latencies.
+    p50_seconds: float
+    p99_seconds: float
+
+    # The longest any call has taken.
+    max_seconds: float
+
+
+class _OperationStats:
+    def __init__(self):
+        self.histogram = LatencyHistogram()
+        self.errors = 0
+        self.rows = 0
+        self.bytes = 0
+
+
+class StorageMetrics:
+    """Records latency histograms, row counts and bytes for the public operations of a storage.
+
+    Use instrument to wrap a storage's operations. Storages that are never instrumented pay no overhead.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.lock = threading.Lock()
+        self.stats: Dict[str, _OperationStats] = {}
+
+        # Whether the calling thread is already inside an instrumented operation.
+        self.thread_local = threading.local()
+
+    def record(
+        self, operation: str, seconds: float, rows: int, size_bytes: int, error: bool
+    ):
+        """Records one call to the operation."""
+        with self.lock:
+            stats = self.stats.get(operation)
+            if stats is None:
+                stats = self.stats[operation] = _OperationStats()
+            stats.histogram.record(seconds)
+            stats.rows += rows
+            stats.bytes += size_bytes
+            if error:
+                stats.errors += 1
+
+    def instrument(self, storage: Any, operations: Dict[str, OperationSizer]) -> Any:
+        """Wraps the provided operations of the storage in place, so every call is recorded. Returns the storage.
+
+        Only the outermost call is recorded, so calls the storage makes to its own instrumented operations, e.g.
+        store_data_entities delegating to store_data_entity_rows, are not counted twice.
+        """
+        for operation, sizer in operations.items():
+            method = getattr(storage, operation, None)
+            if method is None:
+                continue
+            setattr(storage, operation, self._wrap(operation, method, sizer))
+        return storage
+
+    def _wrap(self, operation: str, method: Callable, sizer: OperationSizer):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            if getattr(self.thread_local, "is_recording", False):
+                return method(*args, **kwargs)
+
+            self.thread_local.is_recording = True
+            start = time.perf_counter()
+            try:
+                result = method(*args, **kwargs)
+            except Exception:
+                self.record(operation, time.perf_counter() - start, 0, 0, error=True)
+                raise
+            finally:
+                self.thread_local.is_recording = False
+            seconds = time.perf_counter() - start
+
+            try:
+                rows, size_bytes = sizer(args, kwargs, result)
+            except Exception:
+                # Never fail a storage call because its size could not be measured.
+                rows, size_bytes = 0, 0
+            self.record(operation, seconds, rows, size_bytes, error=False)
+            return result
+
+        return wrapper
+
+    def get_metrics(self) -> Dict[str, OperationMetrics]:
+        """Returns a snapshot of the metrics of each operation called so far."""
+        with self.lock:
+            return {
+                operation: OperationMetrics(
+                    calls=stats.histogram.count,
+                    errors=stats.errors,
+                    rows=stats.rows,
+                    bytes=stats.bytes,
+                    total_seconds=stats.histogram.total_seconds,
+                    p50_seconds=stats.histogram.percentile(50),
+                    p99_seconds=stats.histogram.percentile(99),
+                    max_seconds=stats.histogram.max_seconds,
+                )
+                for operation, stats in sorted(self.stats.items())
+            }
+
+    def format_metrics(self) -> List[str]:
+        """Returns one log line per operation called so far."""
+        return [
+            f"{self.name}.{operation} | "
+            f"Calls:{metrics.calls} | "
+            f"Errors:{metrics.errors} | "
+            f"Rows:{metrics.rows} | "
+            f"Bytes:{metrics.bytes} | "
+            f"p50:{metrics.p50_seconds:.4f}s | "
+            f"p99:{metrics.p99_seconds:.4f}s | "
+            f"Max:{metrics.max_seconds:.4f}s"
+            for operation, metrics in self.get_metrics().items()
+        ]
+
+    def dump_to_file(self, path: str):
+        """Appends a snapshot of the metrics to the file as a json line."""
+        snapshot = {
+            "timestamp": dt.datetime.now(tz=dt.timezone.utc).isoformat(),
+            "storage": self.name,
+            "operations": {
+                operation: dataclasses.asdict(metrics)
+                for operation, metrics in self.get_metrics().items()
+            },
+        }
+        with open(path, "a") as file:
+            file.write(json.dumps(snapshot) + "\n")
+
+    def report(self, path: Optional[str] = None):
+        """Logs the metrics, and appends them to the file at path if provided."""
+        for line in self.format_metrics():
+            bt.logging.info(line)
+        if path:
+            self.dump_to_file(path)
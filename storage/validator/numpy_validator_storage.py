@@ -0,0 +1,469 @@
+import dataclasses
+import datetime as dt
+import os
+import threading
+from typing import Dict, List, Optional, Tuple, Union
+import bittensor as bt
+import numpy as np
+from common.data import CompressedMinerIndex, DataLabel, MinerIndex
+from common.data_v2 import (
+    ScorableBuckets,
+    ScorableDataEntityBucket,
+    ScorableMinerIndex,
+)
+from storage.validator.sqlite_memory_validator_storage import AutoIncrementDict
+from storage.validator.validator_storage import ValidatorStorage
+
+
+# Each bucket is keyed by a single int64, packing its source, label id and time bucket id into separate bit ranges.
+# Packed keys sort in (source, labelId, timeBucketId) order.
+LABEL_ID_SHIFT = 28
+SOURCE_SHIFT = 56
+MAX_TIME_BUCKET_ID = (1 << LABEL_ID_SHIFT) - 1
+MAX_LABEL_ID = (1 << (SOURCE_SHIFT - LABEL_ID_SHIFT)) - 1
+MAX_SOURCE = (1 << (63 - SOURCE_SHIFT)) - 1
+
+
+def pack_bucket_keys(
+    sources: np.ndarray, label_ids: np.ndarray, time_bucket_ids: np.ndarray
+) -> np.ndarray:
+    """Packs the ids of buckets into int64 keys."""
+    return (
+        (sources.astype(np.int64) << SOURCE_SHIFT)
+        | (label_ids.astype(np.int64) << LABEL_ID_SHIFT)
+        | time_bucket_ids.astype(np.int64)
+    )
+
+
+def unpack_bucket_keys(keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Unpacks int64 keys into the (sources, label_ids, time_bucket_ids) of the buckets."""
+    return (
+        keys >> SOURCE_SHIFT,
+        (keys >> LABEL_ID_SHIFT) & MAX_LABEL_ID,
+        keys & MAX_TIME_BUCKET_ID,
+    )
+
+
+def _scorable_bytes(
+    sizes: np.ndarray,
+    credibilities: Union[float, np.ndarray],
+    totals: np.ndarray,
+) -> np.ndarray:
+    """Computes the scorable bytes of buckets from their sizes, their miners' credibilities and the bucket totals."""
+    # A miner's share of a bucket's scorable bytes is its credibility weighted share of the bucket's total size.
+    sizes = sizes.astype(np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scorable_bytes = np.where(
+            totals != 0, sizes * (sizes * credibilities) / totals, 0.0
+        )
+    # Totals are maintained incrementally, so cap in case of any floating point drift.
+    return np.clip(scorable_bytes, 0, sizes).astype(np.int64)
+
+
+@dataclasses.dataclass(frozen=True)
+class _MinerState:
+    """The index of one miner. Arrays are never modified once created."""
+
+    miner_id: int
+    last_updated: dt.datetime
+    credibility: float
+
+    # The sorted, unique packed keys of the buckets the miner serves.
+    keys: np.ndarray
+
+    # The content size in bytes of each bucket in keys.
+    sizes: np.ndarray
+
+
+class NumpyValidatorStorage(ValidatorStorage):
+    """In-memory Validator Storage that keeps each miner's index as typed NumPy arrays.
+
+    Alongside the per miner arrays, the credibility weighted total content size of every bucket across all miners is
+    kept in sorted arrays, updated on each upsert and delete. Scoring a miner's index is then a vectorized lookup of
+    the miner's keys, with no per row work until the ScorableDataEntityBuckets are built.
+    """
+
+    # Compact the bucket totals once this share of them are no longer served by any miner.
+    COMPACTION_THRESHOLD = 0.5
+
+    def __init__(self):
+        self.label_dict = AutoIncrementDict()
+        self.miners: Dict[str, _MinerState] = {}
+        self.next_miner_id = 1
+
+        # Sorted, unique packed keys of every bucket served by any miner, with the credibility weighted total content
+        # size and number of miners serving each. Entries may be left at a count of 0 until the next compaction.
+        self.bucket_keys = np.empty(0, dtype=np.int64)
+        self.bucket_totals = np.empty(0, dtype=np.float64)
+        self.bucket_counts = np.empty(0, dtype=np.int32)
+        self.empty_bucket_count = 0
+
+        # Lock to avoid concurrency issues on interacting with the index.
+        self.lock = threading.Lock()
+
+    def _upsert_miner(
+        self, hotkey: str, now: Union[dt.datetime, str], credibility: float
+    ) -> int:
+        """Updates the miner's last updated time and credibility, returning its id. Must hold the lock."""
+        if isinstance(now, str):
+            # Accept the string form used by SqliteMemoryValidatorStorage.
+            now = dt.datetime.strptime(now, "%Y-%m-%d %H:%M:%S.%f")
+
+        miner = self.miners.get(hotkey, None)
+        if miner is None:
+            miner = _MinerState(
+                miner_id=self.next_miner_id,
+                last_updated=now,
+                credibility=credibility,
+                keys=np.empty(0, dtype=np.int64),
+                sizes=np.empty(0, dtype=np.int64),
+            )
+            self.next_miner_id += 1
+        else:
+            # Rescale the miner's existing contribution to the totals to its new credibility.
+            self._add_to_bucket_totals(
+                miner.keys, miner.sizes * (credibility - miner.credibility), 0
+            )
+            miner = dataclasses.replace(
+                miner, last_updated=now, credibility=credibility
+            )
+
+        self.miners[hotkey] = miner
+        return miner.miner_id
+
+    def _label_value_parse(self, label: Optional[DataLabel]) -> str:
+        """Parses the value to store out of an Optional DataLabel."""
+        return "NULL" if (label is None) else label.value
+
+    def _label_value_parse_str(self, label: Optional[str]) -> str:
+        """Same as _label_value_parse but with a string as input"""
+        return "NULL" if (label is None) else label.casefold()
+
+    def _add_to_bucket_totals(
+        self, keys: np.ndarray, adjusted_sizes: np.ndarray, count_delta: int
+    ):
+        """Adds the credibility adjusted sizes to the totals of the buckets, which must already exist. Must hold the lock."""
+        positions = np.searchsorted(self.bucket_keys, keys)
+        self.bucket_totals[positions] += adjusted_sizes
+        if count_delta:
+            self.bucket_counts[positions] += count_delta
+
+    def _insert_bucket_keys(self, keys: np.ndarray):
+        """Adds any of the sorted keys missing from the bucket totals, with a total of 0. Must hold the lock."""
+        positions = np.searchsorted(self.bucket_keys, keys)
+        existing = positions < len(self.bucket_keys)
+        existing[existing] = self.bucket_keys[positions[existing]] == keys[existing]
+
+        missing = ~existing
+        if missing.any():
+            self.bucket_keys = np.insert(
+                self.bucket_keys, positions[missing], keys[missing]
+            )
+            self.bucket_totals = np.insert(self.bucket_totals, positions[missing], 0.0)
+            self.bucket_counts = np.insert(self.bucket_counts, positions[missing], 0)
+
+    def _remove_miner_buckets(self, miner: _MinerState):
+        """Removes the miner's contribution from the bucket totals. Must hold the lock."""
+        if len(miner.keys) == 0:
+            return
+
+        self._add_to_bucket_totals(miner.keys, -miner.sizes * miner.credibility, -1)
+
+        # Reset buckets no longer served by any miner, so floating point drift does not accumulate.
+        positions = np.searchsorted(self.bucket_keys, miner.keys)
+        emptied = positions[self.bucket_counts[positions] == 0]
+        self.bucket_totals[emptied] = 0.0
+        self.empty_bucket_count += len(emptied)
+
+        if self.empty_bucket_count > len(self.bucket_keys) * self.COMPACTION_THRESHOLD:
+            served = self.bucket_counts > 0
+            self.bucket_keys = self.bucket_keys[served]
+            self.bucket_totals = self.bucket_totals[served]
+            self.bucket_counts = self.bucket_counts[served]
+            self.empty_bucket_count = 0
+
+    def _replace_miner_index(
+        self,
+        hotkey: str,
+        credibility: float,
+        sources: np.ndarray,
+        label_ids: np.ndarray,
+        time_bucket_ids: np.ndarray,
+        sizes: np.ndarray,
+    ):
+        """Replaces the index of the miner with the provided buckets."""
+        # Drop buckets whose ids cannot be packed, which a well formed index never contains.
+        valid = (
+            (sources >= 0)
+            & (sources <= MAX_SOURCE)
+            & (label_ids <= MAX_LABEL_ID)
+            & (time_bucket_ids >= 0)
+            & (time_bucket_ids <= MAX_TIME_BUCKET_ID)
+        )
+        keys = pack_bucket_keys(
+            sources[valid], label_ids[valid], time_bucket_ids[valid]
+        )
+
+        # Keep the first of any duplicate buckets, matching an INSERT OR IGNORE.
+        keys, first_indexes = np.unique(keys, return_index=True)
+        sizes = sizes[valid][first_indexes]
+
+        now = dt.datetime.utcnow()
+        with self.lock:
+            self._upsert_miner(hotkey, now, credibility)
+
+            miner = self.miners[hotkey]
+            self._remove_miner_buckets(miner)
+            self._insert_bucket_keys(keys)
+            self._add_to_bucket_totals(keys, sizes * credibility, 1)
+
+            self.miners[hotkey] = dataclasses.replace(miner, keys=keys, sizes=sizes)
+
+    def upsert_miner_index(self, index: MinerIndex, credibility: float = 0):
+        """Stores the index for all of the data that a specific miner promises to provide."""
+
+        bt.logging.trace(
+            f"{index.hotkey}: Upserting miner index with {len(index.data_entity_buckets)} buckets"
+        )
+
+        # Parse every DataEntityBucket from the index into columns.
+        sources = []
+        label_ids = []
+        time_bucket_ids = []
+        sizes = []
+        for data_entity_bucket in index.data_entity_buckets:
+            try:
+                label_id = self.label_dict.get_or_insert(
+                    self._label_value_parse(data_entity_bucket.id.label)
+                )
+            except:
+                # In the case that we fail to get a label (due to unsupported characters) we drop just that one bucket.
+                continue
+            sources.append(int(data_entity_bucket.id.source))
+            label_ids.append(label_id)
+            time_bucket_ids.append(data_entity_bucket.id.time_bucket.id)
+            sizes.append(data_entity_bucket.size_bytes)
+
+        self._replace_miner_index(
+            index.hotkey,
+            credibility,
+            np.array(sources, dtype=np.int64),
+            np.array(label_ids, dtype=np.int64),
+            np.array(time_bucket_ids, dtype=np.int64),
+            np.array(sizes, dtype=np.int64),
+        )
+
+    def upsert_compressed_miner_index(
+        self, index: CompressedMinerIndex, hotkey: str, credibility: float = 0
+    ):
+        """Stores the index for all of the data that a specific miner promises to provide."""
+
+        bt.logging.trace(
+            f"{hotkey}: Upserting miner index with {CompressedMinerIndex.bucket_count(index)} buckets"
+        )
+
+        # Parse every compressed bucket from the index into columns, one time bucket list at a time.
+        sources = []
+        label_ids = []
+        time_bucket_ids = []
+        sizes = []
+        for source, compressed_buckets in index.sources.items():
+            for compressed_bucket in compressed_buckets:
+                if len(compressed_bucket.time_bucket_ids) != len(
+                    compressed_bucket.sizes_bytes
+                ):
+                    continue
+                try:
+                    label_id = self.label_dict.get_or_insert(
+                        self._label_value_parse_str(compressed_bucket.label)
+                    )
+                except:
+                    # In the case that we fail to get a label (due to unsupported characters) we drop just that one bucket.
+                    continue
+
+                count = len(compressed_bucket.time_bucket_ids)
+                sources.append(np.full(count, int(source), dtype=np.int64))
+                label_ids.append(np.full(count, label_id, dtype=np.int64))
+                time_bucket_ids.append(
+                    np.array(compressed_bucket.time_bucket_ids, dtype=np.int64)
+                )
+                sizes.append(np.array(compressed_bucket.sizes_bytes, dtype=np.int64))
+
+        def concatenate(arrays: List[np.ndarray]) -> np.ndarray:
+            return np.concatenate(arrays) if arrays else np.empty(0, dtype=np.int64)
+
+        self._replace_miner_index(
+            hotkey,
+            credibility,
+            concatenate(sources),
+            concatenate(label_ids),
+            concatenate(time_bucket_ids),
+            concatenate(sizes),
+        )
+
+    def read_miner_index(self, miner_hotkey: str) -> Optional[ScorableMinerIndex]:
+        """Gets a scored index for all of the data that a specific miner promises to provide."""
+
+        with self.lock:
+            miner = self.miners.get(miner_hotkey, None)
+            if miner is None:
+                return None
+
+            totals = self.bucket_totals[np.searchsorted(self.bucket_keys, miner.keys)]
+
+        return self._to_scorable_index(
+            miner, _scorable_bytes(miner.sizes, miner.credibility, totals)
+        )
+
+    def read_scorable_buckets(self, miner_hotkey: str) -> Optional[ScorableBuckets]:
+        """Gets the scorable bytes of every bucket a specific miner serves as columns, to rescore the miner cheaply."""
+
+        with self.lock:
+            miner = self.miners.get(miner_hotkey, None)
+            if miner is None:
+                return None
+
+            totals = self.bucket_totals[np.searchsorted(self.bucket_keys, miner.keys)]
+
+        sources, label_ids, time_bucket_ids = unpack_bucket_keys(miner.keys)
+        labels = {}
+        for label_id in np.unique(label_ids).tolist():
+            label_value = self.label_dict.get_by_id(label_id)
+            labels[label_id] = label_value if label_value != "NULL" else None
+
+        return ScorableBuckets(
+            time_bucket_ids=time_bucket_ids,
+            sources=sources,
+            label_ids=label_ids,
+            scorable_bytes=_scorable_bytes(miner.sizes, miner.credibility, totals),
+            labels=labels,
+        )
+
+    def _to_scorable_index(
+        self, miner: _MinerState, scorable_bytes: np.ndarray
+    ) -> ScorableMinerIndex:
+        """Builds the ScorableMinerIndex of the miner from the scorable bytes of each of its buckets."""
+        sources, label_ids, time_bucket_ids = unpack_bucket_keys(miner.keys)
+        scored_data_entity_buckets = []
+        for source, label_id, time_bucket_id, size_bytes, scorable in zip(
+            sources.tolist(),
+            label_ids.tolist(),
+            time_bucket_ids.tolist(),
+            miner.sizes.tolist(),
+            scorable_bytes.tolist(),
+        ):
+            label_value = self.label_dict.get_by_id(label_id)
+            scored_data_entity_buckets.append(
+                ScorableDataEntityBucket(
+                    time_bucket_id=time_bucket_id,
+                    source=source,
+                    label=label_value if label_value != "NULL" else None,
+                    size_bytes=size_bytes,
+                    scorable_bytes=scorable,
+                )
+            )
+
+        return ScorableMinerIndex(
+            scorable_data_entity_buckets=scored_data_entity_buckets,
+            last_updated=miner.last_updated,
+        )
+
+    def delete_miner(self, hotkey: str):
+        """Removes the index and miner details for the specified miner."""
+        with self.lock:
+            miner = self.miners.pop(hotkey, None)
+            if miner is not None:
+                self._remove_miner_buckets(miner)
+
+    def save_snapshot(self, path: str):
+        """Writes every miner and its index to the file at path, replacing any existing snapshot.
+
+        The lock is only held while the state is copied, not while it is written to disk.
+        """
+        with self.lock:
+            miners = list(self.miners.items())
+            bucket_keys = self.bucket_keys.copy()
+            bucket_totals = self.bucket_totals.copy()
+            bucket_counts = self.bucket_counts.copy()
+            empty_bucket_count = self.empty_bucket_count
+            next_miner_id = self.next_miner_id
+            labels = self.label_dict.to_items()
+
+        # Write to a temporary file first, so a partially written snapshot never replaces a complete one.
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as file:
+            np.savez(
+                file,
+                hotkeys=np.array([hotkey for hotkey, _ in miners], dtype=str),
+                miner_ids=np.array(
+                    [miner.miner_id for _, miner in miners], dtype=np.int64
+                ),
+                last_updated=np.array(
+                    [miner.last_updated for _, miner in miners], dtype="datetime64[us]"
+                ),
+                credibilities=np.array(
+                    [miner.credibility for _, miner in miners], dtype=np.float64
+                ),
+                lengths=np.array(
+                    [len(miner.keys) for _, miner in miners], dtype=np.int64
+                ),
+                keys=np.concatenate(
+                    [np.empty(0, dtype=np.int64)] + [miner.keys for _, miner in miners]
+                ),
+                sizes=np.concatenate(
+                    [np.empty(0, dtype=np.int64)] + [miner.sizes for _, miner in miners]
+                ),
+                bucket_keys=bucket_keys,
+                bucket_totals=bucket_totals,
+                bucket_counts=bucket_counts,
+                empty_bucket_count=np.array(empty_bucket_count),
+                next_miner_id=np.array(next_miner_id),
+                label_ids=np.array(list(labels.keys()), dtype=np.int64),
+                label_values=np.array(list(labels.values()), dtype=str),
+            )
+        os.replace(temp_path, path)
+
+    def load_snapshot(self, path: str):
+        """Replaces the contents of the storage with the snapshot at path."""
+        with np.load(path) as snapshot:
+            offsets = np.cumsum(snapshot["lengths"])[:-1]
+            miners = {
+                hotkey: _MinerState(
+                    miner_id=miner_id,
+                    last_updated=last_updated,
+                    credibility=credibility,
+                    keys=keys,
+                    sizes=sizes,
+                )
+                for hotkey, miner_id, last_updated, credibility, keys, sizes in zip(
+                    snapshot["hotkeys"].tolist(),
+                    snapshot["miner_ids"].tolist(),
+                    snapshot["last_updated"].astype(dt.datetime).tolist(),
+                    snapshot["credibilities"].tolist(),
+                    np.split(snapshot["keys"], offsets),
+                    np.split(snapshot["sizes"], offsets),
+                )
+            }
+            label_dict = AutoIncrementDict.from_items(
+                dict(
+                    zip(
+                        snapshot["label_ids"].tolist(),
+                        snapshot["label_values"].tolist(),
+                    )
+                )
+            )
+
+            with self.lock:
+                self.miners = miners
+                self.label_dict = label_dict
+                self.bucket_keys = snapshot["bucket_keys"]
+                self.bucket_totals = snapshot["bucket_totals"]
+                self.bucket_counts = snapshot["bucket_counts"]
+                self.empty_bucket_count = int(snapshot["empty_bucket_count"])
+                self.next_miner_id = int(snapshot["next_miner_id"])
+
+    def read_miner_last_updated(self, miner_hotkey: str) -> Optional[dt.datetime]:
+        """Gets when a specific miner was last updated."""
+        with self.lock:
+            miner = self.miners.get(miner_hotkey, None)
+            return miner.last_updated if miner is not None else None
@@ -1,11 +1,17 @@
 import contextlib
 import datetime as dt
+import os
 import bittensor as bt
 import sqlite3
 import threading
-from typing import Any, Dict, Optional, Set, Tuple
+from typing import Any, Dict, List, Optional, Set, Tuple
+import numpy as np
 from common.data import CompressedMinerIndex, DataLabel, MinerIndex
-from common.data_v2 import ScorableDataEntityBucket, ScorableMinerIndex
+from common.data_v2 import (
+    ScorableBuckets,
+    ScorableDataEntityBucket,
+    ScorableMinerIndex,
+)
 from storage.validator.validator_storage import ValidatorStorage
 
 
@@ -44,6 +50,29 @@ class AutoIncrementDict:
             del self.indexes[key]
             self.available_ids.add(key_id)
 
+    def to_items(self) -> Dict[int, Any]:
+        """Returns the key of each id in use."""
+        return {
+            key_id: key
+            for key_id, key in enumerate(list(self.items))
+            if key is not None
+        }
+
+    @classmethod
+    def from_items(cls, items: Dict[int, Any]) -> "AutoIncrementDict":
+        """Creates an AutoIncrementDict with the provided key for each id, as returned by to_items."""
+        auto_increment_dict = cls()
+        auto_increment_dict.items = [None] * (max(items, default=-1) + 1)
+        for key_id, key in items.items():
+            auto_increment_dict.items[key_id] = key
+            auto_increment_dict.indexes[key] = key_id
+        auto_increment_dict.available_ids = {
+            key_id
+            for key_id, key in enumerate(auto_increment_dict.items)
+            if key is None
+        }
+        return auto_increment_dict
+
 
 # Use a timezone aware adapter for timestamp columns.
 def tz_aware_timestamp_adapter(val):
@@ -105,8 +134,77 @@ class SqliteMemoryValidatorStorage(ValidatorStorage):
                                     PRIMARY KEY(minerId, source, labelId, timeBucketId)
                                     ) WITHOUT ROWID"""
 
-    MINER_INDEX_TABLE_BUCKET_SIZE_INDEX = """CREATE INDEX IF NOT EXISTS bucket_size_index
-                                             ON MinerIndex (source, labelId, timeBucketId, contentSizeBytes)"""
+    # The credibility weighted total content size of each bucket across all miners, kept up to date by the triggers
+    # below, so reading a miner's index only needs that miner's rows. Buckets no miner serves are removed.
+    BUCKET_TOTAL_TABLE_CREATE = """CREATE TABLE IF NOT EXISTS BucketTotal (
+                                    source                      TINYINT         NOT NULL,
+                                    labelId                     INTEGER         NOT NULL,
+                                    timeBucketId                INTEGER         NOT NULL,
+                                    totalAdjContentSizeBytes    FLOAT           NOT NULL,
+                                    minerCount                  INTEGER         NOT NULL,
+                                    PRIMARY KEY(source, labelId, timeBucketId)
+                                    ) WITHOUT ROWID"""
+
+    BUCKET_TOTAL_INSERT_TRIGGER = """CREATE TRIGGER IF NOT EXISTS bucket_total_insert AFTER INSERT ON MinerIndex
+                                    BEGIN
+                                        INSERT INTO BucketTotal VALUES (
+                                            NEW.source, NEW.labelId, NEW.timeBucketId,
+                                            NEW.contentSizeBytes * (SELECT credibility FROM Miner WHERE minerId = NEW.minerId),
+                                            1
+                                        )
+                                        ON CONFLICT (source, labelId, timeBucketId) DO UPDATE
+                                        SET totalAdjContentSizeBytes = totalAdjContentSizeBytes + excluded.totalAdjContentSizeBytes,
+                                            minerCount = minerCount + 1;
+                                    END"""
+
+    BUCKET_TOTAL_DELETE_TRIGGER = """CREATE TRIGGER IF NOT EXISTS bucket_total_delete AFTER DELETE ON MinerIndex
+                                    BEGIN
+                                        UPDATE BucketTotal
+                                        SET totalAdjContentSizeBytes = totalAdjContentSizeBytes
+                                                - OLD.contentSizeBytes * (SELECT credibility FROM Miner WHERE minerId = OLD.minerId),
+                                            minerCount = minerCount - 1
+                                        WHERE source = OLD.source AND labelId = OLD.labelId AND timeBucketId = OLD.timeBucketId;
+                                        DELETE FROM BucketTotal
+                                        WHERE source = OLD.source AND labelId = OLD.labelId AND timeBucketId = OLD.timeBucketId
+                                            AND minerCount = 0;
+                                    END"""
+
+    BUCKET_TOTAL_UPDATE_TRIGGER = """CREATE TRIGGER IF NOT EXISTS bucket_total_update
+                                    AFTER UPDATE OF contentSizeBytes ON MinerIndex
+                                    BEGIN
+                                        UPDATE BucketTotal
+                                        SET totalAdjContentSizeBytes = totalAdjContentSizeBytes
+                                            + (NEW.contentSizeBytes - OLD.contentSizeBytes)
+                                                * (SELECT credibility FROM Miner WHERE minerId = NEW.minerId)
+                                        WHERE source = NEW.source AND labelId = NEW.labelId AND timeBucketId = NEW.timeBucketId;
+                                    END"""
+
+    BUCKET_TOTAL_CREDIBILITY_TRIGGER = """CREATE TRIGGER IF NOT EXISTS bucket_total_credibility
+                                        AFTER UPDATE OF credibility ON Miner
+                                        WHEN NEW.credibility != OLD.credibility
+                                        BEGIN
+                                            INSERT INTO BucketTotal
+                                            SELECT source, labelId, timeBucketId,
+                                                contentSizeBytes * (NEW.credibility - OLD.credibility), 0
+                                            FROM MinerIndex WHERE minerId = NEW.minerId
+                                            ON CONFLICT (source, labelId, timeBucketId) DO UPDATE
+                                            SET totalAdjContentSizeBytes = totalAdjContentSizeBytes + excluded.totalAdjContentSizeBytes;
+                                        END"""
+
+    # A miner's new index is staged in this connection private table, then diffed against its stored index.
+    STAGED_MINER_INDEX_TABLE_CREATE = """CREATE TEMP TABLE IF NOT EXISTS StagedMinerIndex (
+                                        source              TINYINT         NOT NULL,
+                                        labelId             INTEGER         NOT NULL,
+                                        timeBucketId        INTEGER         NOT NULL,
+                                        contentSizeBytes    INTEGER         NOT NULL,
+                                        PRIMARY KEY(source, labelId, timeBucketId)
+                                        ) WITHOUT ROWID"""
+
+    # Snapshots store the label of each labelId alongside the copied tables.
+    SNAPSHOT_LABEL_TABLE_CREATE = """CREATE TABLE SnapshotLabel (
+                                    labelId     INTEGER     PRIMARY KEY,
+                                    value       TEXT        NOT NULL
+                                    )"""
 
     def __init__(self):
         sqlite3.register_converter("timestamp", tz_aware_timestamp_adapter)
@@ -123,8 +221,14 @@ class SqliteMemoryValidatorStorage(ValidatorStorage):
 
             # Create the Index table (if it does not already exist).
             cursor.execute(SqliteMemoryValidatorStorage.MINER_INDEX_TABLE_CREATE)
+
+            # Create the BucketTotal table and the triggers that maintain it (if they do not already exist).
+            cursor.execute(SqliteMemoryValidatorStorage.BUCKET_TOTAL_TABLE_CREATE)
+            cursor.execute(SqliteMemoryValidatorStorage.BUCKET_TOTAL_INSERT_TRIGGER)
+            cursor.execute(SqliteMemoryValidatorStorage.BUCKET_TOTAL_DELETE_TRIGGER)
+            cursor.execute(SqliteMemoryValidatorStorage.BUCKET_TOTAL_UPDATE_TRIGGER)
             cursor.execute(
-                SqliteMemoryValidatorStorage.MINER_INDEX_TABLE_BUCKET_SIZE_INDEX
+                SqliteMemoryValidatorStorage.BUCKET_TOTAL_CREDIBILITY_TRIGGER
             )
 
             # Lock to avoid concurrency issues on interacting with the database.
@@ -174,6 +278,63 @@ class SqliteMemoryValidatorStorage(ValidatorStorage):
         """Same as _label_value_parse but with a string as input"""
         return "NULL" if (label is None) else label.casefold()
 
+    def _replace_miner_index(
+        self, hotkey: str, credibility: float, values: List[List[int]]
+    ):
+        """Replaces the stored index of the miner with the provided (source, labelId, timeBucketId, contentSizeBytes) rows.
+
+        Most of a miner's index is unchanged between evaluations, so only the buckets that were added, removed or
+        resized are written. The new rows are staged in a connection private table without holding the lock.
+        """
+        now_str = dt.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")
+
+        with contextlib.closing(self._create_connection()) as connection:
+            cursor = connection.cursor()
+            cursor.execute(SqliteMemoryValidatorStorage.STAGED_MINER_INDEX_TABLE_CREATE)
+            # Insert the new keys. (Ignore into to defend against a miner giving us multiple duplicate rows.)
+            # Batch in groups of 1m if necessary to avoid congestion issues.
+            value_subsets = [
+                values[x : x + 1_000_000] for x in range(0, len(values), 1_000_000)
+            ]
+            for value_subset in value_subsets:
+                cursor.executemany(
+                    """INSERT OR IGNORE INTO StagedMinerIndex (source, labelId, timeBucketId, contentSizeBytes) VALUES (?, ?, ?, ?)""",
+                    value_subset,
+                )
+            connection.commit()
+
+            with self.upsert_miner_index_lock:
+                # Upsert this Validator's minerId for the specified hotkey.
+                miner_id = self._upsert_miner(hotkey, now_str, credibility)
+
+                # Remove the buckets the miner no longer serves.
+                cursor.execute(
+                    """DELETE FROM MinerIndex WHERE minerId = ? AND NOT EXISTS (
+                            SELECT 1 FROM StagedMinerIndex AS staged
+                            WHERE staged.source = MinerIndex.source
+                                AND staged.labelId = MinerIndex.labelId
+                                AND staged.timeBucketId = MinerIndex.timeBucketId
+                        )""",
+                    [miner_id],
+                )
+                removed = cursor.rowcount
+
+                # Add the new buckets and resize the changed ones, leaving unchanged buckets untouched.
+                cursor.execute(
+                    """INSERT INTO MinerIndex (minerId, source, labelId, timeBucketId, contentSizeBytes)
+                        SELECT ?, source, labelId, timeBucketId, contentSizeBytes FROM StagedMinerIndex WHERE true
+                        ON CONFLICT (minerId, source, labelId, timeBucketId) DO UPDATE
+                        SET contentSizeBytes = excluded.contentSizeBytes
+                        WHERE contentSizeBytes != excluded.contentSizeBytes""",
+                    [miner_id],
+                )
+                added_or_resized = cursor.rowcount
+                connection.commit()
+
+        bt.logging.trace(
+            f"{hotkey}: Removed {removed} and added or resized {added_or_resized} buckets"
+        )
+
     def upsert_miner_index(self, index: MinerIndex, credibility: float):
         """Stores the index for all of the data that a specific miner promises to provide."""
 
@@ -181,19 +342,12 @@ class SqliteMemoryValidatorStorage(ValidatorStorage):
             f"{index.hotkey}: Upserting miner index with {len(index.data_entity_buckets)} buckets"
         )
 
-        now_str = dt.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")
-
-        # Upsert this Validator's minerId for the specified hotkey.
-        with self.upsert_miner_index_lock:
-            miner_id = self._upsert_miner(index.hotkey, now_str, credibility)
-
         # Parse every DataEntityBucket from the index into a list of values to insert.
         values = []
         for data_entity_bucket in index.data_entity_buckets:
             try:
                 values.append(
                     [
-                        miner_id,
                         int(data_entity_bucket.id.source),
                         self.label_dict.get_or_insert(
                             self._label_value_parse(data_entity_bucket.id.label)
@@ -206,23 +360,7 @@ class SqliteMemoryValidatorStorage(ValidatorStorage):
                 # In the case that we fail to get a label (due to unsupported characters) we drop just that one bucket.
                 pass
 
-        with self.upsert_miner_index_lock:
-            # Clear the previous keys for this miner.
-            self._delete_miner_index(index.hotkey)
-
-            with contextlib.closing(self._create_connection()) as connection:
-                cursor = connection.cursor()
-                # Insert the new keys. (Ignore into to defend against a miner giving us multiple duplicate rows.)
-                # Batch in groups of 1m if necessary to avoid congestion issues.
-                value_subsets = [
-                    values[x : x + 1000000] for x in range(0, len(values), 1000000)
-                ]
-                for value_subset in value_subsets:
-                    cursor.executemany(
-                        """INSERT OR IGNORE INTO MinerIndex (minerId, source, labelId, timeBucketId, contentSizeBytes) VALUES (?, ?, ?, ?, ?)""",
-                        value_subset,
-                    )
-                connection.commit()
+        self._replace_miner_index(index.hotkey, credibility, values)
 
     def upsert_compressed_miner_index(
         self, index: CompressedMinerIndex, hotkey: str, credibility: float
@@ -233,11 +371,6 @@ class SqliteMemoryValidatorStorage(ValidatorStorage):
             f"{hotkey}: Upserting miner index with {CompressedMinerIndex.bucket_count(index)} buckets"
         )
 
-        now_str = dt.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")
-
-        # Upsert this Validator's minerId for the specified hotkey.
-        miner_id = self._upsert_miner(hotkey, now_str, credibility)
-
         # Parse every DataEntityBucket from the index into a list of values to insert.
         values = []
         for source, compressed_buckets in index.sources.items():
@@ -248,7 +381,6 @@ class SqliteMemoryValidatorStorage(ValidatorStorage):
                     try:
                         values.append(
                             [
-                                miner_id,
                                 int(source),
                                 self.label_dict.get_or_insert(
                                     self._label_value_parse_str(compressed_bucket.label)
@@ -261,23 +393,7 @@ class SqliteMemoryValidatorStorage(ValidatorStorage):
                         # In the case that we fail to get a label (due to unsupported characters) we drop just that one bucket.
                         pass
 
-        with self.upsert_miner_index_lock:
-            # Clear the previous keys for this miner.
-            self._delete_miner_index(hotkey)
-
-            with contextlib.closing(self._create_connection()) as connection:
-                cursor = connection.cursor()
-                # Insert the new keys. (Ignore into to defend against a miner giving us multiple duplicate rows.)
-                # Batch in groups of 1m if necessary to avoid congestion issues.
-                value_subsets = [
-                    values[x : x + 1_000_000] for x in range(0, len(values), 1_000_000)
-                ]
-                for value_subset in value_subsets:
-                    cursor.executemany(
-                        """INSERT OR IGNORE INTO MinerIndex (minerId, source, labelId, timeBucketId, contentSizeBytes) VALUES (?, ?, ?, ?, ?)""",
-                        value_subset,
-                    )
-                connection.commit()
+        self._replace_miner_index(hotkey, credibility, values)
 
     def read_miner_index(
         self,
@@ -300,27 +416,15 @@ class SqliteMemoryValidatorStorage(ValidatorStorage):
             miner_credibility = result[2]
 
             # Get all the DataEntityBuckets for this miner joined to the total content size of like buckets.
-            sql_string = """WITH
-                            TempBuckets AS (
-                                SELECT source, labelId, timeBucketId
-                                FROM MinerIndex
-                                WHERE MinerId = ?
-                            ),
-                            TempAgg AS (
-                                SELECT source, labelId, timeBucketId,
-                                SUM(contentSizeBytes * credibility) as totalAdjContentSizeBytes
-                                FROM MinerIndex
-                                INNER JOIN TempBuckets USING (source, labelId, timeBucketId)
-                                JOIN Miner USING (minerId)
-                                GROUP BY source, labelId, timeBucketId
-                            )
-                            SELECT source, labelId, timeBucketId, contentSizeBytes,
-                                (contentSizeBytes * (contentSizeBytes * ?) / TempAgg.totalAdjContentSizeBytes) as scorableBytes
+            # Totals are maintained incrementally, so scorable bytes are capped at the bucket size in case of any
+            # floating point drift.
+            sql_string = """SELECT source, labelId, timeBucketId, contentSizeBytes,
+                                MIN(contentSizeBytes, contentSizeBytes * (contentSizeBytes * ?) / totalAdjContentSizeBytes) as scorableBytes
                             FROM MinerIndex
-                            LEFT JOIN TempAgg USING (source, labelId, timeBucketId)
+                            LEFT JOIN BucketTotal USING (source, labelId, timeBucketId)
                             WHERE minerId = ?"""
 
-            cursor.execute(sql_string, [miner_id, miner_credibility, miner_id])
+            cursor.execute(sql_string, [miner_credibility, miner_id])
 
             # Create to a list to hold each of the ScorableDataEntityBuckets we generate for this miner.
             scored_data_entity_buckets = []
@@ -347,6 +451,44 @@ class SqliteMemoryValidatorStorage(ValidatorStorage):
 
             return scored_index
 
+    def read_scorable_buckets(self, miner_hotkey: str) -> Optional[ScorableBuckets]:
+        """Gets the scorable bytes of every bucket a specific miner serves as columns, to rescore the miner cheaply."""
+
+        with contextlib.closing(self._create_connection()) as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                "SELECT minerId, credibility from Miner WHERE hotkey = ?",
+                [miner_hotkey],
+            )
+            result = cursor.fetchone()
+            if result is None:
+                return None
+
+            # Score the miner's buckets as read_miner_index does, without building a ScorableDataEntityBucket per row.
+            cursor.execute(
+                """SELECT timeBucketId, source, labelId,
+                        COALESCE(MIN(contentSizeBytes, contentSizeBytes * (contentSizeBytes * ?) / totalAdjContentSizeBytes), 0)
+                    FROM MinerIndex
+                    LEFT JOIN BucketTotal USING (source, labelId, timeBucketId)
+                    WHERE minerId = ?""",
+                [result[1], result[0]],
+            )
+            columns = np.array(cursor.fetchall(), dtype=np.float64).reshape(-1, 4)
+
+        label_ids = columns[:, 2].astype(np.int64)
+        labels = {}
+        for label_id in np.unique(label_ids).tolist():
+            label_value = self.label_dict.get_by_id(label_id)
+            labels[label_id] = label_value if label_value != "NULL" else None
+
+        return ScorableBuckets(
+            time_bucket_ids=columns[:, 0].astype(np.int64),
+            sources=columns[:, 1].astype(np.int64),
+            label_ids=label_ids,
+            scorable_bytes=columns[:, 3].astype(np.int64),
+            labels=labels,
+        )
+
     def _delete_miner_index(self, miner_hotkey: str):
         """Removes the index for the specified miner."""
 
@@ -372,6 +514,44 @@ class SqliteMemoryValidatorStorage(ValidatorStorage):
                 cursor = connection.cursor()
                 cursor.execute("DELETE FROM Miner WHERE hotkey = ?", [hotkey])
 
+    def save_snapshot(self, path: str):
+        """Writes every miner and its index to the file at path, replacing any existing snapshot.
+
+        The lock is only held while the in-memory database is copied, not while the copy is written to disk.
+        """
+        with contextlib.closing(sqlite3.connect(":memory:")) as snapshot:
+            with contextlib.closing(self._create_connection()) as connection:
+                with self.upsert_miner_index_lock:
+                    connection.backup(snapshot)
+                    # Every label referenced by the copied rows was inserted before the rows were written.
+                    labels = self.label_dict.to_items()
+
+            snapshot.execute(SqliteMemoryValidatorStorage.SNAPSHOT_LABEL_TABLE_CREATE)
+            snapshot.executemany(
+                "INSERT INTO SnapshotLabel (labelId, value) VALUES (?, ?)",
+                labels.items(),
+            )
+            snapshot.commit()
+
+            # Write to a temporary file first, so a partially written snapshot never replaces a complete one.
+            temp_path = path + ".tmp"
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            with contextlib.closing(sqlite3.connect(temp_path)) as file:
+                snapshot.backup(file)
+            os.replace(temp_path, path)
+
+    def load_snapshot(self, path: str):
+        """Replaces the contents of the storage with the snapshot at path."""
+        with contextlib.closing(sqlite3.connect(path)) as file:
+            labels = dict(file.execute("SELECT labelId, value FROM SnapshotLabel"))
+
+            with contextlib.closing(self._create_connection()) as connection:
+                with self.upsert_miner_index_lock:
+                    file.backup(connection)
+                    connection.execute("DROP TABLE SnapshotLabel")
+                    self.label_dict = AutoIncrementDict.from_items(labels)
+
     def read_miner_last_updated(self, miner_hotkey: str) -> Optional[dt.datetime]:
         """Gets when a specific miner was last updated."""
 
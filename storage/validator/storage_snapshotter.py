@@ -0,0 +1,118 @@
+import dataclasses
+import datetime as dt
+import os
+import threading
+import traceback
+from typing import Optional
+import bittensor as bt
+from storage.validator.validator_storage import ValidatorStorage
+
+
+@dataclasses.dataclass(frozen=True)
+class SnapshotMetrics:
+    """A snapshot of the StorageSnapshotter's state."""
+
+    # The number of snapshots written so far.
+    snapshots: int
+
+    # The size of the most recent snapshot on disk.
+    last_snapshot_bytes: int
+
+    # How long the most recent snapshot took.
+    last_snapshot_latency: Optional[dt.timedelta]
+
+
+class StorageSnapshotter:
+    """Periodically snapshots the ValidatorStorage to a file on a background thread.
+
+    Miner indexes take hours to re-poll from every miner, so the validator loads the latest snapshot on startup instead
+    of starting from an empty storage.
+    """
+
+    def __init__(
+        self, storage: ValidatorStorage, path: str, snapshot_interval: dt.timedelta
+    ):
+        self.storage = storage
+        self.path = path
+        self.snapshot_interval = snapshot_interval
+
+        self.lock = threading.Lock()
+        self.snapshots = 0
+        self.last_snapshot_bytes = 0
+        self.last_snapshot_latency: Optional[dt.timedelta] = None
+
+        self.stop_event = threading.Event()
+        self.is_running = False
+        self.thread: threading.Thread = None
+
+    def load(self) -> bool:
+        """Loads the snapshot into the storage if one exists, returning whether it was loaded."""
+        if not os.path.exists(self.path):
+            bt.logging.info(f"No validator storage snapshot found at {self.path}.")
+            return False
+
+        start = dt.datetime.now()
+        try:
+            self.storage.load_snapshot(self.path)
+        except Exception:
+            bt.logging.warning(
+                f"Failed to load the validator storage snapshot at {self.path}. Starting from scratch: {traceback.format_exc()}"
+            )
+            return False
+
+        bt.logging.success(
+            f"Loaded validator storage snapshot from {self.path} in {dt.datetime.now() - start}."
+        )
+        return True
+
+    def snapshot(self):
+        """Writes a snapshot of the storage to the file."""
+        start = dt.datetime.now()
+        self.storage.save_snapshot(self.path)
+        latency = dt.datetime.now() - start
+
+        snapshot_bytes = os.path.getsize(self.path)
+        with self.lock:
+            self.snapshots += 1
+            self.last_snapshot_bytes = snapshot_bytes
+            self.last_snapshot_latency = latency
+
+        bt.logging.info(
+            f"Wrote a {snapshot_bytes} byte validator storage snapshot to {self.path} in {latency}."
+        )
+
+    def get_metrics(self) -> SnapshotMetrics:
+        """Returns a snapshot of the snapshotter's state."""
+        with self.lock:
+            return SnapshotMetrics(
+                snapshots=self.snapshots,
+                last_snapshot_bytes=self.last_snapshot_bytes,
+                last_snapshot_latency=self.last_snapshot_latency,
+            )
+
+    def run_in_background_thread(self):
+        """Snapshots the storage on a background thread until stopped."""
+        assert not self.is_running, "StorageSnapshotter already running"
+
+        bt.logging.info("Starting StorageSnapshotter in a background thread.")
+
+        self.is_running = True
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        """Blocking call to snapshot the storage every snapshot_interval until stopped."""
+        # The storage was just loaded or is empty, so wait a full interval before the first snapshot.
+        while not self.stop_event.wait(timeout=self.snapshot_interval.total_seconds()):
+            try:
+                self.snapshot()
+            except Exception:
+                bt.logging.error(
+                    f"Failed to snapshot the validator storage: {traceback.format_exc()}"
+                )
+
+    def stop(self):
+        bt.logging.info("Stopping the StorageSnapshotter.")
+        self.is_running = False
+        self.stop_event.set()
@@ -3,7 +3,7 @@ from common.data import CompressedMinerIndex, MinerIndex
 from typing import Optional, Set
 import datetime as dt
 
-from common.data_v2 import ScorableMinerIndex
+from common.data_v2 import ScorableBuckets, ScorableMinerIndex
 
 
 class ValidatorStorage(ABC):
@@ -26,11 +26,26 @@ class ValidatorStorage(ABC):
         """Gets a scored index for all of the data that a specific miner promises to provide."""
         raise NotImplemented
 
+    @abstractmethod
+    def read_scorable_buckets(self, miner_hotkey: str) -> Optional[ScorableBuckets]:
+        """Gets the scorable bytes of every bucket a specific miner serves as columns, to rescore the miner cheaply."""
+        raise NotImplemented
+
     @abstractmethod
     def delete_miner(self, miner_hotkey: str):
         """Removes the index and miner information for the specified miner."""
         raise NotImplemented
 
+    @abstractmethod
+    def save_snapshot(self, path: str):
+        """Writes every miner and its index to the file at path, replacing any existing snapshot."""
+        raise NotImplemented
+
+    @abstractmethod
+    def load_snapshot(self, path: str):
+        """Replaces the contents of the storage with the snapshot at path."""
+        raise NotImplemented
+
     @abstractmethod
     def read_miner_last_updated(self, miner_hotkey: str) -> Optional[dt.datetime]:
         """Gets when a specific miner was last updated."""
@@ -243,6 +243,42 @@ class TestGetDataEntityBucket(unittest.TestCase):
 
         # TODO: Add a test for the response.
 
+    def test_json_with_serialized_data_entities(self):
+        """Tests that a response with pre-serialized DataEntities deserializes like a regular response."""
+        response = GetDataEntityBucket(
+            data_entity_bucket_id=DataEntityBucketId(
+                time_bucket=TimeBucket.from_datetime(dt.datetime.utcnow()),
+                label=DataLabel(value="r/bittensor_"),
+                source=DataSource.REDDIT,
+            ),
+            version=3,
+        )
+        data_entities = [
+            DataEntity(
+                uri="http://1.com",
+                datetime=dt.datetime.now(tz=dt.timezone.utc),
+                source=DataSource.REDDIT,
+                label=DataLabel(value="r/bittensor_"),
+                content=b"content_1",
+                content_size_bytes=9,
+            ),
+            DataEntity(
+                uri="http://2.com",
+                datetime=dt.datetime.now(tz=dt.timezone.utc),
+                source=DataSource.REDDIT,
+                content=b"content_2",
+                content_size_bytes=9,
+            ),
+        ]
+
+        json = response.json_with_serialized_data_entities(
+            "[" + ",".join(data_entity.json() for data_entity in data_entities) + "]"
+        )
+
+        deserialized = GetDataEntityBucket.parse_raw(json)
+        response.data_entities = data_entities
+        self.assertEqual(response, deserialized)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -3,7 +3,7 @@ from unittest.mock import Mock, patch
 
 from attr import dataclass
 from common import constants, utils
-from common.data_v2 import ScorableDataEntityBucket
+from common.data_v2 import ScorableBuckets, ScorableDataEntityBucket
 from rewards.data import DataSourceDesirability, DataDesirabilityLookup
 from rewards.data_value_calculator import DataValueCalculator
 from common.data import (
@@ -155,6 +155,49 @@ class TestDataValueCalculator(unittest.TestCase):
             self.assertLess(score, previous_score)
             previous_score = score
 
+    def test_get_score_for_scorable_buckets(self):
+        """Tests that scoring bucket columns matches summing the score of each bucket."""
+        now = dt.datetime(2023, 12, 12, 12, 30, 0, tzinfo=dt.timezone.utc)
+        rewards.data_value_calculator.dt.datetime.now.return_value = now
+
+        time_bucket_id = utils.time_bucket_id_from_datetime(now)
+        max_age_in_hours = constants.DATA_ENTITY_BUCKET_AGE_LIMIT_DAYS * 24
+        buckets = [
+            ScorableDataEntityBucket(
+                time_bucket_id=time_bucket_id - age_in_hours,
+                source=source,
+                label=label,
+                size_bytes=200,
+                scorable_bytes=scorable_bytes,
+            )
+            for age_in_hours in [-2, 0, 5, max_age_in_hours, max_age_in_hours + 1]
+            for source, label in [
+                (DataSource.REDDIT, "TestLABEL"),
+                (DataSource.REDDIT, "penalizedlabel"),
+                (DataSource.REDDIT, None),
+                (DataSource.X, "#testlabel"),
+                (DataSource.X, "#other-label"),
+            ]
+            for scorable_bytes in [0, 37, 100]
+        ]
+
+        self.assertAlmostEqual(
+            self.value_calculator.get_score_for_scorable_buckets(
+                ScorableBuckets.from_scorable_data_entity_buckets(buckets)
+            ),
+            sum(
+                self.value_calculator.get_score_for_data_entity_bucket(bucket)
+                for bucket in buckets
+            ),
+            places=5,
+        )
+        self.assertEqual(
+            self.value_calculator.get_score_for_scorable_buckets(
+                ScorableBuckets.from_scorable_data_entity_buckets([])
+            ),
+            0.0,
+        )
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -3,7 +3,11 @@ import unittest
 from unittest.mock import MagicMock, Mock, patch
 from typing import List
 import torch
-from common.data_v2 import ScorableDataEntityBucket, ScorableMinerIndex
+from common.data_v2 import (
+    ScorableBuckets,
+    ScorableDataEntityBucket,
+    ScorableMinerIndex,
+)
 from rewards.data import DataSourceDesirability, DataDesirabilityLookup
 from scraping.scraper import ValidationResult
 from common import constants
@@ -337,6 +341,88 @@ class TestMinerScorer(unittest.TestCase):
                     scores[shady_miner].item(),
                 )
 
+    def test_on_miner_index_refreshed(self):
+        """Tests that refreshing a miner's buckets rescores its latest evaluation against them."""
+        # Create an index where the miner's data has since become less unique.
+        refreshed_index = ScorableMinerIndex(
+            scorable_data_entity_buckets=[
+                ScorableDataEntityBucket(
+                    time_bucket_id=bucket.time_bucket_id,
+                    source=bucket.source,
+                    label=bucket.label,
+                    size_bytes=bucket.size_bytes,
+                    scorable_bytes=bucket.scorable_bytes // 2,
+                )
+                for bucket in self.scorable_index.scorable_data_entity_buckets
+            ],
+            last_updated=self.now,
+        )
+        refreshed_miner = 0
+        unchanged_miner = 1
+        no_index_miner = 2
+        for _ in range(5):
+            for uid in [refreshed_miner, unchanged_miner, no_index_miner]:
+                self._add_score_to_uid(uid)
+        self.scorer.on_miner_evaluated(
+            no_index_miner,
+            None,
+            [ValidationResult(is_valid=False, content_size_bytes_validated=0)],
+        )
+
+        # Score the same evaluations against the refreshed index directly, for comparison.
+        expected_scorer = MinerScorer(
+            self.num_neurons, self.value_calculator, alpha=0.2
+        )
+        for _ in range(4):
+            expected_scorer.on_miner_evaluated(
+                refreshed_miner,
+                self.scorable_index,
+                [ValidationResult(is_valid=True, content_size_bytes_validated=100)],
+            )
+        expected_scorer.on_miner_evaluated(
+            refreshed_miner,
+            refreshed_index,
+            [ValidationResult(is_valid=True, content_size_bytes_validated=100)],
+        )
+
+        def to_buckets(index: ScorableMinerIndex) -> ScorableBuckets:
+            return ScorableBuckets.from_scorable_data_entity_buckets(
+                index.scorable_data_entity_buckets
+            )
+
+        scores = self.scorer.get_scores()
+        self.scorer.on_miner_index_refreshed(
+            refreshed_miner, to_buckets(refreshed_index)
+        )
+        self.scorer.on_miner_index_refreshed(
+            unchanged_miner, to_buckets(self.scorable_index)
+        )
+        self.scorer.on_miner_index_refreshed(
+            no_index_miner, to_buckets(refreshed_index)
+        )
+        refreshed_scores = self.scorer.get_scores()
+
+        self.assertAlmostEqual(
+            refreshed_scores[refreshed_miner].item(),
+            expected_scorer.get_scores()[refreshed_miner].item(),
+            places=3,
+        )
+        self.assertLess(refreshed_scores[refreshed_miner], scores[refreshed_miner])
+        self.assertAlmostEqual(
+            refreshed_scores[unchanged_miner].item(),
+            scores[unchanged_miner].item(),
+            places=3,
+        )
+        self.assertEqual(refreshed_scores[no_index_miner], scores[no_index_miner])
+
+        # Refreshing again rescores the same evaluation, rather than applying another one.
+        self.scorer.on_miner_index_refreshed(
+            refreshed_miner, to_buckets(refreshed_index)
+        )
+        self.assertEqual(
+            self.scorer.get_scores()[refreshed_miner], refreshed_scores[refreshed_miner]
+        )
+
     def test_update_score_respects_growth_limit_threshhold(self):
         """Verifies that a score can only increase up to the threshold in one cycle."""
         uid = 0
@@ -0,0 +1,144 @@
+import datetime as dt
+import os
+import unittest
+from unittest.mock import Mock
+
+from common.data import (
+    DataEntity,
+    DataEntityBucketId,
+    DataLabel,
+    DataSource,
+    TimeBucket,
+)
+from storage.miner.bucket_cache import DataEntityBucketCache
+from storage.miner.miner_storage import SerializedDataEntities
+from storage.miner.sqlite_miner_storage import SqliteMinerStorage
+
+
+def _create_bucket_id(time_bucket_id: int, label: str = "label_1"):
+    return DataEntityBucketId(
+        time_bucket=TimeBucket(id=time_bucket_id),
+        source=DataSource.REDDIT,
+        label=DataLabel(value=label),
+    )
+
+
+def _serialized(size: int) -> SerializedDataEntities:
+    return SerializedDataEntities(serialized="x" * size, count=1, content_size_bytes=1)
+
+
+class TestDataEntityBucketCache(unittest.TestCase):
+    def test_get_or_load_caches(self):
+        """Tests that a bucket is only loaded once."""
+        cache = DataEntityBucketCache(max_size_bytes=100)
+        load = Mock(return_value=_serialized(10))
+
+        first = cache.get_or_load(_create_bucket_id(1), load)
+        second = cache.get_or_load(_create_bucket_id(1), load)
+
+        self.assertEqual(first, second)
+        self.assertEqual(load.call_count, 1)
+        metrics = cache.get_metrics()
+        self.assertEqual(metrics.hits, 1)
+        self.assertEqual(metrics.misses, 1)
+        self.assertEqual(metrics.size_bytes, 10)
+
+    def test_evicts_least_recently_used(self):
+        """Tests that the least recently used buckets are evicted once over the byte budget."""
+        cache = DataEntityBucketCache(max_size_bytes=25)
+        load = Mock(return_value=_serialized(10))
+
+        cache.get_or_load(_create_bucket_id(1), load)
+        cache.get_or_load(_create_bucket_id(2), load)
+        # Use bucket 1 so bucket 2 is the least recently used.
+        cache.get_or_load(_create_bucket_id(1), load)
+        cache.get_or_load(_create_bucket_id(3), load)
+        self.assertEqual(load.call_count, 3)
+
+        cache.get_or_load(_create_bucket_id(1), load)
+        self.assertEqual(load.call_count, 3)
+        cache.get_or_load(_create_bucket_id(2), load)
+        self.assertEqual(load.call_count, 4)
+        self.assertLessEqual(cache.get_metrics().size_bytes, 25)
+
+    def test_does_not_cache_over_budget(self):
+        """Tests that a bucket larger than the whole budget is served but not cached."""
+        cache = DataEntityBucketCache(max_size_bytes=5)
+        load = Mock(return_value=_serialized(10))
+
+        cache.get_or_load(_create_bucket_id(1), load)
+        cache.get_or_load(_create_bucket_id(1), load)
+
+        self.assertEqual(load.call_count, 2)
+        self.assertEqual(cache.get_metrics().entries, 0)
+
+    def test_on_write_invalidates_time_bucket(self):
+        """Tests that a write only invalidates the buckets in the written time buckets."""
+        cache = DataEntityBucketCache(max_size_bytes=100)
+        load = Mock(return_value=_serialized(10))
+        cache.get_or_load(_create_bucket_id(1, "label_1"), load)
+        cache.get_or_load(_create_bucket_id(1, "label_2"), load)
+        cache.get_or_load(_create_bucket_id(2), load)
+
+        cache.on_write({1})
+
+        metrics = cache.get_metrics()
+        self.assertEqual(metrics.entries, 1)
+        self.assertEqual(metrics.size_bytes, 10)
+        cache.get_or_load(_create_bucket_id(2), load)
+        self.assertEqual(load.call_count, 3)
+
+    def test_write_while_loading_is_not_cached(self):
+        """Tests that a bucket loaded while its time bucket was written to is not cached."""
+        cache = DataEntityBucketCache(max_size_bytes=100)
+
+        def load(data_entity_bucket_id):
+            cache.on_write({data_entity_bucket_id.time_bucket.id})
+            return _serialized(10)
+
+        cache.get_or_load(_create_bucket_id(1), load)
+
+        self.assertEqual(cache.get_metrics().entries, 0)
+
+    def test_storage_writes_invalidate(self):
+        """Tests that storing into a bucket through the storage invalidates its cached serialization."""
+        test_storage = SqliteMinerStorage(
+            "TestBucketCacheDb.sqlite", max_database_size_gb_hint=1
+        )
+        self.addCleanup(os.remove, test_storage.database)
+        self.addCleanup(test_storage.close)
+        cache = DataEntityBucketCache(max_size_bytes=1024 * 1024)
+        test_storage.add_write_listener(cache.on_write)
+
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        bucket_id = DataEntityBucketId(
+            time_bucket=TimeBucket.from_datetime(now),
+            source=DataSource.REDDIT,
+            label=DataLabel(value="label_1"),
+        )
+
+        def store(uri: str):
+            test_storage.store_data_entities(
+                [
+                    DataEntity(
+                        uri=uri,
+                        datetime=now,
+                        source=DataSource.REDDIT,
+                        label=DataLabel(value="label_1"),
+                        content=uri.encode(),
+                        content_size_bytes=10,
+                    )
+                ]
+            )
+
+        store("test_entity_1")
+        load = test_storage.get_serialized_data_entities_in_data_entity_bucket
+        self.assertEqual(cache.get_or_load(bucket_id, load).count, 1)
+
+        store("test_entity_2")
+        self.assertEqual(cache.get_or_load(bucket_id, load).count, 2)
+        self.assertEqual(cache.get_metrics().hits, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
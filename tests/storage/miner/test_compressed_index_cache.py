@@ -0,0 +1,109 @@
+import datetime as dt
+import os
+import unittest
+
+from common import constants
+from common.data import CompressedMinerIndex, DataEntity, DataLabel, DataSource
+from storage.miner.compressed_index_cache import CompressedIndexCache
+from storage.miner.sqlite_miner_storage import SqliteMinerStorage
+from tests import utils
+
+
+class TestCompressedIndexCache(unittest.TestCase):
+    def setUp(self):
+        self.test_storage = SqliteMinerStorage(
+            "TestIndexCacheDb.sqlite", max_database_size_gb_hint=1
+        )
+        self.cache = CompressedIndexCache(
+            storage=self.test_storage,
+            bucket_count_limits=[
+                constants.DATA_ENTITY_BUCKET_COUNT_LIMIT_PER_MINER_INDEX,
+                1,
+            ],
+            refresh_interval=dt.timedelta(hours=1),
+            refresh_after_writes=2,
+        )
+        self.test_storage.add_write_listener(self.cache.on_write)
+
+    def tearDown(self):
+        self.cache.stop()
+        self.test_storage.close()
+        os.remove(self.test_storage.database)
+
+    def _store_entity(self, uri: str, hours: int, size: int):
+        self.test_storage.store_data_entities(
+            [
+                DataEntity(
+                    uri=uri,
+                    datetime=dt.datetime.now() + dt.timedelta(hours=hours),
+                    source=DataSource.REDDIT,
+                    label=DataLabel(value="label_1"),
+                    content=bytes(size),
+                    content_size_bytes=size,
+                )
+            ]
+        )
+
+    def test_get_before_refresh(self):
+        """Tests that nothing is served before the cache is first built."""
+        self.assertIsNone(
+            self.cache.get(constants.DATA_ENTITY_BUCKET_COUNT_LIMIT_PER_MINER_INDEX)
+        )
+
+    def test_refresh(self):
+        """Tests that a refresh serializes the index for every bucket count limit."""
+        self._store_entity("test_entity_1", hours=0, size=10)
+        self._store_entity("test_entity_2", hours=1, size=20)
+
+        self.cache.refresh()
+
+        for limit in [constants.DATA_ENTITY_BUCKET_COUNT_LIMIT_PER_MINER_INDEX, 1]:
+            cached_index = self.cache.get(limit)
+            expected_index = self.test_storage.get_compressed_index(
+                bucket_count_limit=limit
+            )
+            self.assertTrue(
+                utils.are_compressed_indexes_equal(
+                    CompressedMinerIndex.parse_raw(cached_index.serialized),
+                    expected_index,
+                )
+            )
+            self.assertEqual(
+                cached_index.size_bytes, CompressedMinerIndex.size_bytes(expected_index)
+            )
+            self.assertEqual(
+                cached_index.bucket_count,
+                CompressedMinerIndex.bucket_count(expected_index),
+            )
+
+        self.assertEqual(self.cache.get(1).bucket_count, 1)
+
+    def test_refresh_after_writes(self):
+        """Tests that the background thread refreshes the cache after enough writes."""
+        self.cache.run_in_background_thread()
+        utils.wait_for_condition(
+            lambda: self.cache.get(
+                constants.DATA_ENTITY_BUCKET_COUNT_LIMIT_PER_MINER_INDEX
+            )
+            is not None
+        )
+        self.assertEqual(
+            self.cache.get(
+                constants.DATA_ENTITY_BUCKET_COUNT_LIMIT_PER_MINER_INDEX
+            ).bucket_count,
+            0,
+        )
+
+        self._store_entity("test_entity_1", hours=0, size=10)
+        self._store_entity("test_entity_2", hours=1, size=20)
+
+        utils.wait_for_condition(
+            lambda: self.cache.get(
+                constants.DATA_ENTITY_BUCKET_COUNT_LIMIT_PER_MINER_INDEX
+            ).bucket_count
+            == 2
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
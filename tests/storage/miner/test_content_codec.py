@@ -0,0 +1,51 @@
+import unittest
+from unittest.mock import patch
+
+from storage.miner import content_codec
+from storage.miner.content_codec import ContentCodec
+
+
+class TestContentCodec(unittest.TestCase):
+    def test_round_trip(self):
+        """Tests that every available codec decodes what it encodes."""
+        content = b'{"body": "' + b"compressible " * 100 + b'"}'
+        for codec in ContentCodec:
+            if not content_codec.is_available(codec):
+                continue
+
+            with self.subTest(codec=codec):
+                compressed = content_codec.compress(content, codec)
+                self.assertEqual(content_codec.decompress(compressed, codec), content)
+
+    def test_encode_compresses(self):
+        """Tests that compressible content is stored compressed."""
+        content = b"compressible " * 100
+        encoded, codec = content_codec.encode(content, ContentCodec.ZLIB)
+
+        self.assertEqual(codec, ContentCodec.ZLIB)
+        self.assertLess(len(encoded), len(content))
+
+    def test_encode_falls_back_to_none(self):
+        """Tests that content which does not shrink is stored as is."""
+        content = b"x"
+        encoded, codec = content_codec.encode(content, ContentCodec.ZLIB)
+
+        self.assertEqual(codec, ContentCodec.NONE)
+        self.assertEqual(encoded, content)
+
+    def test_zstd_unavailable(self):
+        """Tests that using ZSTD without zstandard installed names the missing package and codec."""
+        with patch.object(content_codec, "zstandard", None):
+            self.assertFalse(content_codec.is_available(ContentCodec.ZSTD))
+
+            for operation in (content_codec.compress, content_codec.decompress):
+                with self.subTest(operation=operation.__name__):
+                    with self.assertRaisesRegex(ImportError, "ZSTD.*zstandard"):
+                        operation(b"content", ContentCodec.ZSTD)
+
+            # Codecs without optional dependencies are unaffected.
+            content_codec.check_available(ContentCodec.ZLIB)
+
+
+if __name__ == "__main__":
+    unittest.main()
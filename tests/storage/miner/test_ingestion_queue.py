@@ -0,0 +1,113 @@
+import datetime as dt
+import os
+import unittest
+from unittest.mock import Mock
+
+from common.data import DataEntity, DataLabel, DataSource
+from storage.miner.ingestion_queue import IngestionQueue
+from storage.miner.miner_storage import MinerStorage
+from storage.miner.sqlite_miner_storage import SqliteMinerStorage
+from tests import utils
+
+
+def _create_entity(uri: str, size: int = 10) -> DataEntity:
+    return DataEntity(
+        uri=uri,
+        datetime=dt.datetime.now(tz=dt.timezone.utc),
+        source=DataSource.REDDIT,
+        label=DataLabel(value="label_1"),
+        content=uri.encode(),
+        content_size_bytes=size,
+    )
+
+
+class TestIngestionQueue(unittest.TestCase):
+    def setUp(self):
+        self.test_storage = SqliteMinerStorage(
+            "TestIngestionQueueDb.sqlite", max_database_size_gb_hint=1
+        )
+        self.ingestion_queue = IngestionQueue(
+            storage=self.test_storage, max_queued_batches=2
+        )
+
+    def tearDown(self):
+        self.ingestion_queue.stop()
+        self.test_storage.close()
+        os.remove(self.test_storage.database)
+
+    def test_merges_queued_batches(self):
+        """Tests that batches waiting in the queue are written in a single commit."""
+        self.ingestion_queue.put([_create_entity("test_entity_1")])
+        self.ingestion_queue.put(
+            [_create_entity("test_entity_2"), _create_entity("test_entity_3")]
+        )
+
+        self.ingestion_queue.flush()
+
+        metrics = self.ingestion_queue.get_metrics()
+        self.assertEqual(metrics.queue_depth, 0)
+        self.assertEqual(metrics.commits, 1)
+        self.assertEqual(metrics.entities_committed, 3)
+        self.assertEqual(self.test_storage.get_total_content_size_bytes(), 30)
+
+    def test_commits_in_background(self):
+        """Tests that the writer thread stores queued batches."""
+        self.ingestion_queue.run_in_background_thread()
+
+        self.ingestion_queue.put([_create_entity("test_entity_1")])
+
+        utils.wait_for_condition(
+            lambda: self.ingestion_queue.get_metrics().entities_committed == 1
+        )
+        self.assertEqual(self.test_storage.get_total_content_size_bytes(), 10)
+
+    def test_stop_flushes_queue(self):
+        """Tests that stopping writes any batches still in the queue."""
+        self.ingestion_queue.put([_create_entity("test_entity_1")])
+
+        self.ingestion_queue.stop()
+
+        self.assertEqual(self.test_storage.get_total_content_size_bytes(), 10)
+
+    def test_max_entities_per_commit(self):
+        """Tests that merged batches are split into commits once the entity limit is reached."""
+        mock_storage = Mock(spec=MinerStorage)
+        ingestion_queue = IngestionQueue(
+            storage=mock_storage, max_queued_batches=3, max_entities_per_commit=2
+        )
+        for i in range(3):
+            ingestion_queue.put([_create_entity(f"test_entity_{i}")])
+
+        ingestion_queue.flush()
+
+        self.assertEqual(mock_storage.store_data_entities.call_count, 2)
+        self.assertEqual(ingestion_queue.get_metrics().entities_committed, 3)
+
+    def test_retries_batches_when_merged_commit_fails(self):
+        """Tests that a failed merged commit is retried per batch, dropping only the batches that still fail."""
+        mock_storage = Mock(spec=MinerStorage)
+
+        def store_data_entities(data_entities):
+            if any(entity.uri == "bad_entity" for entity in data_entities):
+                raise ValueError("Failed to store")
+
+        mock_storage.store_data_entities.side_effect = store_data_entities
+        ingestion_queue = IngestionQueue(storage=mock_storage, max_queued_batches=3)
+        ingestion_queue.put([_create_entity("test_entity_1")])
+        ingestion_queue.put(
+            [_create_entity("bad_entity"), _create_entity("test_entity_2")]
+        )
+        ingestion_queue.put([_create_entity("test_entity_3")])
+
+        ingestion_queue.flush()
+
+        # One merged attempt, then one attempt per batch.
+        self.assertEqual(mock_storage.store_data_entities.call_count, 4)
+        metrics = ingestion_queue.get_metrics()
+        self.assertEqual(metrics.commits, 2)
+        self.assertEqual(metrics.entities_committed, 2)
+        self.assertEqual(metrics.entities_dropped, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import datetime as dt
+import os
+import shutil
+import tempfile
+import unittest
+
+from common.data import DataEntity, DataLabel, DataSource
+from storage.miner import parquet_io
+from storage.miner.sqlite_miner_storage import SqliteMinerStorage
+
+
+# CI installs requirements-parquet.txt, so only skip locally, where pyarrow is optional.
+@unittest.skipIf(
+    not parquet_io.is_available() and "CI" not in os.environ, "pyarrow is not installed"
+)
+class TestParquetIO(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.test_storage = SqliteMinerStorage(
+            os.path.join(self.directory, "TestDb.sqlite"), max_database_size_gb_hint=1
+        )
+        self.addCleanup(self.test_storage.close)
+
+    def test_export_import_round_trip(self):
+        """Tests that DataEntities exported to Parquet are imported back unchanged."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        entities = [
+            DataEntity(
+                uri=f"test_entity_{i}",
+                datetime=now - dt.timedelta(hours=i % 3),
+                source=DataSource.REDDIT if i % 2 else DataSource.X,
+                label=DataLabel(value=f"label_{i % 4}") if i % 5 else None,
+                content=f"content_{i}".encode(),
+                content_size_bytes=10 + i,
+            )
+            for i in range(20)
+        ]
+        self.test_storage.store_data_entities(entities)
+
+        export_directory = os.path.join(self.directory, "export")
+        self.assertEqual(
+            parquet_io.export_to_parquet(
+                self.test_storage, export_directory, batch_size=3
+            ),
+            len(entities),
+        )
+        bucket = self.test_storage.list_data_entity_buckets()[0]
+        self.assertTrue(
+            os.path.exists(
+                parquet_io.partition_path(
+                    export_directory, bucket.id.time_bucket.id, int(bucket.id.source)
+                )
+            )
+        )
+
+        import_storage = SqliteMinerStorage(
+            os.path.join(self.directory, "TestImportDb.sqlite"),
+            max_database_size_gb_hint=1,
+        )
+        self.addCleanup(import_storage.close)
+        self.assertEqual(
+            parquet_io.import_from_parquet(
+                import_storage, export_directory, batch_size=3
+            ),
+            len(entities),
+        )
+
+        self.assertEqual(
+            import_storage.list_data_entity_buckets(),
+            self.test_storage.list_data_entity_buckets(),
+        )
+        for bucket in self.test_storage.list_data_entity_buckets():
+            self.assertEqual(
+                import_storage.list_data_entities_in_data_entity_bucket(bucket.id),
+                self.test_storage.list_data_entities_in_data_entity_bucket(bucket.id),
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,307 @@
+import concurrent.futures
+import datetime as dt
+import os
+import shutil
+import sqlite3
+import threading
+import unittest
+from unittest.mock import patch
+
+from common import constants
+from common.data import (
+    CompressedEntityBucket,
+    CompressedMinerIndex,
+    DataEntity,
+    DataEntityBucketId,
+    DataLabel,
+    DataSource,
+    TimeBucket,
+)
+from storage.miner.partitioned_sqlite_miner_storage import (
+    PartitionedSqliteMinerStorage,
+)
+from tests import utils
+
+
+class TestPartitionedSqliteMinerStorage(unittest.TestCase):
+    def setUp(self):
+        # Make a test directory of partitions for the test to operate against.
+        self.test_storage = PartitionedSqliteMinerStorage(
+            "TestPartitionedDb", max_database_size_gb_hint=1, partition_hours=1
+        )
+
+    def tearDown(self):
+        # Clean up the test partitions.
+        self.test_storage.close()
+        shutil.rmtree(self.test_storage.directory)
+
+    def _create_entity(
+        self, uri: str, datetime: dt.datetime, size: int, label: str = "label_1"
+    ) -> DataEntity:
+        return DataEntity(
+            uri=uri,
+            datetime=datetime,
+            source=DataSource.REDDIT,
+            label=DataLabel(value=label),
+            content=bytes(size),
+            content_size_bytes=size,
+        )
+
+    def test_store_entities_by_partition(self):
+        """Tests that entities are stored in the partition for their time bucket."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        self.test_storage.store_data_entities(
+            [
+                self._create_entity("test_entity_1", now, 10),
+                self._create_entity("test_entity_2", now + dt.timedelta(hours=1), 20),
+            ]
+        )
+
+        self.assertEqual(len(self.test_storage.partitions), 2)
+        self.assertEqual(self.test_storage.get_total_content_size_bytes(), 30)
+
+    def test_list_entities_in_data_entity_bucket(self):
+        """Tests that bucket reads are routed to the right partition."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        entity1 = self._create_entity("test_entity_1", now, 10)
+        entity2 = self._create_entity("test_entity_2", now + dt.timedelta(hours=1), 20)
+        self.test_storage.store_data_entities([entity1, entity2])
+
+        data_entities = self.test_storage.list_data_entities_in_data_entity_bucket(
+            DataEntityBucketId(
+                time_bucket=TimeBucket.from_datetime(entity2.datetime),
+                source=DataSource.REDDIT,
+                label=DataLabel(value="label_1"),
+            )
+        )
+        self.assertEqual(data_entities, [entity2])
+
+        # A bucket without a partition is empty.
+        data_entities = self.test_storage.list_data_entities_in_data_entity_bucket(
+            DataEntityBucketId(
+                time_bucket=TimeBucket.from_datetime(now + dt.timedelta(hours=5)),
+                source=DataSource.REDDIT,
+            )
+        )
+        self.assertEqual(data_entities, [])
+
+    def test_get_compressed_index(self):
+        """Tests that the index merges the largest buckets across partitions."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        self.test_storage.store_data_entities(
+            [
+                self._create_entity("test_entity_1", now, 10),
+                self._create_entity("test_entity_2", now + dt.timedelta(hours=1), 30),
+                self._create_entity("test_entity_3", now + dt.timedelta(hours=2), 20),
+            ]
+        )
+
+        index = self.test_storage.get_compressed_index(bucket_count_limit=2)
+
+        expected_index = CompressedMinerIndex(
+            sources={
+                DataSource.REDDIT: [
+                    CompressedEntityBucket(
+                        label="label_1",
+                        time_bucket_ids=[
+                            TimeBucket.from_datetime(now + dt.timedelta(hours=1)).id,
+                            TimeBucket.from_datetime(now + dt.timedelta(hours=2)).id,
+                        ],
+                        sizes_bytes=[30, 20],
+                    )
+                ],
+            }
+        )
+        self.assertTrue(utils.are_compressed_indexes_equal(index, expected_index))
+
+        data_entity_buckets = self.test_storage.list_data_entity_buckets()
+        self.assertEqual(
+            [bucket.size_bytes for bucket in data_entity_buckets], [30, 20, 10]
+        )
+
+    def test_clear_content_from_oldest_drops_partitions(self):
+        """Tests that clearing content drops the oldest partitions."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        self.test_storage.store_data_entities(
+            [
+                self._create_entity("test_entity_1", now, 10),
+                self._create_entity("test_entity_2", now + dt.timedelta(hours=1), 20),
+            ]
+        )
+        oldest_path = self.test_storage._partition_path(
+            self.test_storage._partition_id(TimeBucket.from_datetime(now).id)
+        )
+        self.assertTrue(os.path.exists(oldest_path))
+
+        self.test_storage.clear_content_from_oldest(10)
+
+        self.assertFalse(os.path.exists(oldest_path))
+        self.assertEqual(len(self.test_storage.partitions), 1)
+        self.assertEqual(self.test_storage.get_total_content_size_bytes(), 20)
+
+    def test_read_while_dropping_partition(self):
+        """Tests that a partition is only dropped once reads using it finish, and is never recreated by a read."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        entity = self._create_entity("test_entity_1", now, 10)
+        self.test_storage.store_data_entities(
+            [
+                entity,
+                self._create_entity("test_entity_2", now + dt.timedelta(hours=1), 20),
+            ]
+        )
+        bucket_id = DataEntityBucketId(
+            time_bucket=TimeBucket.from_datetime(now),
+            source=DataSource.REDDIT,
+            label=DataLabel(value="label_1"),
+        )
+        partition_id = self.test_storage._partition_id(bucket_id.time_bucket.id)
+        partition_path = self.test_storage._partition_path(partition_id)
+
+        # Block the read inside the partition until the drop has started.
+        partition = self.test_storage.partitions[partition_id]
+        read_started = threading.Event()
+        finish_read = threading.Event()
+        list_data_entities = partition.list_data_entities_in_data_entity_bucket
+
+        def blocking_list_data_entities(data_entity_bucket_id):
+            read_started.set()
+            finish_read.wait(timeout=10)
+            return list_data_entities(data_entity_bucket_id)
+
+        partition.list_data_entities_in_data_entity_bucket = blocking_list_data_entities
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            read = executor.submit(
+                self.test_storage.list_data_entities_in_data_entity_bucket, bucket_id
+            )
+            self.assertTrue(read_started.wait(timeout=10))
+            drop = executor.submit(self.test_storage.clear_content_from_oldest, 10)
+
+            # The drop waits for the read to finish.
+            with self.assertRaises(concurrent.futures.TimeoutError):
+                drop.result(timeout=0.5)
+            self.assertTrue(os.path.exists(partition_path))
+
+            finish_read.set()
+            self.assertEqual(read.result(timeout=10), [entity])
+            drop.result(timeout=10)
+
+        self.assertFalse(os.path.exists(partition_path))
+
+        # Reads after the drop find no partition, and do not recreate its file.
+        self.assertEqual(
+            self.test_storage.list_data_entities_in_data_entity_bucket(bucket_id), []
+        )
+        self.assertFalse(os.path.exists(partition_path))
+
+        # The dropped partition refuses to reopen its file.
+        with self.assertRaises(sqlite3.ProgrammingError):
+            list_data_entities(bucket_id)
+        self.assertFalse(os.path.exists(partition_path))
+
+    def test_drop_expired_partitions(self):
+        """Tests that partitions past the age limit are dropped."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        old = now - dt.timedelta(days=constants.DATA_ENTITY_BUCKET_AGE_LIMIT_DAYS + 1)
+        self.test_storage.store_data_entities(
+            [
+                self._create_entity("test_entity_1", now, 10),
+                self._create_entity("test_entity_2", old, 20),
+            ]
+        )
+
+        self.assertEqual(self.test_storage.drop_expired_partitions(), 20)
+        self.assertEqual(len(self.test_storage.partitions), 1)
+        self.assertEqual(self.test_storage.get_total_content_size_bytes(), 10)
+
+    def test_store_samples_sizes(self):
+        """Tests that stores only sum sizes over the partitions once per sample interval, and never drop partitions."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        old = now - dt.timedelta(days=constants.DATA_ENTITY_BUCKET_AGE_LIMIT_DAYS + 1)
+        with patch.object(
+            self.test_storage,
+            "get_total_content_size_bytes",
+            wraps=self.test_storage.get_total_content_size_bytes,
+        ) as get_total_content_size_bytes:
+            for i in range(3):
+                self.test_storage.store_data_entities(
+                    [
+                        self._create_entity(f"test_entity_{i}", now, 10 + i),
+                        self._create_entity(f"test_old_entity_{i}", old, 10 + i),
+                    ]
+                )
+            self.assertEqual(get_total_content_size_bytes.call_count, 1)
+
+        self.assertEqual(self.test_storage.sampled_content_size_bytes, 66)
+        self.assertEqual(len(self.test_storage.partitions), 2)
+
+        # Clearing content resamples on the next store.
+        self.assertEqual(self.test_storage.delete_expired_data_entities(), 33)
+        self.test_storage.store_data_entities(
+            [self._create_entity("test_entity_3", now, 20)]
+        )
+        self.assertEqual(self.test_storage.sampled_content_size_bytes, 53)
+
+    def test_partition_cache_sizes(self):
+        """Tests that partitions use the smaller page cache and memory map sizes."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        self.test_storage.store_data_entities(
+            [self._create_entity("test_entity_1", now, 10)]
+        )
+
+        partition = next(iter(self.test_storage.partitions.values()))
+        connection = partition.write_connection
+        self.assertEqual(
+            connection.execute("PRAGMA cache_size").fetchone()[0],
+            -PartitionedSqliteMinerStorage.PARTITION_CACHE_SIZE_KIB,
+        )
+        self.assertEqual(
+            connection.execute("PRAGMA mmap_size").fetchone()[0],
+            PartitionedSqliteMinerStorage.PARTITION_MMAP_SIZE_BYTES,
+        )
+
+    def test_delete_expired_data_entities(self):
+        """Tests that expired DataEntities are deleted, including from a partition that also holds newer data."""
+        self.test_storage.close()
+        shutil.rmtree(self.test_storage.directory)
+        # Use a single partition for all time, so it spans the age limit.
+        self.test_storage = PartitionedSqliteMinerStorage(
+            "TestPartitionedDb", max_database_size_gb_hint=1, partition_hours=10**9
+        )
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        old = now - dt.timedelta(days=constants.DATA_ENTITY_BUCKET_AGE_LIMIT_DAYS + 1)
+        self.test_storage.store_data_entities(
+            [
+                self._create_entity("test_entity_1", now, 10),
+                self._create_entity("test_entity_2", old, 20),
+            ]
+        )
+        self.assertEqual(len(self.test_storage.partitions), 1)
+
+        self.assertEqual(self.test_storage.delete_expired_data_entities(), 20)
+        self.assertEqual(self.test_storage.get_total_content_size_bytes(), 10)
+
+    def test_reopen_existing_partitions(self):
+        """Tests that existing partitions are opened on startup."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        entity = self._create_entity("test_entity_1", now, 10)
+        self.test_storage.store_data_entities([entity])
+        self.test_storage.close()
+
+        self.test_storage = PartitionedSqliteMinerStorage(
+            "TestPartitionedDb", max_database_size_gb_hint=1, partition_hours=1
+        )
+
+        self.assertEqual(self.test_storage.get_total_content_size_bytes(), 10)
+        data_entities = self.test_storage.list_data_entities_in_data_entity_bucket(
+            DataEntityBucketId(
+                time_bucket=TimeBucket.from_datetime(now),
+                source=DataSource.REDDIT,
+                label=DataLabel(value="label_1"),
+            )
+        )
+        self.assertEqual(data_entities, [entity])
+
+
+if __name__ == "__main__":
+    unittest.main()
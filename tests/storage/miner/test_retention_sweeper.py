@@ -0,0 +1,75 @@
+import datetime as dt
+import os
+import unittest
+
+from common import constants
+from common.data import DataEntity, DataLabel, DataSource
+from storage.miner.retention_sweeper import RetentionSweeper
+from storage.miner.sqlite_miner_storage import SqliteMinerStorage
+
+
+class TestRetentionSweeper(unittest.TestCase):
+    def setUp(self):
+        self.test_storage = SqliteMinerStorage(
+            "TestRetentionSweeperDb.sqlite", max_database_size_gb_hint=1
+        )
+        self.addCleanup(os.remove, self.test_storage.database)
+        self.addCleanup(self.test_storage.close)
+        self.sweeper = RetentionSweeper(
+            storage=self.test_storage, sweep_interval=dt.timedelta(minutes=1)
+        )
+
+    def _create_entity(self, uri: str, datetime: dt.datetime) -> DataEntity:
+        return DataEntity(
+            uri=uri,
+            datetime=datetime,
+            source=DataSource.REDDIT,
+            label=DataLabel(value="label_1"),
+            content=os.urandom(100 * 1024),
+            content_size_bytes=100 * 1024,
+        )
+
+    def _get_disk_size_bytes(self) -> int:
+        return sum(
+            os.path.getsize(path)
+            for path in self.test_storage.get_database_files()
+            if os.path.exists(path)
+        )
+
+    def test_sweep(self):
+        """Tests that a sweep deletes expired data and reports the bytes cleared and reclaimed."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        old = now - dt.timedelta(days=constants.DATA_ENTITY_BUCKET_AGE_LIMIT_DAYS + 1)
+        self.test_storage.store_data_entities(
+            [self._create_entity("test_entity_1", now)]
+            + [self._create_entity(f"test_entity_{i}", old) for i in range(2, 5)]
+        )
+
+        disk_size_before = self._get_disk_size_bytes()
+        self.assertEqual(self.sweeper.sweep(), 300 * 1024)
+        disk_size_after = self._get_disk_size_bytes()
+        self.assertEqual(self.sweeper.sweep(), 0)
+
+        metrics = self.sweeper.get_metrics()
+        self.assertEqual(metrics.sweeps, 2)
+        self.assertEqual(metrics.content_bytes_cleared, 300 * 1024)
+        self.assertGreaterEqual(metrics.database_bytes_reclaimed, 300 * 1024)
+        # Reclaimed bytes are measured on disk, including the write-ahead log.
+        self.assertEqual(
+            metrics.database_bytes_reclaimed, disk_size_before - disk_size_after
+        )
+        self.assertIsNotNone(metrics.last_sweep_latency)
+        self.assertEqual(self.test_storage.get_total_content_size_bytes(), 100 * 1024)
+
+    def test_run_in_background_thread(self):
+        """Tests that the sweeper sweeps on start and stops when asked."""
+        self.sweeper.run_in_background_thread()
+        self.sweeper.stop()
+        self.sweeper.thread.join(timeout=5)
+
+        self.assertFalse(self.sweeper.thread.is_alive())
+        self.assertEqual(self.sweeper.get_metrics().sweeps, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
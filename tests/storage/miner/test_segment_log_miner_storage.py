@@ -0,0 +1,630 @@
+import datetime as dt
+import json
+import os
+import random
+import shutil
+import unittest
+from unittest.mock import Mock, patch
+
+from common import constants
+from common.data import (
+    CompressedEntityBucket,
+    CompressedMinerIndex,
+    DataEntity,
+    DataEntityBucketId,
+    DataLabel,
+    DataSource,
+    TimeBucket,
+)
+from storage.miner.content_codec import ContentCodec
+from storage.miner.segment_log_miner_storage import SegmentLogMinerStorage, _KeyIndex
+from storage.miner.sqlite_miner_storage import SqliteMinerStorage
+from tests import utils
+
+
+class TestSegmentLogMinerStorage(unittest.TestCase):
+    def setUp(self):
+        # Make a test directory of segments for the test to operate against.
+        self.test_storage = SegmentLogMinerStorage(
+            "TestSegmentLogDb", max_database_size_gb_hint=1
+        )
+
+    def tearDown(self):
+        # Clean up the test segments.
+        self.test_storage.close()
+        shutil.rmtree(self.test_storage.directory)
+
+    def _reopen(self, content_codec=ContentCodec.NONE):
+        self.test_storage.close()
+        self.test_storage = SegmentLogMinerStorage(
+            "TestSegmentLogDb",
+            max_database_size_gb_hint=1,
+            content_codec=content_codec,
+        )
+
+    def _create_entity(
+        self,
+        uri: str,
+        datetime: dt.datetime,
+        size: int,
+        label: str = "label_1",
+        content: bytes = None,
+    ) -> DataEntity:
+        return DataEntity(
+            uri=uri,
+            datetime=datetime,
+            source=DataSource.REDDIT,
+            label=DataLabel(value=label) if label is not None else None,
+            content=content if content is not None else uri.encode(),
+            content_size_bytes=size,
+        )
+
+    def _create_bucket_id(self, datetime: dt.datetime, label: str = "label_1"):
+        return DataEntityBucketId(
+            time_bucket=TimeBucket.from_datetime(datetime),
+            source=DataSource.REDDIT,
+            label=DataLabel(value=label) if label is not None else None,
+        )
+
+    def test_store_entities_by_segment(self):
+        """Tests that entities are appended to the segment for their time bucket."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        self.test_storage.store_data_entities(
+            [
+                self._create_entity("test_entity_1", now, 10),
+                self._create_entity("test_entity_2", now + dt.timedelta(hours=1), 20),
+            ]
+        )
+
+        self.assertEqual(len(self.test_storage.segments), 2)
+        self.assertEqual(self.test_storage.get_total_content_size_bytes(), 30)
+        self.assertEqual(
+            self.test_storage.get_database_size_bytes(),
+            sum(
+                os.path.getsize(segment.path) + os.path.getsize(segment.index_path)
+                for segment in self.test_storage.segments.values()
+            ),
+        )
+
+    def test_store_identical_entities(self):
+        """Tests that storing a uri again replaces its entity."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        self.test_storage.store_data_entities(
+            [
+                self._create_entity("test_entity_1", now, 10),
+                self._create_entity("test_entity_2", now, 20, label=None),
+            ]
+        )
+
+        entity1 = self._create_entity("test_entity_1", now, 50, content=b"updated_1")
+        entity2 = self._create_entity(
+            "test_entity_2", now, 100, label=None, content=b"updated_2"
+        )
+        self.test_storage.store_data_entities([entity1, entity2])
+
+        self.assertEqual(self.test_storage.get_total_content_size_bytes(), 150)
+        self.assertEqual(
+            self.test_storage.list_data_entities_in_data_entity_bucket(
+                self._create_bucket_id(now)
+            ),
+            [entity1],
+        )
+        self.assertEqual(
+            self.test_storage.list_data_entities_in_data_entity_bucket(
+                self._create_bucket_id(now, label=None)
+            ),
+            [entity2],
+        )
+
+    def test_store_duplicate_content(self):
+        """Tests that entities with the same content as another uri are dropped, but updates to a uri are not."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        entity1 = self._create_entity("test_entity_1", now, 10, content=b"content_1")
+        entity2 = self._create_entity("test_entity_2", now, 10, content=b"content_1")
+        self.test_storage.store_data_entities([entity1, entity2])
+
+        entity3 = self._create_entity("test_entity_3", now, 10, content=b"content_1")
+        entity4 = self._create_entity("test_entity_4", now, 10, content=b"content_4")
+        self.test_storage.store_data_entities([entity3, entity4, entity1])
+
+        self.assertEqual(
+            [
+                data_entity.uri
+                for data_entity in self.test_storage.list_data_entities_in_data_entity_bucket(
+                    self._create_bucket_id(now)
+                )
+            ],
+            ["test_entity_1", "test_entity_4"],
+        )
+        self.assertEqual(self.test_storage.get_total_content_size_bytes(), 20)
+
+    def test_store_over_max_content_size_fail(self):
+        """Tests that we except on attempts to store entities larger than maximum storage in one store call."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        large_entity = self._create_entity(
+            "large_entity", now, 1.1 * 1024 * 1024 * 1024
+        )
+
+        with self.assertRaises(ValueError):
+            self.test_storage.store_data_entities([large_entity])
+
+    def test_store_over_max_content_size_succeeds(self):
+        """Tests that we succeed on clearing space when going over maximum configured content storage."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        mb_400 = 400 * 1024 * 1024
+        entities = [
+            self._create_entity(f"test_entity_{i}", now + dt.timedelta(hours=i), mb_400)
+            for i in range(3)
+        ]
+
+        self.test_storage.store_data_entities(entities[:2])
+        self.test_storage.store_data_entities(entities[2:])
+
+        self.assertEqual(len(self.test_storage.segments), 2)
+        self.assertEqual(self.test_storage.get_total_content_size_bytes(), 2 * mb_400)
+        self.assertEqual(
+            self.test_storage.list_data_entities_in_data_entity_bucket(
+                self._create_bucket_id(now)
+            ),
+            [],
+        )
+
+    def test_list_entities_in_data_entity_bucket(self):
+        """Tests that bucket reads return the entities of the bucket ordered by uri, for every codec."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        entities = [
+            self._create_entity(
+                f"test_entity_{i}",
+                now,
+                10,
+                label=label,
+                content=json.dumps({"text": "é" * 100, "id": i}).encode(),
+            )
+            for i, label in enumerate(["label_1", None, "label_1", "label_2"])
+        ]
+        self.test_storage.store_data_entities(list(reversed(entities)))
+
+        for content_codec in [ContentCodec.NONE, ContentCodec.ZLIB]:
+            with self.subTest(content_codec=content_codec):
+                self._reopen(content_codec)
+                # Store again so the records are encoded with the codec.
+                self.test_storage.store_data_entities(entities)
+
+                self.assertEqual(
+                    self.test_storage.list_data_entities_in_data_entity_bucket(
+                        self._create_bucket_id(now)
+                    ),
+                    [entities[0], entities[2]],
+                )
+                self.assertEqual(
+                    self.test_storage.list_data_entities_in_data_entity_bucket(
+                        self._create_bucket_id(now, label=None)
+                    ),
+                    [entities[1]],
+                )
+                self.assertEqual(
+                    self.test_storage.list_data_entities_in_data_entity_bucket(
+                        self._create_bucket_id(now, label="unknown")
+                    ),
+                    [],
+                )
+
+    def test_get_serialized_data_entities_in_data_entity_bucket(self):
+        """Tests that serialized bucket reads match the DataEntities of the bucket."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        self.test_storage.store_data_entities(
+            [
+                self._create_entity(
+                    "test_entity_1", now, 10, content='{"text": "é"}'.encode()
+                ),
+                self._create_entity("test_entity_2", now, 20),
+                self._create_entity("test_entity_3", now, 30, label=None),
+            ]
+        )
+
+        for label in ["label_1", None, "unknown"]:
+            bucket_id = self._create_bucket_id(now, label=label)
+            data_entities = self.test_storage.list_data_entities_in_data_entity_bucket(
+                bucket_id
+            )
+
+            serialized_data_entities = (
+                self.test_storage.get_serialized_data_entities_in_data_entity_bucket(
+                    bucket_id
+                )
+            )
+
+            self.assertEqual(
+                [
+                    DataEntity.parse_obj(data_entity)
+                    for data_entity in json.loads(serialized_data_entities.serialized)
+                ],
+                data_entities,
+            )
+            self.assertEqual(serialized_data_entities.count, len(data_entities))
+            self.assertEqual(
+                serialized_data_entities.content_size_bytes,
+                sum(data_entity.content_size_bytes for data_entity in data_entities),
+            )
+
+    @patch.object(constants, "DATA_ENTITY_BUCKET_SIZE_LIMIT_BYTES", 50)
+    def test_list_entities_in_data_entity_bucket_over_size_limit(self):
+        """Tests that bucket reads stop at the size limit and always return the same entities."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        self.test_storage.store_data_entities(
+            [
+                self._create_entity(f"test_entity_{i}", now, 20)
+                for i in reversed(range(5))
+            ]
+        )
+
+        # Only the first entities by uri that fit within the limit are returned.
+        for _ in range(2):
+            data_entities = self.test_storage.list_data_entities_in_data_entity_bucket(
+                self._create_bucket_id(now)
+            )
+            self.assertEqual(
+                [data_entity.uri for data_entity in data_entities],
+                ["test_entity_0", "test_entity_1"],
+            )
+
+    def test_get_compressed_index(self):
+        """Tests that the index holds the largest buckets, grouped by source and label."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        old = now - dt.timedelta(days=constants.DATA_ENTITY_BUCKET_AGE_LIMIT_DAYS + 1)
+        self.test_storage.store_data_entities(
+            [
+                self._create_entity("test_entity_1", now, 10),
+                self._create_entity("test_entity_2", now + dt.timedelta(hours=1), 20),
+                self._create_entity("test_entity_3", now, 30, label="label_2"),
+            ]
+        )
+        # Bypass the expiry on store to check the index skips buckets past the age limit.
+        with patch.object(self.test_storage, "drop_expired_segments"):
+            self.test_storage.store_data_entities(
+                [self._create_entity("test_entity_4", old, 40)]
+            )
+
+        index = self.test_storage.get_compressed_index()
+
+        expected_index = CompressedMinerIndex(
+            sources={
+                DataSource.REDDIT.value: [
+                    CompressedEntityBucket(
+                        label="label_2",
+                        time_bucket_ids=[TimeBucket.from_datetime(now).id],
+                        sizes_bytes=[30],
+                    ),
+                    CompressedEntityBucket(
+                        label="label_1",
+                        time_bucket_ids=[
+                            TimeBucket.from_datetime(now + dt.timedelta(hours=1)).id,
+                            TimeBucket.from_datetime(now).id,
+                        ],
+                        sizes_bytes=[20, 10],
+                    ),
+                ]
+            }
+        )
+        self.assertTrue(utils.are_compressed_indexes_equal(index, expected_index))
+        self.assertEqual(
+            CompressedMinerIndex.bucket_count(
+                self.test_storage.get_compressed_index(bucket_count_limit=1)
+            ),
+            1,
+        )
+
+        data_entity_buckets = self.test_storage.list_data_entity_buckets()
+        self.assertEqual(
+            [bucket.size_bytes for bucket in data_entity_buckets], [30, 20, 10]
+        )
+
+    def test_clear_content_from_oldest_drops_segments(self):
+        """Tests that clearing content deletes the oldest segments."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        listener = Mock()
+        self.test_storage.add_write_listener(listener)
+        self.test_storage.store_data_entities(
+            [
+                self._create_entity("test_entity_1", now, 10),
+                self._create_entity("test_entity_2", now + dt.timedelta(hours=1), 20),
+            ]
+        )
+        oldest_time_bucket_id = TimeBucket.from_datetime(now).id
+        oldest_path = self.test_storage._segment_path(oldest_time_bucket_id)
+        self.assertTrue(os.path.exists(oldest_path))
+
+        self.test_storage.clear_content_from_oldest(10)
+
+        self.assertFalse(os.path.exists(oldest_path))
+        self.assertEqual(len(self.test_storage.segments), 1)
+        self.assertEqual(self.test_storage.get_total_content_size_bytes(), 20)
+        listener.assert_called_with({oldest_time_bucket_id})
+
+        # The content of cleared entities can be stored again under another uri.
+        self.test_storage.store_data_entities(
+            [self._create_entity("test_entity_3", now, 10, content=b"test_entity_1")]
+        )
+        self.assertEqual(self.test_storage.get_total_content_size_bytes(), 30)
+
+    def test_drop_expired_segments(self):
+        """Tests that segments past the age limit are dropped."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        old = now - dt.timedelta(days=constants.DATA_ENTITY_BUCKET_AGE_LIMIT_DAYS + 1)
+        self.test_storage.store_data_entities(
+            [
+                self._create_entity("test_entity_1", now, 10),
+                self._create_entity("test_entity_2", old, 20),
+            ]
+        )
+
+        self.assertEqual(self.test_storage.drop_expired_segments(), 20)
+        self.assertEqual(len(self.test_storage.segments), 1)
+        self.assertEqual(self.test_storage.get_total_content_size_bytes(), 10)
+
+    def test_reopen_existing_segments(self):
+        """Tests that the index is rebuilt from existing segments on startup, keeping the latest record per uri."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        self.test_storage.store_data_entities(
+            [self._create_entity("test_entity_1", now + dt.timedelta(hours=1), 10)]
+        )
+        # Move the entity to an older time bucket, so its latest record is in an earlier segment.
+        entity = self._create_entity("test_entity_1", now, 20, content=b"updated")
+        self.test_storage.store_data_entities([entity])
+
+        self._reopen()
+
+        self.assertEqual(self.test_storage.get_total_content_size_bytes(), 20)
+        self.assertEqual(
+            self.test_storage.list_data_entities_in_data_entity_bucket(
+                self._create_bucket_id(now)
+            ),
+            [entity],
+        )
+        self.assertEqual(
+            self.test_storage.list_data_entities_in_data_entity_bucket(
+                self._create_bucket_id(now + dt.timedelta(hours=1))
+            ),
+            [],
+        )
+
+        # Records appended after reopening are ordered after the existing ones.
+        entity = self._create_entity("test_entity_1", now, 30, content=b"updated_2")
+        self.test_storage.store_data_entities([entity])
+        self._reopen()
+        self.assertEqual(self.test_storage.get_total_content_size_bytes(), 30)
+
+    def test_reopen_truncates_torn_record(self):
+        """Tests that an incomplete record at the end of a segment is dropped on startup."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        entity = self._create_entity("test_entity_1", now, 10)
+        self.test_storage.store_data_entities([entity])
+        self.test_storage.store_data_entities(
+            [self._create_entity("test_entity_2", now, 20)]
+        )
+        path = self.test_storage._segment_path(TimeBucket.from_datetime(now).id)
+        self.test_storage.close()
+
+        with open(path, "r+b") as file:
+            file.truncate(os.path.getsize(path) - 5)
+
+        self._reopen()
+
+        self.assertEqual(self.test_storage.get_total_content_size_bytes(), 10)
+        self.assertEqual(
+            self.test_storage.list_data_entities_in_data_entity_bucket(
+                self._create_bucket_id(now)
+            ),
+            [entity],
+        )
+
+        # New records are appended after the last complete record.
+        self.test_storage.store_data_entities(
+            [self._create_entity("test_entity_2", now, 20)]
+        )
+        self._reopen()
+        self.assertEqual(self.test_storage.get_total_content_size_bytes(), 30)
+
+    def test_reopen_reads_index_without_scanning(self):
+        """Tests that records covered by the index files are not scanned on startup."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        entity = self._create_entity("test_entity_1", now, 10)
+        self.test_storage.store_data_entities(
+            [entity, self._create_entity("test_entity_2", now, 20, label=None)]
+        )
+
+        with patch.object(SegmentLogMinerStorage, "_read_record") as read_record:
+            self._reopen()
+            read_record.assert_not_called()
+
+        self.assertEqual(self.test_storage.get_total_content_size_bytes(), 30)
+        self.assertEqual(
+            self.test_storage.list_data_entities_in_data_entity_bucket(
+                self._create_bucket_id(now)
+            ),
+            [entity],
+        )
+
+    def test_reopen_recovers_lost_index_entries(self):
+        """Tests that records missing from the index file are scanned and indexed on startup."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        entities = [
+            self._create_entity("test_entity_1", now, 10),
+            self._create_entity("test_entity_2", now, 20),
+        ]
+        self.test_storage.store_data_entities(entities[:1])
+        self.test_storage.store_data_entities(entities[1:])
+        index_path = self.test_storage._index_path(TimeBucket.from_datetime(now).id)
+        self.test_storage.close()
+
+        # Leave a partially written entry for the second record.
+        with open(index_path, "r+b") as file:
+            file.truncate(os.path.getsize(index_path) - 5)
+        self._reopen()
+        self.assertEqual(
+            self.test_storage.list_data_entities_in_data_entity_bucket(
+                self._create_bucket_id(now)
+            ),
+            entities,
+        )
+
+        # Segments without an index file are fully scanned.
+        self.test_storage.close()
+        os.remove(index_path)
+        self._reopen()
+        self.assertEqual(self.test_storage.get_total_content_size_bytes(), 30)
+        self.assertEqual(
+            self.test_storage.list_data_entities_in_data_entity_bucket(
+                self._create_bucket_id(now)
+            ),
+            entities,
+        )
+
+        # The recovered entries were written back, so the next startup does not scan.
+        with patch.object(SegmentLogMinerStorage, "_read_record") as read_record:
+            self._reopen()
+            read_record.assert_not_called()
+        self.assertEqual(self.test_storage.get_total_content_size_bytes(), 30)
+
+    def test_sync_every_store(self):
+        """Tests that stores are only synced to disk when sync_every_store is set."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        self.test_storage.close()
+        self.test_storage = SegmentLogMinerStorage(
+            "TestSegmentLogDb", max_database_size_gb_hint=1, sync_every_store=False
+        )
+
+        with patch("storage.miner.segment_log_miner_storage.os.fsync") as fsync:
+            self.test_storage.store_data_entities(
+                [self._create_entity("test_entity_1", now, 10)]
+            )
+            fsync.assert_not_called()
+
+            self._reopen()
+            fsync.reset_mock()
+            self.test_storage.store_data_entities(
+                [self._create_entity("test_entity_2", now, 20)]
+            )
+            self.assertGreater(fsync.call_count, 0)
+
+    @patch.object(SegmentLogMinerStorage, "MAX_OPEN_SEGMENTS", 2)
+    @patch.object(SegmentLogMinerStorage, "MAX_MAPPED_SEGMENTS", 3)
+    def test_bounds_open_segments(self):
+        """Tests that only the most recently used segments keep their files open and mapped."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        datetimes = [now - dt.timedelta(hours=hours) for hours in range(6)]
+        for i, datetime in enumerate(datetimes):
+            self.test_storage.store_data_entities(
+                [self._create_entity(f"test_entity_{i}", datetime, 10)]
+            )
+            self.assertLessEqual(
+                sum(segment.is_open for segment in self.test_storage.segments.values()),
+                2,
+            )
+
+        for i, datetime in enumerate(datetimes):
+            entities = self.test_storage.list_data_entities_in_data_entity_bucket(
+                self._create_bucket_id(datetime)
+            )
+            self.assertEqual([entity.uri for entity in entities], [f"test_entity_{i}"])
+            self.assertLessEqual(
+                sum(
+                    segment.is_mapped for segment in self.test_storage.segments.values()
+                ),
+                3,
+            )
+
+        # Segments whose files were closed are reopened to append to them.
+        self.test_storage.store_data_entities(
+            [self._create_entity("test_entity_6", datetimes[0], 10)]
+        )
+        self.assertEqual(
+            len(
+                self.test_storage.list_data_entities_in_data_entity_bucket(
+                    self._create_bucket_id(datetimes[0])
+                )
+            ),
+            2,
+        )
+
+    def test_replaced_mmap_closed_after_release(self):
+        """Tests that a segment's map is closed once it is replaced and its readers have released it."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        self.test_storage.store_data_entities(
+            [self._create_entity("test_entity_1", now, 10)]
+        )
+        segment = next(iter(self.test_storage.segments.values()))
+
+        with self.test_storage._read_data_entity_bucket_records(
+            self._create_bucket_id(now)
+        ) as (view, records):
+            self.assertEqual(len(records), 1)
+
+            # Growing the segment replaces its map, but the reader's map stays open until it is done.
+            self.test_storage.store_data_entities(
+                [self._create_entity("test_entity_2", now, 10)]
+            )
+            self.test_storage.list_data_entities_in_data_entity_bucket(
+                self._create_bucket_id(now)
+            )
+            self.assertFalse(view.closed)
+
+        self.assertTrue(view.closed)
+        self.assertFalse(segment.mapping.mmap.closed)
+
+    # Merge pending index changes often, so stores go through the sorted arrays.
+    @patch.object(_KeyIndex, "MAX_PENDING", 16)
+    def test_matches_sqlite_miner_storage(self):
+        """Tests that the same stores produce the same buckets and bucket contents as SqliteMinerStorage."""
+        sqlite_storage = SqliteMinerStorage(
+            "TestSegmentLogParityDb.sqlite", max_database_size_gb_hint=1
+        )
+        self.addCleanup(os.remove, sqlite_storage.database)
+        self.addCleanup(sqlite_storage.close)
+
+        rng = random.Random(0)
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        for batch in range(5):
+            entities = [
+                DataEntity(
+                    uri=f"test_entity_{rng.randrange(200)}",
+                    datetime=now - dt.timedelta(hours=rng.randrange(5)),
+                    source=rng.choice([DataSource.REDDIT, DataSource.X]),
+                    label=rng.choice([None, DataLabel(value="label_1")]),
+                    content=f"content_{rng.randrange(300)}".encode(),
+                    content_size_bytes=rng.randrange(1, 100),
+                )
+                for _ in range(100)
+            ]
+            self.test_storage.store_data_entities(entities)
+            sqlite_storage.store_data_entities(entities)
+
+        # The index rebuilt on startup must match the one maintained by the stores.
+        for reopen in (False, True):
+            if reopen:
+                self._reopen()
+
+            self.assertEqual(
+                self.test_storage.get_total_content_size_bytes(),
+                sqlite_storage.get_total_content_size_bytes(),
+            )
+            buckets = sorted(
+                self.test_storage.list_data_entity_buckets(), key=lambda b: b.json()
+            )
+            self.assertEqual(
+                buckets,
+                sorted(
+                    sqlite_storage.list_data_entity_buckets(), key=lambda b: b.json()
+                ),
+            )
+            for bucket in buckets:
+                self.assertEqual(
+                    self.test_storage.list_data_entities_in_data_entity_bucket(
+                        bucket.id
+                    ),
+                    sqlite_storage.list_data_entities_in_data_entity_bucket(bucket.id),
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,9 @@
 import contextlib
+import json
 import unittest
+from unittest.mock import patch
 import os
+import time
 
 from common import constants
 from common.data import (
@@ -15,9 +18,13 @@ from common.data import (
 )
 import datetime as dt
 import pytz
+import sqlite3
 
 from tests import utils
 
+from storage.miner import content_codec
+from storage.miner.content_codec import ContentCodec
+from storage.miner import sqlite_miner_storage
 from storage.miner.sqlite_miner_storage import SqliteMinerStorage
 
 
@@ -30,6 +37,7 @@ class TestSqliteMinerStorage(unittest.TestCase):
 
     def tearDown(self):
         # Clean up the test database.
+        self.test_storage.close()
         os.remove(self.test_storage.database)
 
     def test_instantiate_sqlite_miner_storage(self):
@@ -108,6 +116,52 @@ class TestSqliteMinerStorage(unittest.TestCase):
             size = cursor.fetchone()[0]
             self.assertEqual(size, 150)
 
+    def test_store_duplicate_content(self):
+        """Tests that entities with the same content as another uri are dropped, but updates to a uri are not."""
+        now = dt.datetime.now()
+        entity1 = DataEntity(
+            uri="test_entity_1",
+            datetime=now,
+            source=DataSource.REDDIT,
+            content=b"content_1",
+            content_size_bytes=10,
+        )
+        # Duplicates the content of entity1 within the same batch.
+        entity2 = DataEntity(
+            uri="test_entity_2",
+            datetime=now,
+            source=DataSource.REDDIT,
+            content=b"content_1",
+            content_size_bytes=10,
+        )
+        self.test_storage.store_data_entities([entity1, entity2])
+
+        # Duplicates the content of the already stored entity1.
+        entity3 = DataEntity(
+            uri="test_entity_3",
+            datetime=now,
+            source=DataSource.REDDIT,
+            content=b"content_1",
+            content_size_bytes=10,
+        )
+        entity4 = DataEntity(
+            uri="test_entity_4",
+            datetime=now,
+            source=DataSource.REDDIT,
+            content=b"content_4",
+            content_size_bytes=10,
+        )
+        # Storing entity1 again with the same content is an update rather than a duplicate.
+        self.test_storage.store_data_entities([entity3, entity4, entity1])
+
+        with contextlib.closing(self.test_storage._create_connection()) as connection:
+            cursor = connection.cursor()
+            cursor.execute("SELECT uri FROM DataEntity ORDER BY uri")
+            self.assertEqual(
+                [row["uri"] for row in cursor], ["test_entity_1", "test_entity_4"]
+            )
+        self.assertEqual(self.test_storage.get_total_content_size_bytes(), 20)
+
     # TODO Consider storing what we can and discarding the rest.
     def test_store_over_max_content_size_fail(self):
         """Tests that we except on attempts to store entities larger than maximum storage in one store call"""
@@ -166,6 +220,887 @@ class TestSqliteMinerStorage(unittest.TestCase):
 
             self.assertEqual(uris, ["test_entity_2", "test_entity_3"])
 
+    def test_auto_vacuum_incremental(self):
+        """Tests that new databases are created with incremental auto_vacuum."""
+        with contextlib.closing(self.test_storage._create_connection()) as connection:
+            self.assertEqual(connection.execute("PRAGMA auto_vacuum").fetchone()[0], 2)
+
+    def test_store_over_max_database_size_succeeds(self):
+        """Tests that we clear space when going over the maximum database size, even with little content."""
+        now = dt.datetime.now()
+        kb_200 = 200 * 1024
+        entities = [
+            DataEntity(
+                uri=f"test_entity_{i}",
+                datetime=now + dt.timedelta(hours=i),
+                source=DataSource.REDDIT,
+                content=os.urandom(kb_200),
+                content_size_bytes=kb_200,
+            )
+            for i in range(3)
+        ]
+
+        self.test_storage.store_data_entities(entities[:2])
+        database_size = self.test_storage.get_database_size_bytes()
+        self.assertGreater(database_size, 2 * kb_200)
+
+        # Only allow a little more than what is already stored.
+        self.test_storage.database_max_size_bytes = database_size + kb_200 // 2
+        self.test_storage.store_data_entities(entities[2:])
+
+        with contextlib.closing(self.test_storage._create_connection()) as connection:
+            cursor = connection.cursor()
+            cursor.execute("SELECT uri FROM DataEntity ORDER BY uri")
+            self.assertEqual(
+                [row["uri"] for row in cursor], ["test_entity_1", "test_entity_2"]
+            )
+            # The pages freed by clearing space were returned to the file system, then reused.
+            self.assertEqual(
+                connection.execute("PRAGMA freelist_count").fetchone()[0], 0
+            )
+        self.assertLessEqual(
+            self.test_storage.get_database_size_bytes(),
+            self.test_storage.database_max_size_bytes,
+        )
+
+    def test_database_size_includes_free_pages(self):
+        """Tests that the database size is the size of the file on disk, including pages not yet vacuumed."""
+        now = dt.datetime.now()
+        kb_200 = 200 * 1024
+        self.test_storage.store_data_entities(
+            [
+                DataEntity(
+                    uri=f"test_entity_{i}",
+                    datetime=now,
+                    source=DataSource.REDDIT,
+                    content=os.urandom(kb_200),
+                    content_size_bytes=kb_200,
+                )
+                for i in range(2)
+            ]
+        )
+        database_size = self.test_storage.get_database_size_bytes()
+        with self.test_storage.write_lock:
+            self.test_storage.write_connection.execute("PRAGMA wal_checkpoint")
+        self.assertEqual(database_size, os.path.getsize(self.test_storage.database))
+
+        with self.test_storage.write_lock, self.test_storage.write_connection:
+            self.test_storage.write_connection.execute(
+                "DELETE FROM DataEntity WHERE uri = 'test_entity_0'"
+            )
+        self.assertEqual(self.test_storage.get_database_size_bytes(), database_size)
+
+        self.test_storage._vacuum_free_pages()
+        self.assertLessEqual(
+            self.test_storage.get_database_size_bytes(), database_size - kb_200
+        )
+
+    def test_database_size_is_sampled(self):
+        """Tests that stores sample the database size rather than reading the page stats every time."""
+        now = dt.datetime.now()
+        with patch.object(
+            SqliteMinerStorage,
+            "_get_database_size_bytes",
+            wraps=self.test_storage._get_database_size_bytes,
+        ) as get_database_size_bytes:
+            for i in range(3):
+                self.test_storage.store_data_entities(
+                    [
+                        DataEntity(
+                            uri=f"test_entity_{i}",
+                            datetime=now,
+                            source=DataSource.REDDIT,
+                            content=bytes([i]) * 10,
+                            content_size_bytes=10,
+                        )
+                    ]
+                )
+            self.assertEqual(get_database_size_bytes.call_count, 1)
+
+            # Clearing space shrinks the database, so the next store samples it again.
+            self.test_storage.clear_content_from_oldest(10)
+            self.test_storage.store_data_entities(
+                [
+                    DataEntity(
+                        uri="test_entity_3",
+                        datetime=now,
+                        source=DataSource.REDDIT,
+                        content=bytes([3]) * 10,
+                        content_size_bytes=10,
+                    )
+                ]
+            )
+            self.assertEqual(get_database_size_bytes.call_count, 2)
+
+    def test_delete_expired_data_entities(self):
+        """Tests that DataEntities past the age limit are deleted in batches and their pages are reclaimed."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        old = now - dt.timedelta(days=constants.DATA_ENTITY_BUCKET_AGE_LIMIT_DAYS + 1)
+        kb_10 = 10 * 1024
+        entities = [
+            DataEntity(
+                uri=f"test_entity_{i}",
+                datetime=old if i else now,
+                source=DataSource.REDDIT,
+                content=os.urandom(kb_10),
+                content_size_bytes=kb_10,
+            )
+            for i in range(20)
+        ]
+        self.test_storage.store_data_entities(entities)
+        database_size = self.test_storage.get_database_size_bytes()
+        written_time_bucket_ids = []
+        self.test_storage.add_write_listener(written_time_bucket_ids.append)
+
+        with patch.object(SqliteMinerStorage, "DELETE_BATCH_SIZE", 3), patch.object(
+            SqliteMinerStorage, "VACUUM_BATCH_PAGES", 2
+        ):
+            self.assertEqual(
+                self.test_storage.delete_expired_data_entities(), 19 * kb_10
+            )
+
+        self.assertEqual(self.test_storage.get_total_content_size_bytes(), kb_10)
+        self.assertEqual(written_time_bucket_ids, [{TimeBucket.from_datetime(old).id}])
+        with contextlib.closing(self.test_storage._create_connection()) as connection:
+            cursor = connection.cursor()
+            cursor.execute("SELECT uri FROM DataEntity")
+            self.assertEqual([row["uri"] for row in cursor], ["test_entity_0"])
+            self.assertEqual(
+                connection.execute("PRAGMA freelist_count").fetchone()[0], 0
+            )
+        self.assertLess(os.path.getsize(self.test_storage.database), database_size)
+
+        # Nothing else is expired.
+        self.assertEqual(self.test_storage.delete_expired_data_entities(), 0)
+
+    def test_delete_expired_data_entities_with_open_reader(self):
+        """Tests that truncating the write-ahead log gives up rather than waiting on a reader's snapshot."""
+        old = dt.datetime.now(tz=dt.timezone.utc) - dt.timedelta(
+            days=constants.DATA_ENTITY_BUCKET_AGE_LIMIT_DAYS + 1
+        )
+        self.test_storage.store_data_entities(
+            [
+                DataEntity(
+                    uri=f"test_entity_{i}",
+                    datetime=old,
+                    source=DataSource.REDDIT,
+                    content=os.urandom(10 * 1024),
+                    content_size_bytes=10 * 1024,
+                )
+                for i in range(5)
+            ]
+        )
+
+        with contextlib.closing(self.test_storage._create_connection()) as reader:
+            reader.execute("BEGIN")
+            reader.execute("SELECT COUNT(*) FROM DataEntity").fetchone()
+
+            start = time.perf_counter()
+            self.assertEqual(
+                self.test_storage.delete_expired_data_entities(), 50 * 1024
+            )
+            self.assertLess(time.perf_counter() - start, 5)
+
+    def test_get_content_bytes_to_clear(self):
+        """Tests how much content is cleared for each limit."""
+        # Everything fits.
+        self.assertEqual(
+            SqliteMinerStorage.get_content_bytes_to_clear(
+                current_content_size=50,
+                added_content_size=10,
+                max_content_size=100,
+                current_database_size=500,
+                added_database_size=100,
+                max_database_size=1000,
+            ),
+            0,
+        )
+        # Over the content limit clears a tenth of it, or the added content if larger.
+        self.assertEqual(
+            SqliteMinerStorage.get_content_bytes_to_clear(
+                current_content_size=95,
+                added_content_size=20,
+                max_content_size=100,
+                current_database_size=500,
+                added_database_size=100,
+                max_database_size=1000,
+            ),
+            20,
+        )
+        # Over the database limit clears the content equivalent of a tenth of it.
+        self.assertEqual(
+            SqliteMinerStorage.get_content_bytes_to_clear(
+                current_content_size=50,
+                added_content_size=10,
+                max_content_size=100,
+                current_database_size=1000,
+                added_database_size=50,
+                max_database_size=1000,
+            ),
+            5,
+        )
+
+    def test_content_size_ledger(self):
+        """Tests that the content size ledger tracks stores, replacements and deletes."""
+        now = dt.datetime.now()
+        entity1 = DataEntity(
+            uri="test_entity_1",
+            datetime=now,
+            source=DataSource.REDDIT,
+            content=bytes(10),
+            content_size_bytes=10,
+        )
+        entity2 = DataEntity(
+            uri="test_entity_2",
+            datetime=now + dt.timedelta(hours=1),
+            source=DataSource.X,
+            content=bytes(20),
+            content_size_bytes=20,
+        )
+
+        self.test_storage.store_data_entities([entity1, entity2])
+        self.assertEqual(self.test_storage.get_total_content_size_bytes(), 30)
+
+        # Replacing an entity should only count the latest content.
+        entity1.content = bytes(50)
+        entity1.content_size_bytes = 50
+        self.test_storage.store_data_entities([entity1])
+        self.assertEqual(self.test_storage.get_total_content_size_bytes(), 70)
+
+        # Clearing the oldest entity should remove its content from the ledger.
+        self.test_storage.clear_content_from_oldest(50)
+        self.assertEqual(self.test_storage.get_total_content_size_bytes(), 20)
+
+        self.assertTrue(self.test_storage.rebuild_content_size_ledger())
+
+    def test_rebuild_content_size_ledger(self):
+        """Tests that an inconsistent content size ledger is detected and rebuilt."""
+        self.test_storage.store_data_entities(
+            [
+                DataEntity(
+                    uri="test_entity_1",
+                    datetime=dt.datetime.now(),
+                    source=DataSource.REDDIT,
+                    content=bytes(10),
+                    content_size_bytes=10,
+                )
+            ]
+        )
+
+        # Corrupt the ledger.
+        with contextlib.closing(self.test_storage._create_connection()) as connection:
+            connection.execute("UPDATE ContentSizeLedger SET totalBytes = 12345")
+            connection.commit()
+
+        self.assertFalse(self.test_storage.rebuild_content_size_ledger())
+        self.assertEqual(self.test_storage.get_total_content_size_bytes(), 10)
+        self.assertTrue(self.test_storage.rebuild_content_size_ledger())
+
+    def _read_bucket_summary(self):
+        with contextlib.closing(self.test_storage._create_connection()) as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                """SELECT timeBucketId, source, value, totalBytes, rowCount FROM BucketSummary
+                JOIN Label USING (labelId) ORDER BY timeBucketId, value"""
+            )
+            return [tuple(row) for row in cursor]
+
+    def test_bucket_summary(self):
+        """Tests that the bucket summary tracks stores, replacements and deletes."""
+        now = dt.datetime.now()
+        later = now + dt.timedelta(hours=1)
+        entity1 = DataEntity(
+            uri="test_entity_1",
+            datetime=now,
+            source=DataSource.REDDIT,
+            label=DataLabel(value="label_1"),
+            content=bytes(10),
+            content_size_bytes=10,
+        )
+        entity2 = DataEntity(
+            uri="test_entity_2",
+            datetime=now,
+            source=DataSource.REDDIT,
+            label=DataLabel(value="label_1"),
+            content=bytes(20),
+            content_size_bytes=20,
+        )
+        self.test_storage.store_data_entities([entity1, entity2])
+
+        now_id = TimeBucket.from_datetime(now).id
+        later_id = TimeBucket.from_datetime(later).id
+        self.assertEqual(
+            self._read_bucket_summary(),
+            [(now_id, DataSource.REDDIT, "label_1", 30, 2)],
+        )
+
+        # Move entity2 to a later bucket by replacing it.
+        entity2.datetime = later
+        self.test_storage.store_data_entities([entity2])
+        self.assertEqual(
+            self._read_bucket_summary(),
+            [
+                (now_id, DataSource.REDDIT, "label_1", 10, 1),
+                (later_id, DataSource.REDDIT, "label_1", 20, 1),
+            ],
+        )
+
+        # Clearing the oldest bucket should remove it from the summary.
+        self.test_storage.clear_content_from_oldest(10)
+        self.assertEqual(
+            self._read_bucket_summary(),
+            [(later_id, DataSource.REDDIT, "label_1", 20, 1)],
+        )
+
+        self.assertTrue(self.test_storage.rebuild_bucket_summary())
+
+    def test_bucket_summary_built_for_existing_database(self):
+        """Tests that the bucket summary is built when opening a database that predates it."""
+        now = dt.datetime.now()
+        self.test_storage.store_data_entities(
+            [
+                DataEntity(
+                    uri="test_entity_1",
+                    datetime=now,
+                    source=DataSource.X,
+                    content=bytes(10),
+                    content_size_bytes=10,
+                )
+            ]
+        )
+
+        with contextlib.closing(self.test_storage._create_connection()) as connection:
+            connection.execute("DROP TABLE BucketSummary")
+            connection.commit()
+
+        self.test_storage.close()
+        self.test_storage = SqliteMinerStorage(
+            self.test_storage.database, max_database_size_gb_hint=1
+        )
+        self.assertEqual(
+            self._read_bucket_summary(),
+            [(TimeBucket.from_datetime(now).id, DataSource.X, "NULL", 10, 1)],
+        )
+
+    def test_rebuild_bucket_summary(self):
+        """Tests that an inconsistent bucket summary is detected and rebuilt."""
+        now = dt.datetime.now()
+        self.test_storage.store_data_entities(
+            [
+                DataEntity(
+                    uri="test_entity_1",
+                    datetime=now,
+                    source=DataSource.X,
+                    content=bytes(10),
+                    content_size_bytes=10,
+                )
+            ]
+        )
+
+        # Corrupt the summary.
+        with contextlib.closing(self.test_storage._create_connection()) as connection:
+            connection.execute("UPDATE BucketSummary SET totalBytes = 12345")
+            connection.commit()
+
+        self.assertFalse(self.test_storage.rebuild_bucket_summary())
+        self.assertEqual(
+            self._read_bucket_summary(),
+            [(TimeBucket.from_datetime(now).id, DataSource.X, "NULL", 10, 1)],
+        )
+        self.assertTrue(self.test_storage.rebuild_bucket_summary())
+
+    def test_uses_wal_journal_mode(self):
+        """Tests that the database is configured for write-ahead logging."""
+        with contextlib.closing(self.test_storage._create_connection()) as connection:
+            journal_mode = connection.execute("PRAGMA journal_mode").fetchone()[0]
+            self.assertEqual(journal_mode, "wal")
+
+    def test_read_during_uncommitted_write(self):
+        """Tests that reads are not blocked by a write transaction in progress."""
+        now = dt.datetime.now()
+        entity = DataEntity(
+            uri="test_entity_1",
+            datetime=now,
+            source=DataSource.REDDIT,
+            content=bytes(10),
+            content_size_bytes=10,
+        )
+        self.test_storage.store_data_entities([entity])
+
+        # Hold an open write transaction on another connection.
+        with contextlib.closing(self.test_storage._create_connection()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute("DELETE FROM DataEntity")
+
+            data_entities = self.test_storage.list_data_entities_in_data_entity_bucket(
+                DataEntityBucketId(
+                    time_bucket=TimeBucket.from_datetime(now), source=DataSource.REDDIT
+                )
+            )
+            self.assertEqual(len(data_entities), 1)
+            connection.rollback()
+
+    def test_clear_content_from_oldest_clears_whole_time_buckets(self):
+        """Tests that clearing content removes the oldest time buckets until enough content is cleared."""
+        now = dt.datetime.now()
+        entities = [
+            DataEntity(
+                uri=f"test_entity_{hour}_{i}",
+                datetime=now + dt.timedelta(hours=hour),
+                source=DataSource.REDDIT,
+                content=f"content_{hour}_{i}".encode(),
+                content_size_bytes=10,
+            )
+            for hour in range(3)
+            for i in range(3)
+        ]
+        self.test_storage.store_data_entities(entities)
+
+        # Clearing just over one time bucket of content should clear the two oldest time buckets.
+        # Use a small batch size to ensure every batch is deleted.
+        with patch.object(SqliteMinerStorage, "DELETE_BATCH_SIZE", 2):
+            self.test_storage.clear_content_from_oldest(31)
+
+        with contextlib.closing(self.test_storage._create_connection()) as connection:
+            cursor = connection.cursor()
+            cursor.execute("SELECT DISTINCT timeBucketId FROM DataEntity")
+            time_bucket_ids = [row[0] for row in cursor]
+
+        self.assertEqual(
+            time_bucket_ids,
+            [TimeBucket.from_datetime(now + dt.timedelta(hours=2)).id],
+        )
+        self.assertEqual(self.test_storage.get_total_content_size_bytes(), 30)
+
+    def test_store_entities_compressed(self):
+        """Tests that content is compressed at rest and decompressed on read."""
+        self.test_storage.close()
+        self.test_storage = SqliteMinerStorage(
+            self.test_storage.database,
+            max_database_size_gb_hint=1,
+            content_codec=ContentCodec.ZLIB,
+        )
+
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        content = b'{"body": "' + b"compressible " * 100 + b'"}'
+        entity = DataEntity(
+            uri="test_entity_1",
+            datetime=now,
+            source=DataSource.REDDIT,
+            label=DataLabel(value="label_1"),
+            content=content,
+            content_size_bytes=len(content),
+        )
+        self.test_storage.store_data_entities([entity])
+
+        # Confirm the content is stored compressed, but the uncompressed size is reported.
+        with contextlib.closing(self.test_storage._create_connection()) as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                "SELECT content, contentSizeBytes, contentCodec FROM DataEntity"
+            )
+            row = cursor.fetchone()
+            self.assertLess(len(row["content"]), len(content))
+            self.assertEqual(row["contentSizeBytes"], len(content))
+            self.assertEqual(row["contentCodec"], ContentCodec.ZLIB)
+
+        data_entities = self.test_storage.list_data_entities_in_data_entity_bucket(
+            DataEntityBucketId(
+                time_bucket=TimeBucket.from_datetime(now),
+                source=DataSource.REDDIT,
+                label=DataLabel(value="label_1"),
+            )
+        )
+        self.assertEqual(data_entities, [entity])
+
+    def test_zstd_unavailable(self):
+        """Tests that ZSTD content cannot be configured or read without zstandard installed."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        entity = DataEntity(
+            uri="test_entity_1",
+            datetime=now,
+            source=DataSource.REDDIT,
+            label=DataLabel(value="label_1"),
+            content=b"content",
+            content_size_bytes=7,
+        )
+        self.test_storage.store_data_entities([entity])
+
+        # Mark the row as ZSTD encoded, as if it had been written by a miner with zstandard installed.
+        with self.test_storage.write_lock:
+            self.test_storage.write_connection.execute(
+                "UPDATE DataEntity SET contentCodec = ?", [ContentCodec.ZSTD]
+            )
+            self.test_storage.write_connection.commit()
+
+        with patch.object(content_codec, "zstandard", None):
+            with self.assertRaisesRegex(ImportError, "ZSTD.*zstandard"):
+                SqliteMinerStorage(
+                    self.test_storage.database,
+                    max_database_size_gb_hint=1,
+                    content_codec=ContentCodec.ZSTD,
+                )
+
+            with self.assertRaisesRegex(ImportError, "ZSTD.*zstandard"):
+                self.test_storage.list_data_entities_in_data_entity_bucket(
+                    DataEntityBucketId(
+                        time_bucket=TimeBucket.from_datetime(now),
+                        source=DataSource.REDDIT,
+                        label=DataLabel(value="label_1"),
+                    )
+                )
+
+    def test_store_datetime_as_epoch_micros(self):
+        """Tests that datetimes are stored as integer microseconds since the epoch and read back in UTC."""
+        datetime = dt.datetime(
+            2023, 12, 12, 2, 30, 0, 1001, tzinfo=pytz.timezone("America/Los_Angeles")
+        )
+        entity = DataEntity(
+            uri="test_entity_1",
+            datetime=datetime,
+            source=DataSource.REDDIT,
+            content=bytes(10),
+            content_size_bytes=10,
+        )
+        self.test_storage.store_data_entities([entity])
+
+        with contextlib.closing(self.test_storage._create_connection()) as connection:
+            cursor = connection.cursor()
+            cursor.execute("SELECT datetime FROM DataEntity")
+            self.assertEqual(
+                cursor.fetchone()[0],
+                int(datetime.timestamp()) * 1_000_000 + datetime.microsecond,
+            )
+
+        data_entities = self.test_storage.list_data_entities_in_data_entity_bucket(
+            DataEntityBucketId(
+                time_bucket=TimeBucket.from_datetime(datetime),
+                source=DataSource.REDDIT,
+            )
+        )
+        self.assertEqual(data_entities, [entity])
+        self.assertEqual(data_entities[0].datetime.tzinfo, dt.timezone.utc)
+
+    def test_iter_data_entity_rows_round_trip(self):
+        """Tests that rows iterated from one storage can be stored into another unchanged."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        entities = [
+            DataEntity(
+                uri=f"test_entity_{i}",
+                datetime=now - dt.timedelta(hours=i % 3),
+                source=DataSource.REDDIT if i % 2 else DataSource.X,
+                label=DataLabel(value=f"label_{i % 4}") if i % 5 else None,
+                content=f"content_{i}".encode(),
+                content_size_bytes=10 + i,
+            )
+            for i in range(20)
+        ]
+        self.test_storage.store_data_entities(entities)
+
+        batches = list(self.test_storage.iter_data_entity_rows(batch_size=2))
+        self.assertEqual(sum(len(batch) for batch in batches), len(entities))
+        for batch in batches:
+            self.assertLessEqual(len(batch), 2)
+            # A batch never spans more than one time bucket and source.
+            self.assertEqual(
+                len(
+                    {
+                        (
+                            sqlite_miner_storage.epoch_micros_to_time_bucket_id(
+                                row.datetime
+                            ),
+                            row.source,
+                        )
+                        for row in batch
+                    }
+                ),
+                1,
+            )
+
+        copy_storage = SqliteMinerStorage(
+            "TestCopyDb.sqlite",
+            max_database_size_gb_hint=1,
+            content_codec=ContentCodec.ZLIB,
+        )
+        self.addCleanup(os.remove, copy_storage.database)
+        self.addCleanup(copy_storage.close)
+        for batch in batches:
+            copy_storage.store_data_entity_rows(batch)
+
+        self.assertEqual(
+            copy_storage.list_data_entity_buckets(),
+            self.test_storage.list_data_entity_buckets(),
+        )
+        for bucket in self.test_storage.list_data_entity_buckets():
+            self.assertEqual(
+                copy_storage.list_data_entities_in_data_entity_bucket(bucket.id),
+                self.test_storage.list_data_entities_in_data_entity_bucket(bucket.id),
+            )
+
+    def _create_legacy_database(self, rows: list):
+        """Replaces the test database with one in the original schema, holding the provided rows."""
+        self.test_storage.close()
+        os.remove(self.test_storage.database)
+
+        with contextlib.closing(
+            sqlite3.connect(self.test_storage.database)
+        ) as connection:
+            connection.execute(
+                """CREATE TABLE DataEntity (
+                    uri                 TEXT            PRIMARY KEY,
+                    datetime            TIMESTAMP(6)    NOT NULL,
+                    timeBucketId        INTEGER         NOT NULL,
+                    source              INTEGER         NOT NULL,
+                    label               CHAR(32)                ,
+                    content             BLOB            NOT NULL,
+                    contentSizeBytes    INTEGER         NOT NULL
+                    ) WITHOUT ROWID"""
+            )
+            connection.execute(
+                """CREATE INDEX data_entity_bucket_index2
+                    ON DataEntity (timeBucketId, source, label, contentSizeBytes)"""
+            )
+            connection.executemany(
+                "INSERT INTO DataEntity VALUES (?,?,?,?,?,?,?)", rows
+            )
+            connection.commit()
+
+    def test_migrate_legacy_datetimes(self):
+        """Tests that text datetimes in existing databases are migrated to epoch microseconds."""
+        datetime = dt.datetime(2023, 12, 12, 1, 30, 0, 1000, tzinfo=dt.timezone.utc)
+        self._create_legacy_database(
+            [
+                [
+                    f"test_entity_{i}",
+                    str(datetime + dt.timedelta(seconds=i)),
+                    TimeBucket.from_datetime(datetime).id,
+                    DataSource.REDDIT,
+                    "label_1",
+                    bytes([i]) * 10,
+                    10,
+                ]
+                for i in range(5)
+            ]
+        )
+
+        with patch.object(SqliteMinerStorage, "DATETIME_MIGRATION_BATCH_SIZE", 2):
+            self.test_storage = SqliteMinerStorage(
+                self.test_storage.database, max_database_size_gb_hint=1
+            )
+            self.test_storage.migration_thread.join()
+
+        with contextlib.closing(self.test_storage._create_connection()) as connection:
+            cursor = connection.cursor()
+            cursor.execute("SELECT DISTINCT typeof(datetime) FROM DataEntity")
+            self.assertEqual([row[0] for row in cursor], ["integer"])
+            cursor.execute("PRAGMA user_version")
+            self.assertEqual(
+                cursor.fetchone()[0], SqliteMinerStorage.LABEL_ID_USER_VERSION
+            )
+
+        data_entities = self.test_storage.list_data_entities_in_data_entity_bucket(
+            DataEntityBucketId(
+                time_bucket=TimeBucket.from_datetime(datetime),
+                source=DataSource.REDDIT,
+                label=DataLabel(value="label_1"),
+            )
+        )
+        self.assertEqual(
+            [data_entity.datetime for data_entity in data_entities],
+            [datetime + dt.timedelta(seconds=i) for i in range(5)],
+        )
+
+    def test_migrate_legacy_content_hashes(self):
+        """Tests that legacy rows are hashed so that duplicates of them are detected."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        time_bucket_id = TimeBucket.from_datetime(now).id
+        self._create_legacy_database(
+            [
+                [
+                    f"test_entity_{i}",
+                    str(now),
+                    time_bucket_id,
+                    DataSource.REDDIT,
+                    "label_1",
+                    content,
+                    10,
+                ]
+                for i, content in enumerate([b"content_1", b"content_1", b"content_2"])
+            ]
+        )
+
+        with patch.object(SqliteMinerStorage, "CONTENT_HASH_MIGRATION_BATCH_SIZE", 2):
+            self.test_storage = SqliteMinerStorage(
+                self.test_storage.database, max_database_size_gb_hint=1
+            )
+            self.test_storage.migration_thread.join()
+
+        # A duplicate of a legacy row is not stored.
+        self.test_storage.store_data_entities(
+            [
+                DataEntity(
+                    uri="test_entity_3",
+                    datetime=now,
+                    source=DataSource.REDDIT,
+                    label=DataLabel(value="label_1"),
+                    content=b"content_2",
+                    content_size_bytes=10,
+                )
+            ]
+        )
+
+        # The legacy duplicate is deleted, keeping the first uri stored with the content.
+        data_entities = self.test_storage.list_data_entities_in_data_entity_bucket(
+            DataEntityBucketId(
+                time_bucket=TimeBucket(id=time_bucket_id),
+                source=DataSource.REDDIT,
+                label=DataLabel(value="label_1"),
+            )
+        )
+        self.assertEqual(
+            [data_entity.uri for data_entity in data_entities],
+            ["test_entity_0", "test_entity_2"],
+        )
+        self.assertEqual(self.test_storage.get_total_content_size_bytes(), 20)
+
+    def test_migrate_labels(self):
+        """Tests that label values in existing databases are replaced by ids into the Label table in the background."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        time_bucket_id = TimeBucket.from_datetime(now).id
+        self._create_legacy_database(
+            [
+                [
+                    f"test_entity_{i}",
+                    str(now),
+                    time_bucket_id,
+                    DataSource.REDDIT,
+                    label,
+                    bytes([i]) * 10,
+                    10,
+                ]
+                for i, label in enumerate(["label_1", "NULL", "label_1", "label_2"])
+            ]
+        )
+
+        with patch.object(SqliteMinerStorage, "LABEL_MIGRATION_BATCH_SIZE", 3):
+            self.test_storage = SqliteMinerStorage(
+                self.test_storage.database, max_database_size_gb_hint=1
+            )
+            self.test_storage.migration_thread.join()
+
+        with contextlib.closing(self.test_storage._create_connection()) as connection:
+            cursor = connection.cursor()
+            cursor.execute("PRAGMA table_info(DataEntity)")
+            columns = [row["name"] for row in cursor]
+            self.assertIn("labelId", columns)
+            self.assertNotIn("label", columns)
+            # The legacy column is left in place under a new name rather than rewriting the table to drop it.
+            self.assertIn("legacyLabel", columns)
+            cursor.execute("SELECT value FROM Label ORDER BY value")
+            self.assertEqual([row[0] for row in cursor], ["NULL", "label_1", "label_2"])
+            # The legacy values are cleared as rows are migrated.
+            cursor.execute(
+                "SELECT COUNT(*) FROM DataEntity WHERE legacyLabel IS NOT NULL"
+            )
+            self.assertEqual(cursor.fetchone()[0], 0)
+            cursor.execute("PRAGMA user_version")
+            self.assertEqual(
+                cursor.fetchone()[0], SqliteMinerStorage.LABEL_ID_USER_VERSION
+            )
+
+        self.assertEqual(
+            self._read_bucket_summary(),
+            [
+                (time_bucket_id, DataSource.REDDIT, "NULL", 10, 1),
+                (time_bucket_id, DataSource.REDDIT, "label_1", 20, 2),
+                (time_bucket_id, DataSource.REDDIT, "label_2", 10, 1),
+            ],
+        )
+        data_entities = self.test_storage.list_data_entities_in_data_entity_bucket(
+            DataEntityBucketId(
+                time_bucket=TimeBucket(id=time_bucket_id),
+                source=DataSource.REDDIT,
+                label=DataLabel(value="label_1"),
+            )
+        )
+        self.assertEqual(
+            [data_entity.uri for data_entity in data_entities],
+            ["test_entity_0", "test_entity_2"],
+        )
+
+        # New labels are interned alongside the migrated ones.
+        self.test_storage.store_data_entities(
+            [
+                DataEntity(
+                    uri="test_entity_4",
+                    datetime=now,
+                    source=DataSource.REDDIT,
+                    label=DataLabel(value="label_3"),
+                    content=bytes([4]) * 10,
+                    content_size_bytes=10,
+                )
+            ]
+        )
+        self.assertEqual(len(self.test_storage.list_data_entity_buckets()), 4)
+
+        # Reopening does not migrate again.
+        self.test_storage.close()
+        self.test_storage = SqliteMinerStorage(
+            self.test_storage.database, max_database_size_gb_hint=1
+        )
+        self.assertIsNone(self.test_storage.migration_thread)
+        self.assertEqual(len(self.test_storage.list_data_entity_buckets()), 4)
+
+    def test_migrate_labels_clears_retired_labels(self):
+        """Tests that legacyLabel is cleared from rows that already have a label id."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        time_bucket_id = TimeBucket.from_datetime(now).id
+        self._create_legacy_database(
+            [
+                [
+                    f"test_entity_{i}",
+                    str(now),
+                    time_bucket_id,
+                    DataSource.REDDIT,
+                    "label_1",
+                    bytes([i]) * 10,
+                    10,
+                ]
+                for i in range(3)
+            ]
+        )
+        self.test_storage = SqliteMinerStorage(
+            self.test_storage.database, max_database_size_gb_hint=1
+        )
+        self.test_storage.migration_thread.join()
+        self.test_storage.close()
+
+        # Restore the legacy values, which the label migration used to leave in place when it ran on startup.
+        with contextlib.closing(
+            sqlite3.connect(self.test_storage.database)
+        ) as connection:
+            connection.execute("UPDATE DataEntity SET legacyLabel = 'label_1'")
+            connection.execute(
+                f"PRAGMA user_version = {SqliteMinerStorage.CONTENT_HASH_USER_VERSION}"
+            )
+            connection.commit()
+
+        self.test_storage = SqliteMinerStorage(
+            self.test_storage.database, max_database_size_gb_hint=1
+        )
+        self.test_storage.migration_thread.join()
+
+        with contextlib.closing(self.test_storage._create_connection()) as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                "SELECT COUNT(*) FROM DataEntity WHERE legacyLabel IS NOT NULL"
+            )
+            self.assertEqual(cursor.fetchone()[0], 0)
+        self.assertEqual(
+            self._read_bucket_summary(),
+            [(time_bucket_id, DataSource.REDDIT, "label_1", 30, 3)],
+        )
+
     def test_get_compressed_index(self):
         """Tests that we can get the compressed miner index from storage."""
         now = dt.datetime.now()
@@ -477,6 +1412,99 @@ class TestSqliteMinerStorage(unittest.TestCase):
         # Confirm we get back the expected data entities.
         self.assertEqual(data_entities, [bucket2_entity1, bucket2_entity2])
 
+    def test_get_serialized_data_entities_in_data_entity_bucket(self):
+        """Tests that serialized bucket reads match the DataEntities of the bucket."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        self.test_storage.store_data_entities(
+            [
+                DataEntity(
+                    uri="test_entity_1",
+                    datetime=now,
+                    source=DataSource.X,
+                    label=DataLabel(value="#bittensor"),
+                    content='{"text": "\u00e9"}'.encode(),
+                    content_size_bytes=10,
+                ),
+                DataEntity(
+                    uri="test_entity_2",
+                    datetime=now + dt.timedelta(microseconds=1),
+                    source=DataSource.X,
+                    label=DataLabel(value="#bittensor"),
+                    content=b"content_2",
+                    content_size_bytes=20,
+                ),
+                DataEntity(
+                    uri="test_entity_3",
+                    datetime=now,
+                    source=DataSource.X,
+                    content=b"content_3",
+                    content_size_bytes=30,
+                ),
+            ]
+        )
+
+        for label in [DataLabel(value="#bittensor"), None, DataLabel(value="unknown")]:
+            bucket_id = DataEntityBucketId(
+                time_bucket=TimeBucket.from_datetime(now),
+                source=DataSource.X,
+                label=label,
+            )
+            data_entities = self.test_storage.list_data_entities_in_data_entity_bucket(
+                bucket_id
+            )
+
+            serialized_data_entities = (
+                self.test_storage.get_serialized_data_entities_in_data_entity_bucket(
+                    bucket_id
+                )
+            )
+
+            self.assertEqual(
+                [
+                    DataEntity.parse_obj(data_entity)
+                    for data_entity in json.loads(serialized_data_entities.serialized)
+                ],
+                data_entities,
+            )
+            self.assertEqual(serialized_data_entities.count, len(data_entities))
+            self.assertEqual(
+                serialized_data_entities.content_size_bytes,
+                sum(data_entity.content_size_bytes for data_entity in data_entities),
+            )
+
+    @patch.object(constants, "DATA_ENTITY_BUCKET_SIZE_LIMIT_BYTES", 50)
+    def test_list_entities_in_data_entity_bucket_over_size_limit(self):
+        """Tests that bucket reads stop at the size limit and always return the same entities."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        entities = [
+            DataEntity(
+                uri=f"test_entity_{i}",
+                datetime=now,
+                source=DataSource.REDDIT,
+                label=DataLabel(value="label_1"),
+                content=f"content_{i}".encode(),
+                content_size_bytes=20,
+            )
+            for i in reversed(range(5))
+        ]
+        self.test_storage.store_data_entities(entities)
+
+        bucket_id = DataEntityBucketId(
+            time_bucket=TimeBucket.from_datetime(now),
+            source=DataSource.REDDIT,
+            label=DataLabel(value="label_1"),
+        )
+
+        # Only the first entities by uri that fit within the limit are returned.
+        for _ in range(2):
+            data_entities = self.test_storage.list_data_entities_in_data_entity_bucket(
+                bucket_id
+            )
+            self.assertEqual(
+                [data_entity.uri for data_entity in data_entities],
+                ["test_entity_0", "test_entity_1"],
+            )
+
     def test_list_data_entity_buckets(self):
         """Tests that we can list the data entity buckets from storage."""
         now = dt.datetime.now()
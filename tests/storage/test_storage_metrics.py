@@ -0,0 +1,177 @@
+import datetime as dt
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import Mock
+
+from common import constants
+from common.data import (
+    DataEntity,
+    DataEntityBucketId,
+    DataLabel,
+    DataSource,
+    TimeBucket,
+)
+from storage.miner.sqlite_miner_storage import (
+    DataEntityRow,
+    SqliteMinerStorage,
+    datetime_to_epoch_micros,
+)
+from storage.storage_metrics import (
+    LATENCY_BUCKET_BOUNDS,
+    MINER_STORAGE_OPERATIONS,
+    LatencyHistogram,
+    StorageMetrics,
+)
+
+
+class TestLatencyHistogram(unittest.TestCase):
+    def test_percentile(self):
+        """Tests that percentiles are bounded by the bucket holding the ranked latency."""
+        histogram = LatencyHistogram()
+        for _ in range(98):
+            histogram.record(0.00005)
+        histogram.record(0.05)
+        histogram.record(1000)
+
+        self.assertEqual(histogram.count, 100)
+        self.assertEqual(histogram.percentile(50), LATENCY_BUCKET_BOUNDS[0])
+        self.assertGreaterEqual(histogram.percentile(99), 0.05)
+        self.assertLess(histogram.percentile(99), 0.1)
+        # Latencies above every bound report the max.
+        self.assertEqual(histogram.percentile(100), 1000)
+
+    def test_percentile_empty(self):
+        self.assertEqual(LatencyHistogram().percentile(99), 0)
+
+
+class TestStorageMetrics(unittest.TestCase):
+    def setUp(self):
+        self.test_storage = SqliteMinerStorage(
+            "TestStorageMetricsDb.sqlite", max_database_size_gb_hint=1
+        )
+        self.addCleanup(os.remove, self.test_storage.database)
+        self.addCleanup(self.test_storage.close)
+        self.metrics = StorageMetrics("miner_storage")
+        self.metrics.instrument(self.test_storage, MINER_STORAGE_OPERATIONS)
+
+    def test_records_calls_rows_and_bytes(self):
+        """Tests that calls through an instrumented storage record their rows and bytes."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        self.test_storage.store_data_entities(
+            [
+                DataEntity(
+                    uri=f"test_entity_{i}",
+                    datetime=now,
+                    source=DataSource.REDDIT,
+                    label=DataLabel(value="label_1"),
+                    content=f"content_{i}".encode(),
+                    content_size_bytes=10,
+                )
+                for i in range(3)
+            ]
+        )
+        self.test_storage.list_data_entities_in_data_entity_bucket(
+            DataEntityBucketId(
+                time_bucket=TimeBucket.from_datetime(now),
+                source=DataSource.REDDIT,
+                label=DataLabel(value="label_1"),
+            )
+        )
+        self.test_storage.get_compressed_index()
+
+        metrics = self.metrics.get_metrics()
+        self.assertEqual(metrics["store_data_entities"].calls, 1)
+        self.assertEqual(metrics["store_data_entities"].rows, 3)
+        self.assertEqual(metrics["store_data_entities"].bytes, 30)
+        # SqliteMinerStorage stores DataEntities through store_data_entity_rows, which is only recorded once.
+        self.assertNotIn("store_data_entity_rows", metrics)
+        self.assertEqual(metrics["list_data_entities_in_data_entity_bucket"].rows, 3)
+        self.assertEqual(metrics["get_compressed_index"].rows, 1)
+        self.assertEqual(metrics["get_compressed_index"].bytes, 30)
+        self.assertGreater(metrics["store_data_entities"].max_seconds, 0)
+        self.assertNotIn("list_data_entity_buckets", metrics)
+
+    def test_records_direct_nested_operation(self):
+        """Tests that an operation the storage also calls internally is recorded when called directly."""
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        self.test_storage.store_data_entity_rows(
+            [
+                DataEntityRow(
+                    uri="test_entity_1",
+                    datetime=datetime_to_epoch_micros(now),
+                    source=DataSource.REDDIT,
+                    label=None,
+                    content=b"content_1",
+                    content_size_bytes=10,
+                )
+            ]
+        )
+
+        metrics = self.metrics.get_metrics()
+        self.assertEqual(metrics["store_data_entity_rows"].calls, 1)
+        self.assertEqual(metrics["store_data_entity_rows"].bytes, 10)
+        self.assertNotIn("store_data_entities", metrics)
+
+    def test_records_delete_expired_data_entities(self):
+        """Tests that deleting expired DataEntities records the content bytes cleared."""
+        expired = dt.datetime.now(tz=dt.timezone.utc) - dt.timedelta(
+            days=constants.DATA_ENTITY_BUCKET_AGE_LIMIT_DAYS + 1
+        )
+        self.test_storage.store_data_entities(
+            [
+                DataEntity(
+                    uri="test_entity_1",
+                    datetime=expired,
+                    source=DataSource.REDDIT,
+                    content=b"content_1",
+                    content_size_bytes=10,
+                )
+            ]
+        )
+        self.test_storage.delete_expired_data_entities()
+
+        metrics = self.metrics.get_metrics()["delete_expired_data_entities"]
+        self.assertEqual(metrics.calls, 1)
+        self.assertEqual(metrics.rows, 0)
+        self.assertEqual(metrics.bytes, 10)
+
+    def test_records_errors(self):
+        """Tests that a failing call is recorded as an error and still raises."""
+        self.test_storage.list_data_entity_buckets = Mock(side_effect=ValueError())
+        self.metrics.instrument(
+            self.test_storage,
+            {
+                "list_data_entity_buckets": MINER_STORAGE_OPERATIONS[
+                    "list_data_entity_buckets"
+                ]
+            },
+        )
+
+        with self.assertRaises(ValueError):
+            self.test_storage.list_data_entity_buckets()
+
+        metrics = self.metrics.get_metrics()["list_data_entity_buckets"]
+        self.assertEqual(metrics.calls, 1)
+        self.assertEqual(metrics.errors, 1)
+
+    def test_dump_to_file(self):
+        """Tests that each dump appends a json line."""
+        self.test_storage.get_compressed_index()
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "metrics.jsonl")
+            self.metrics.dump_to_file(path)
+            self.metrics.dump_to_file(path)
+
+            with open(path) as file:
+                lines = [json.loads(line) for line in file]
+
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0]["storage"], "miner_storage")
+        self.assertEqual(lines[0]["operations"]["get_compressed_index"]["calls"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+import datetime as dt
+import unittest
+
+from common.data import (
+    CompressedEntityBucket,
+    CompressedMinerIndex,
+    DataEntityBucket,
+    DataEntityBucketId,
+    DataLabel,
+    DataSource,
+    MinerIndex,
+    TimeBucket,
+)
+from storage.validator.numpy_validator_storage import (
+    NumpyValidatorStorage,
+    pack_bucket_keys,
+    unpack_bucket_keys,
+)
+from tests.storage.validator import test_sqlite_memory_validator_storage
+import numpy as np
+
+
+class TestNumpyValidatorStorage(
+    test_sqlite_memory_validator_storage.TestSqliteMemoryValidatorStorage
+):
+    """Runs the SqliteMemoryValidatorStorage tests against the NumpyValidatorStorage."""
+
+    def setUp(self):
+        self.test_storage = NumpyValidatorStorage()
+
+    def test_upsert_miner(self):
+        """Tests that we can store a newly encountered miner."""
+        miner_id = self.test_storage._upsert_miner(
+            "test_hotkey", dt.datetime.utcnow(), credibility=1.0
+        )
+        self.assertEqual(miner_id, 1)
+
+        # Check inserting the same miner again returns the same id.
+        next_id = self.test_storage._upsert_miner(
+            "test_hotkey", dt.datetime.utcnow(), credibility=0.5
+        )
+        self.assertEqual(next_id, miner_id)
+        self.assertEqual(self.test_storage.miners["test_hotkey"].credibility, 0.5)
+
+        # Finally, insert a new miner and make sure it has a new id.
+        other_id = self.test_storage._upsert_miner(
+            "other_hotkey", dt.datetime.utcnow(), credibility=0.5
+        )
+        self.assertNotEqual(other_id, miner_id)
+
+    def test_bucket_totals_maintained(self):
+        """Tests that the bucket totals match the miner indexes after upserts, credibility changes and deletes."""
+        now = dt.datetime.utcnow()
+
+        def create_index(hotkey: str, sizes: list) -> MinerIndex:
+            return MinerIndex(
+                hotkey=hotkey,
+                data_entity_buckets=[
+                    DataEntityBucket(
+                        id=DataEntityBucketId(
+                            time_bucket=TimeBucket.from_datetime(now),
+                            source=DataSource.REDDIT,
+                            label=DataLabel(value=f"label_{i}"),
+                        ),
+                        size_bytes=size,
+                    )
+                    for i, size in enumerate(sizes)
+                ],
+            )
+
+        self.test_storage.upsert_miner_index(create_index("hotkey1", [10, 20]), 1)
+        self.test_storage.upsert_miner_index(create_index("hotkey2", [30, 40, 50]), 0.5)
+        self.test_storage.upsert_miner_index(create_index("hotkey1", [60]), 0.25)
+        self.test_storage.delete_miner("hotkey2")
+
+        served = self.test_storage.bucket_counts > 0
+        self.assertEqual(self.test_storage.bucket_counts[served].tolist(), [1])
+        self.assertEqual(self.test_storage.bucket_totals[served].tolist(), [15.0])
+        # Buckets no miner serves have been reset or compacted away.
+        self.assertTrue((self.test_storage.bucket_totals[~served] == 0).all())
+
+        scored_index = self.test_storage.read_miner_index("hotkey1")
+        self.assertEqual(
+            [
+                (bucket.label, bucket.scorable_bytes)
+                for bucket in scored_index.scorable_data_entity_buckets
+            ],
+            [("label_0", 60)],
+        )
+
+    @unittest.skip("Counts writes with sqlite triggers.")
+    def test_upsert_miner_index_writes_only_diff(self):
+        pass
+
+    def test_pack_bucket_keys(self):
+        """Tests that packed keys round trip and sort by source, label id then time bucket id."""
+        sources = np.array([2, 1, 1, 1])
+        label_ids = np.array([0, 5, 5, 0])
+        time_bucket_ids = np.array([1, 3, 2, 100])
+
+        keys = pack_bucket_keys(sources, label_ids, time_bucket_ids)
+
+        for unpacked, expected in zip(
+            unpack_bucket_keys(keys), [sources, label_ids, time_bucket_ids]
+        ):
+            self.assertEqual(unpacked.tolist(), expected.tolist())
+        self.assertEqual(np.argsort(keys).tolist(), [3, 2, 1, 0])
+
+    def test_drops_unpackable_buckets(self):
+        """Tests that buckets with out of range ids are dropped rather than aliasing other buckets."""
+        index = CompressedMinerIndex(
+            sources={
+                int(DataSource.REDDIT): [
+                    CompressedEntityBucket(
+                        label="label_1",
+                        time_bucket_ids=[1, 1 << 40, -1],
+                        sizes_bytes=[10, 20, 30],
+                    )
+                ]
+            }
+        )
+        self.test_storage.upsert_compressed_miner_index(index, "hotkey1", 1)
+
+        scored_index = self.test_storage.read_miner_index("hotkey1")
+        self.assertEqual(
+            [
+                bucket.time_bucket_id
+                for bucket in scored_index.scorable_data_entity_buckets
+            ],
+            [1],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,8 @@
 from collections import defaultdict
 import contextlib
+import os
 import random
+import tempfile
 import time
 from typing import Dict, List
 import unittest
@@ -20,7 +22,11 @@ from common.data import (
     TimeBucket,
 )
 import datetime as dt
-from common.data_v2 import ScorableDataEntityBucket, ScorableMinerIndex
+from common.data_v2 import (
+    ScorableBuckets,
+    ScorableDataEntityBucket,
+    ScorableMinerIndex,
+)
 from storage.validator.sqlite_memory_validator_storage import (
     SqliteMemoryValidatorStorage,
 )
@@ -513,6 +519,162 @@ class TestSqliteMemoryValidatorStorage(unittest.TestCase):
         # Confirm the scored_index is None.
         self.assertEqual(scored_index, None)
 
+    def test_read_scorable_buckets(self):
+        """Tests that a miner's scorable buckets are scored the same as its scorable index."""
+        # The storage is shared in memory across tests, so remove the miners afterwards.
+        for hotkey in ["hotkey1", "hotkey2", "hotkey3"]:
+            self.addCleanup(self.test_storage.delete_miner, hotkey)
+
+        self.test_storage.upsert_compressed_miner_index(
+            CompressedMinerIndex(
+                sources={
+                    DataSource.REDDIT.value: [
+                        CompressedEntityBucket(
+                            label="label_1",
+                            time_bucket_ids=[5, 6],
+                            sizes_bytes=[100, 200],
+                        ),
+                        CompressedEntityBucket(
+                            label=None, time_bucket_ids=[5], sizes_bytes=[50]
+                        ),
+                    ]
+                }
+            ),
+            "hotkey1",
+            1.0,
+        )
+        self.test_storage.upsert_compressed_miner_index(
+            CompressedMinerIndex(
+                sources={
+                    DataSource.REDDIT.value: [
+                        CompressedEntityBucket(
+                            label="label_1", time_bucket_ids=[6], sizes_bytes=[300]
+                        )
+                    ],
+                    DataSource.X.value: [
+                        CompressedEntityBucket(
+                            label="label_2", time_bucket_ids=[7], sizes_bytes=[400]
+                        )
+                    ],
+                }
+            ),
+            "hotkey2",
+            0.5,
+        )
+        self.test_storage.upsert_compressed_miner_index(
+            CompressedMinerIndex(sources={}), "hotkey3", 0.5
+        )
+
+        def buckets(index: ScorableMinerIndex):
+            return sorted(
+                (
+                    int(bucket.source),
+                    bucket.label or "",
+                    bucket.time_bucket_id,
+                    bucket.scorable_bytes,
+                )
+                for bucket in index.scorable_data_entity_buckets
+            )
+
+        def columns(scorable_buckets: ScorableBuckets):
+            return sorted(
+                (source, scorable_buckets.labels[label_id] or "", time_bucket_id, size)
+                for source, label_id, time_bucket_id, size in zip(
+                    scorable_buckets.sources.tolist(),
+                    scorable_buckets.label_ids.tolist(),
+                    scorable_buckets.time_bucket_ids.tolist(),
+                    scorable_buckets.scorable_bytes.tolist(),
+                )
+            )
+
+        for hotkey in ["hotkey1", "hotkey2", "hotkey3"]:
+            self.assertEqual(
+                columns(self.test_storage.read_scorable_buckets(hotkey)),
+                buckets(self.test_storage.read_miner_index(hotkey)),
+                hotkey,
+            )
+        self.assertEqual(
+            columns(self.test_storage.read_scorable_buckets("hotkey2")),
+            [
+                (int(DataSource.REDDIT), "label_1", 6, 128),
+                (int(DataSource.X), "label_2", 7, 400),
+            ],
+        )
+        self.assertEqual(
+            len(self.test_storage.read_scorable_buckets("hotkey3").scorable_bytes), 0
+        )
+        self.assertIsNone(self.test_storage.read_scorable_buckets("hotkey4"))
+
+    def test_snapshot_round_trip(self):
+        """Tests that loading a snapshot restores the miners, their indexes and the labels at the time it was taken."""
+        rng = random.Random(0)
+
+        def create_index(labels: List[str]) -> CompressedMinerIndex:
+            return CompressedMinerIndex(
+                sources={
+                    DataSource.REDDIT.value: [
+                        CompressedEntityBucket(
+                            label=label,
+                            time_bucket_ids=[5, 6, 7],
+                            sizes_bytes=[rng.randint(1, 1000) for _ in range(3)],
+                        )
+                        for label in labels
+                    ]
+                }
+            )
+
+        self.test_storage.upsert_compressed_miner_index(
+            create_index(["label_1", "label_2"]), "snapshot_hotkey1", 1.0
+        )
+        self.test_storage.upsert_compressed_miner_index(
+            create_index(["label_2", "label_3"]), "snapshot_hotkey2", 0.5
+        )
+        scored_indexes = {
+            hotkey: self.test_storage.read_miner_index(hotkey)
+            for hotkey in ["snapshot_hotkey1", "snapshot_hotkey2"]
+        }
+
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        path = os.path.join(temp_dir.name, "validator_storage.snapshot")
+        self.test_storage.save_snapshot(path)
+
+        # Change the storage after the snapshot was taken.
+        self.test_storage.delete_miner("snapshot_hotkey1")
+        self.test_storage.upsert_compressed_miner_index(
+            create_index(["label_4"]), "snapshot_hotkey3", 1.0
+        )
+
+        self.test_storage.load_snapshot(path)
+
+        self.assertEqual(
+            self.test_storage.read_miner_index("snapshot_hotkey1"),
+            scored_indexes["snapshot_hotkey1"],
+        )
+        self.assertEqual(
+            self.test_storage.read_miner_index("snapshot_hotkey2"),
+            scored_indexes["snapshot_hotkey2"],
+        )
+        self.assertIsNone(self.test_storage.read_miner_index("snapshot_hotkey3"))
+
+        # New labels must not reuse the ids of labels in the snapshot.
+        self.test_storage.upsert_compressed_miner_index(
+            create_index(["label_1", "label_5"]), "snapshot_hotkey3", 1.0
+        )
+        self.assertEqual(
+            sorted(
+                bucket.label
+                for bucket in self.test_storage.read_miner_index(
+                    "snapshot_hotkey3"
+                ).scorable_data_entity_buckets
+            ),
+            ["label_1"] * 3 + ["label_5"] * 3,
+        )
+        self.assertEqual(
+            self.test_storage.read_miner_index("snapshot_hotkey2"),
+            scored_indexes["snapshot_hotkey2"],
+        )
+
     def test_delete_miner(self):
         """Tests that we can delete a miner."""
         # Create two DataEntityBuckets for the indexes.
@@ -551,6 +713,166 @@ class TestSqliteMemoryValidatorStorage(unittest.TestCase):
         self.assertIsNone(self.test_storage.read_miner_index("hotkey2"))
         self.assertIsNotNone(self.test_storage.read_miner_index("hotkey3"))
 
+    def test_bucket_totals_maintained(self):
+        """Tests that the bucket totals match the miner indexes after upserts, credibility changes and deletes."""
+        now = dt.datetime.utcnow()
+
+        def create_index(hotkey: str, sizes: List[int]) -> MinerIndex:
+            return MinerIndex(
+                hotkey=hotkey,
+                data_entity_buckets=[
+                    DataEntityBucket(
+                        id=DataEntityBucketId(
+                            time_bucket=TimeBucket.from_datetime(now),
+                            source=DataSource.REDDIT,
+                            label=DataLabel(value=f"totals_label_{i}"),
+                        ),
+                        size_bytes=size,
+                    )
+                    for i, size in enumerate(sizes)
+                ],
+            )
+
+        self.test_storage.upsert_miner_index(create_index("hotkey1", [10, 20]), 1)
+        self.test_storage.upsert_miner_index(create_index("hotkey2", [30, 40, 50]), 0.5)
+        # Change a credibility and the buckets served.
+        self.test_storage.upsert_miner_index(create_index("hotkey1", [60]), 0.25)
+        self.test_storage.upsert_compressed_miner_index(
+            CompressedMinerIndex(
+                sources={
+                    int(DataSource.REDDIT): [
+                        CompressedEntityBucket(
+                            label="totals_label_1",
+                            time_bucket_ids=[TimeBucket.from_datetime(now).id],
+                            sizes_bytes=[70],
+                        )
+                    ]
+                }
+            ),
+            "hotkey3",
+            0.75,
+        )
+        self.test_storage.delete_miner("hotkey2")
+
+        with contextlib.closing(self.test_storage._create_connection()) as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                """SELECT source, labelId, timeBucketId, totalAdjContentSizeBytes, minerCount
+                    FROM BucketTotal ORDER BY source, labelId, timeBucketId"""
+            )
+            totals = cursor.fetchall()
+            cursor.execute(
+                """SELECT source, labelId, timeBucketId, SUM(contentSizeBytes * credibility), COUNT(*)
+                    FROM MinerIndex JOIN Miner USING (minerId)
+                    GROUP BY source, labelId, timeBucketId
+                    ORDER BY source, labelId, timeBucketId"""
+            )
+            expected_totals = cursor.fetchall()
+
+        self.assertEqual(len(totals), len(expected_totals))
+        for total, expected_total in zip(totals, expected_totals):
+            self.assertEqual(total[:3], expected_total[:3])
+            self.assertAlmostEqual(total[3], expected_total[3])
+            self.assertEqual(total[4], expected_total[4])
+
+        # hotkey1 serves 60 bytes of label_0 alone and hotkey3 serves 70 bytes of label_1 alone.
+        self.assertEqual(
+            [
+                (bucket.label, bucket.scorable_bytes)
+                for bucket in self.test_storage.read_miner_index(
+                    "hotkey1"
+                ).scorable_data_entity_buckets
+            ],
+            [("totals_label_0", 60)],
+        )
+        self.assertEqual(
+            [
+                (bucket.label, bucket.scorable_bytes)
+                for bucket in self.test_storage.read_miner_index(
+                    "hotkey3"
+                ).scorable_data_entity_buckets
+            ],
+            [("totals_label_1", 70)],
+        )
+
+    def _create_diff_indexes(self):
+        """Returns a miner index, and a second with one bucket removed, one resized, one added and the rest unchanged."""
+        now = dt.datetime.utcnow()
+
+        def create_index(sizes: Dict[str, int]) -> MinerIndex:
+            return MinerIndex(
+                hotkey="hotkey1",
+                data_entity_buckets=[
+                    DataEntityBucket(
+                        id=DataEntityBucketId(
+                            time_bucket=TimeBucket.from_datetime(now),
+                            source=DataSource.REDDIT,
+                            label=DataLabel(value=label),
+                        ),
+                        size_bytes=size,
+                    )
+                    for label, size in sizes.items()
+                ],
+            )
+
+        return (
+            create_index({"diff_1": 10, "diff_2": 20, "diff_3": 30, "diff_4": 40}),
+            create_index({"diff_2": 20, "diff_3": 35, "diff_4": 40, "diff_5": 50}),
+        )
+
+    def test_upsert_miner_index_diff(self):
+        """Tests that upserting a changed index stores exactly the new index."""
+        index_1, index_2 = self._create_diff_indexes()
+        self.test_storage.upsert_miner_index(index_1, 1)
+        self.test_storage.upsert_miner_index(index_2, 1)
+
+        scored_index = self.test_storage.read_miner_index("hotkey1")
+        self.assertEqual(
+            sorted(
+                (bucket.label, bucket.size_bytes, bucket.scorable_bytes)
+                for bucket in scored_index.scorable_data_entity_buckets
+            ),
+            [
+                ("diff_2", 20, 20),
+                ("diff_3", 35, 35),
+                ("diff_4", 40, 40),
+                ("diff_5", 50, 50),
+            ],
+        )
+
+    def test_upsert_miner_index_writes_only_diff(self):
+        """Tests that upserting a changed index only writes the added, removed and resized buckets."""
+        index_1, index_2 = self._create_diff_indexes()
+        self.test_storage.upsert_miner_index(index_1, 1)
+
+        # Count the writes to MinerIndex. The in-memory database is shared, so clean the triggers up afterwards.
+        with contextlib.closing(self.test_storage._create_connection()) as connection:
+            connection.execute("CREATE TABLE WriteCount (operation TEXT)")
+            for operation in ["INSERT", "UPDATE", "DELETE"]:
+                connection.execute(
+                    f"""CREATE TRIGGER count_{operation.lower()} AFTER {operation} ON MinerIndex
+                        BEGIN INSERT INTO WriteCount VALUES ('{operation}'); END"""
+                )
+
+        def drop_write_count():
+            with contextlib.closing(
+                self.test_storage._create_connection()
+            ) as connection:
+                for operation in ["insert", "update", "delete"]:
+                    connection.execute(f"DROP TRIGGER count_{operation}")
+                connection.execute("DROP TABLE WriteCount")
+
+        self.addCleanup(drop_write_count)
+
+        self.test_storage.upsert_miner_index(index_2, 1)
+
+        with contextlib.closing(self.test_storage._create_connection()) as connection:
+            cursor = connection.cursor()
+            cursor.execute("SELECT operation FROM WriteCount ORDER BY operation")
+            self.assertEqual(
+                [row[0] for row in cursor.fetchall()], ["DELETE", "INSERT", "UPDATE"]
+            )
+
     def test_read_miner_last_updated(self):
         """Tests getting the last time a miner was updated."""
         # Insert a miner
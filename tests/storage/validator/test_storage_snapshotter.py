@@ -0,0 +1,81 @@
+import datetime as dt
+import os
+import tempfile
+import unittest
+
+from common.data import CompressedEntityBucket, CompressedMinerIndex, DataSource
+from storage.validator.numpy_validator_storage import NumpyValidatorStorage
+from storage.validator.storage_snapshotter import StorageSnapshotter
+
+
+class TestStorageSnapshotter(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.path = os.path.join(temp_dir.name, "validator_storage.snapshot")
+
+        self.test_storage = NumpyValidatorStorage()
+        self.test_storage.upsert_compressed_miner_index(
+            CompressedMinerIndex(
+                sources={
+                    DataSource.REDDIT.value: [
+                        CompressedEntityBucket(
+                            label="label_1",
+                            time_bucket_ids=[5, 6],
+                            sizes_bytes=[100, 200],
+                        )
+                    ]
+                }
+            ),
+            "hotkey1",
+            1.0,
+        )
+        self.snapshotter = StorageSnapshotter(
+            storage=self.test_storage,
+            path=self.path,
+            snapshot_interval=dt.timedelta(minutes=1),
+        )
+
+    def test_snapshot_and_load(self):
+        """Tests that a snapshot can be loaded into a new storage and reports its metrics."""
+        self.snapshotter.snapshot()
+
+        metrics = self.snapshotter.get_metrics()
+        self.assertEqual(metrics.snapshots, 1)
+        self.assertEqual(metrics.last_snapshot_bytes, os.path.getsize(self.path))
+        self.assertIsNotNone(metrics.last_snapshot_latency)
+
+        loaded_storage = NumpyValidatorStorage()
+        self.assertTrue(
+            StorageSnapshotter(
+                loaded_storage, self.path, dt.timedelta(minutes=1)
+            ).load()
+        )
+        self.assertEqual(
+            loaded_storage.read_miner_index("hotkey1"),
+            self.test_storage.read_miner_index("hotkey1"),
+        )
+
+    def test_load_missing_or_invalid_snapshot(self):
+        """Tests that a missing or invalid snapshot leaves the storage unchanged."""
+        self.assertFalse(self.snapshotter.load())
+
+        with open(self.path, "wb") as file:
+            file.write(b"not a snapshot")
+        self.assertFalse(self.snapshotter.load())
+
+        self.assertIsNotNone(self.test_storage.read_miner_index("hotkey1"))
+
+    def test_run_in_background_thread(self):
+        """Tests that the snapshotter waits an interval before snapshotting and stops when asked."""
+        self.snapshotter.run_in_background_thread()
+        self.snapshotter.stop()
+        self.snapshotter.thread.join(timeout=5)
+
+        self.assertFalse(self.snapshotter.thread.is_alive())
+        self.assertEqual(self.snapshotter.get_metrics().snapshots, 0)
+        self.assertFalse(os.path.exists(self.path))
+
+
+if __name__ == "__main__":
+    unittest.main()